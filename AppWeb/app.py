@@ -1,30 +1,166 @@
 import os
-from flask import Flask, request, jsonify, render_template, send_from_directory
+import time
+import threading
+from flask import Flask, request, jsonify, render_template, send_from_directory, stream_with_context
 from werkzeug.utils import secure_filename
-from PIL import Image
+from werkzeug.security import safe_join
+import numpy as np
 import torch
 import torch.nn as nn
-from torchvision import transforms
-from torchvision.models import resnet50
-from datetime import datetime, timedelta
+from torchvision.models import resnet50, resnet101
+from datetime import datetime
 import json
-from collections import defaultdict
 import csv
 import io
+import base64
+from batching_module import MicroBatcher
+from storage_module import BackgroundWriter, StorageManager
+from preprocessing_module import INPUT_SIZE, decode_image, tensor_from_pixels, transform as preprocess_transform
+from cache_module import ContentCache, hash_bytes, hash_file
+from jobs_module import JobManager, QueueFullError
+from inference_module import artifact_path_for, build_backend, configure_threads
+from stats_module import StatsCollector
+
+# WebSocket opcional para la cámara (pip install flask-sock)
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+from results_module import COLUMNAR_FORMATS, ResultsStore, iter_columnar_export
+from metrics_module import OPENMETRICS_CONTENT_TYPE, SharedMetrics, render_openmetrics, stage_timer
+from ingest_module import IngestManager, IngestSync
+from registry_module import ModelRegistry, ModelVersion, RegistrySync
+from temporal_module import TemporalTracker
+from tiling_module import AGGREGATIONS, aggregate as aggregate_tiles, build_views, min_views_for_tiles
+from json_module import install_json_provider
 
 # --- Configuración Inicial ---
 # Usar ruta absoluta para evitar problemas
 # Aquí se definen las carpetas donde se guardarán imágenes subidas
 # y las salidas de Grad-CAM, además de los formatos de archivo permitidos.
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
-GRADCAM_FOLDER = os.path.join(BASE_DIR, 'gradcam_outputs')
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', os.path.join(BASE_DIR, 'uploads'))
+GRADCAM_FOLDER = os.environ.get('GRADCAM_FOLDER', os.path.join(BASE_DIR, 'gradcam_outputs'))
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'webp'}
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['GRADCAM_FOLDER'] = GRADCAM_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = None  # Sin límite de tamaño
+# Número máximo de imágenes por forward pass en /classify.
+# Acota la memoria usada por cada lote (N x 3 x 224 x 224).
+app.config['MAX_BATCH_SIZE'] = int(os.environ.get('MAX_BATCH_SIZE', 16))
+# Modo por teselas de /classify (mode=tiled): presupuesto de entradas del
+# forward pass por imagen (teselas + vista completa + volteos), solape entre
+# teselas de 224 px, agregación de las salidas (max o mean) y volteos por defecto.
+app.config['TILING_MAX_VIEWS'] = int(os.environ.get('TILING_MAX_VIEWS', 16))
+app.config['TILING_OVERLAP'] = float(os.environ.get('TILING_OVERLAP', 0.25))
+app.config['TILING_AGGREGATION'] = os.environ.get('TILING_AGGREGATION', 'max')
+app.config['TILING_FLIPS'] = os.environ.get('TILING_FLIPS', '0') == '1'
+# Micro-batching de /classify/camera: los frames que llegan dentro de la
+# ventana (en ms) se agrupan en un único forward pass de hasta N frames.
+app.config['CAMERA_BATCH_WINDOW_MS'] = float(os.environ.get('CAMERA_BATCH_WINDOW_MS', 20))
+app.config['CAMERA_MAX_BATCH_SIZE'] = int(os.environ.get('CAMERA_MAX_BATCH_SIZE', 8))
+# Estado temporal de los streams de cámara que envían stream_id: un frame que
+# difiere menos de CAMERA_DIFF_THRESHOLD (0-255) del último inferido reutiliza
+# su resultado (como mucho CAMERA_MAX_REUSE_FRAMES seguidos), y las salidas se
+# suavizan con una EMA de peso CAMERA_EMA_ALPHA (1 = sin suavizado).
+app.config['CAMERA_DIFF_THRESHOLD'] = float(os.environ.get('CAMERA_DIFF_THRESHOLD', 3.0))
+app.config['CAMERA_EMA_ALPHA'] = float(os.environ.get('CAMERA_EMA_ALPHA', 0.3))
+app.config['CAMERA_MAX_REUSE_FRAMES'] = int(os.environ.get('CAMERA_MAX_REUSE_FRAMES', 30))
+app.config['CAMERA_STREAM_TTL_SECONDS'] = float(os.environ.get('CAMERA_STREAM_TTL_SECONDS', 300))
+# Con gunicorn gthread cada WebSocket de cámara ocupa un hilo del worker
+# durante toda la sesión. Como mucho CAMERA_WS_MAX_SESSIONS por proceso (por
+# defecto la mitad de WEB_THREADS); por encima se cierra la conexión y el
+# navegador sigue con POST /classify/camera/raw.
+app.config['CAMERA_WS_MAX_SESSIONS'] = int(os.environ.get('CAMERA_WS_MAX_SESSIONS',
+                                                          int(os.environ.get('WEB_THREADS', 4)) // 2))
+# Caché por contenido (hash de la imagen + huella del modelo) para
+# predicciones y heatmaps Grad-CAM. El nivel en disco es opcional.
+app.config['PREDICTION_CACHE_MAX_MB'] = float(os.environ.get('PREDICTION_CACHE_MAX_MB', 16))
+app.config['GRADCAM_CACHE_MAX_MB'] = float(os.environ.get('GRADCAM_CACHE_MAX_MB', 128))
+app.config['CACHE_DISK_FOLDER'] = os.environ.get('CACHE_DISK_FOLDER')  # None → sin nivel en disco
+app.config['CACHE_DISK_MAX_MB'] = float(os.environ.get('CACHE_DISK_MAX_MB', 1024))
+# Trabajos Grad-CAM asíncronos: hilos que los ejecutan a la vez y trabajos
+# que pueden esperar en cola antes de rechazar nuevos (HTTP 503).
+app.config['GRADCAM_MAX_WORKERS'] = int(os.environ.get('GRADCAM_MAX_WORKERS', 1))
+app.config['GRADCAM_MAX_PENDING_JOBS'] = int(os.environ.get('GRADCAM_MAX_PENDING_JOBS', 32))
+# Heatmaps Grad-CAM: lado mayor máximo en píxeles (0 = resolución original),
+# formato ('webp', 'jpeg' o 'png') y calidad de codificación (1-100).
+app.config['GRADCAM_MAX_SIZE'] = int(os.environ.get('GRADCAM_MAX_SIZE', 1024))
+app.config['GRADCAM_IMAGE_FORMAT'] = os.environ.get('GRADCAM_IMAGE_FORMAT', 'webp')
+app.config['GRADCAM_QUALITY'] = int(os.environ.get('GRADCAM_QUALITY', 85))
+# Backend de inferencia: 'eager', 'torchscript' (trazado y congelado) u 'onnx'
+# (ONNX Runtime). Los modelos exportados se guardan en MODEL_EXPORT_FOLDER.
+# INTRA_OP_THREADS = 0 deja el número de hilos por defecto de PyTorch/ORT.
+app.config['INFERENCE_BACKEND'] = os.environ.get('INFERENCE_BACKEND', 'eager')
+app.config['INTRA_OP_THREADS'] = int(os.environ.get('INTRA_OP_THREADS', 0))
+app.config['CHANNELS_LAST'] = os.environ.get('CHANNELS_LAST', '1') == '1'
+app.config['MODEL_EXPORT_FOLDER'] = os.environ.get('MODEL_EXPORT_FOLDER', os.path.join(BASE_DIR, 'exported_models'))
+# Variante cuantizada INT8 (solo CPU): '' (desactivada) o 'static'.
+# La cuantización estática se calibra con imágenes de QUANTIZATION_CALIBRATION_DIR.
+app.config['QUANTIZATION'] = os.environ.get('QUANTIZATION', '')
+app.config['QUANTIZATION_CALIBRATION_DIR'] = os.environ.get('QUANTIZATION_CALIBRATION_DIR', os.path.join(BASE_DIR, 'test images'))
+app.config['QUANTIZATION_CALIBRATION_SIZE'] = int(os.environ.get('QUANTIZATION_CALIBRATION_SIZE', 64))
+# Si no se encuentra best_resnet_multilabel_v5.pt, ALLOW_RANDOM_WEIGHTS=1 arranca
+# con pesos aleatorios (semilla fija) en lugar de fallar. Solo para benchmarks
+# y pruebas de carga: las predicciones no tienen sentido.
+app.config['ALLOW_RANDOM_WEIGHTS'] = os.environ.get('ALLOW_RANDOM_WEIGHTS', '0') == '1'
+# Registro de modelos: los checkpoints adicionales (/api/models) se buscan en
+# MODEL_FOLDER. MODEL_CANDIDATE carga al arrancar una versión candidata que
+# recibe MODEL_CANDIDATE_PERCENT % del tráfico y todo el de las cámaras de
+# MODEL_CANDIDATE_CAMERAS (ids separados por comas). Los cambios hechos por
+# /api/models* se guardan en MODEL_REGISTRY_STATE y todos los workers los
+# aplican (cada uno consulta el archivo cada MODEL_SYNC_INTERVAL_SECONDS).
+app.config['MODEL_FOLDER'] = os.environ.get('MODEL_FOLDER', BASE_DIR)
+app.config['MODEL_REGISTRY_STATE'] = os.environ.get('MODEL_REGISTRY_STATE', os.path.join(BASE_DIR, 'model_registry.json'))
+app.config['MODEL_SYNC_INTERVAL_SECONDS'] = float(os.environ.get('MODEL_SYNC_INTERVAL_SECONDS', 2))
+app.config['MODEL_CANDIDATE'] = os.environ.get('MODEL_CANDIDATE', '')
+app.config['MODEL_CANDIDATE_PERCENT'] = float(os.environ.get('MODEL_CANDIDATE_PERCENT', 0))
+app.config['MODEL_CANDIDATE_CAMERAS'] = [c for c in os.environ.get('MODEL_CANDIDATE_CAMERAS', '').split(',') if c]
+# Retención de uploads y gradcam_outputs: cada petición usa su propia
+# subcarpeta y un hilo de fondo elimina las que superan la antigüedad máxima
+# o, si se supera la cuota total, las menos usadas recientemente.
+app.config['STORAGE_MAX_AGE_HOURS'] = float(os.environ.get('STORAGE_MAX_AGE_HOURS', 24))
+app.config['STORAGE_MAX_MB'] = float(os.environ.get('STORAGE_MAX_MB', 1024))
+app.config['STORAGE_SWEEP_INTERVAL_SECONDS'] = float(os.environ.get('STORAGE_SWEEP_INTERVAL_SECONDS', 60))
+# Segundos que /uploads y Grad-CAM esperan a que aparezca una imagen que aún
+# guarda otro worker (la escritura a disco va en segundo plano).
+app.config['UPLOAD_WAIT_SECONDS'] = float(os.environ.get('UPLOAD_WAIT_SECONDS', 5))
+# Métricas de /metrics: cada worker vuelca sus histogramas en METRICS_DIR cada
+# METRICS_FLUSH_SECONDS y el scrape devuelve la suma de todos los workers.
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, '.metrics'))
+app.config['METRICS_FLUSH_SECONDS'] = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
+# Base de datos SQLite (modo WAL) donde se guarda el histórico de resultados.
+app.config['RESULTS_DB_PATH'] = os.environ.get('RESULTS_DB_PATH', os.path.join(BASE_DIR, 'results.db'))
+# Ingesta de vídeo en el servidor (/api/streams): frames muestreados por
+# segundo, umbral de diferencia (0-255) por debajo del cual un frame se
+# considera duplicado y se salta, y frames por forward pass. Los archivos de
+# vídeo solo se leen desde INGEST_VIDEO_FOLDER; las cámaras se indican por URL.
+app.config['INGEST_SAMPLE_FPS'] = float(os.environ.get('INGEST_SAMPLE_FPS', 1.0))
+app.config['INGEST_DIFF_THRESHOLD'] = float(os.environ.get('INGEST_DIFF_THRESHOLD', 4.0))
+app.config['INGEST_BATCH_SIZE'] = int(os.environ.get('INGEST_BATCH_SIZE', 8))
+app.config['INGEST_VIDEO_FOLDER'] = os.environ.get('INGEST_VIDEO_FOLDER', os.path.join(BASE_DIR, 'videos'))
+# Los streams pedidos se guardan en INGEST_STATE y los ingiere un único
+# proceso, que publica su estado cada INGEST_SYNC_INTERVAL_SECONDS.
+app.config['INGEST_STATE'] = os.environ.get('INGEST_STATE', os.path.join(BASE_DIR, 'ingest_streams.json'))
+app.config['INGEST_SYNC_INTERVAL_SECONDS'] = float(os.environ.get('INGEST_SYNC_INTERVAL_SECONDS', 1))
+# Serialización JSON con orjson (si está instalado) en lugar del módulo json;
+# FAST_JSON=0 vuelve al codificador de Flask.
+app.config['FAST_JSON'] = os.environ.get('FAST_JSON', '1') == '1'
+# Camino ASGI (asgi.py): las subidas de /classify se reciben en el event
+# loop y la clasificación se ejecuta en un pool de ASGI_INFERENCE_WORKERS
+# hilos con como mucho ASGI_MAX_PENDING peticiones en cola o en ejecución
+# (por encima, HTTP 503 con Retry-After). ASGI_MAX_UPLOADS limita las subidas
+# recibiéndose a la vez (por encima, HTTP 429) y ASGI_WSGI_THREADS los hilos
+# que atienden el resto de rutas de Flask.
+app.config['ASGI_INFERENCE_WORKERS'] = int(os.environ.get('ASGI_INFERENCE_WORKERS', 1))
+app.config['ASGI_MAX_PENDING'] = int(os.environ.get('ASGI_MAX_PENDING', 8))
+app.config['ASGI_MAX_UPLOADS'] = int(os.environ.get('ASGI_MAX_UPLOADS', 64))
+app.config['ASGI_WSGI_THREADS'] = int(os.environ.get('ASGI_WSGI_THREADS', 8))
+
+json_encoder = install_json_provider(app, app.config['FAST_JSON'])
+print(f"Codificador JSON: {json_encoder}")
 
 # Crear la carpeta de subidas si no existe
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -62,266 +198,566 @@ CLASS_COLORS = {
     'basura_general': '#e74c3c'  # rojo basura
 }
 
+# Metadatos de presentación precalculados por índice de clase (mismo orden que
+# CLASS_NAMES), para no repetir las búsquedas en los diccionarios anteriores
+# en cada resultado. Se fusionan tal cual en las respuestas.
+CLASS_INDEX = {name: i for i, name in enumerate(CLASS_NAMES)}
+CLASS_METADATA = [
+    {
+        'predicted_class': name,
+        'display_name': CLASS_DISPLAY_NAMES.get(name, name.capitalize()),
+        'emoji': CLASS_EMOJIS.get(name, '📦'),
+        'color': CLASS_COLORS.get(name, '#34495e')
+    }
+    for name in CLASS_NAMES
+]
+
 # --- Carga del Modelo ---
 # Se usan variables globales para mantener cargado el modelo, el dispositivo
 # (CPU o GPU) y las transformaciones de preprocesamiento de imágenes.
+# Las versiones del modelo viven en model_registry (ver registry_module);
+# `model`, `inference_backend` y `model_fingerprint` reflejan siempre la
+# versión activa: `model` es el modelo eager (lo usa Grad-CAM) y las
+# predicciones pasan por el backend de la versión que enruta el registro.
+MODEL_FILENAME = "best_resnet_multilabel_v5.pt"
+MODEL_ARCHITECTURES = {'resnet50': resnet50, 'resnet101': resnet101}
 model = None
 device = None
 transform = None
+model_fingerprint = None   # hash de los pesos, forma parte de las claves de caché
+inference_backend = None
+
+def build_classifier(architecture='resnet50'):
+    """Red sin pesos con la capa fully-connected reemplazada para clasificación multietiqueta."""
+    net = MODEL_ARCHITECTURES[architecture](weights=None)
+    num_features = net.fc.in_features
+    net.fc = nn.Sequential(
+        nn.Linear(num_features, len(CLASS_NAMES)),
+        nn.Sigmoid()  # salida en [0,1] para probabilidades
+    )
+    return net
+
+def load_model_version(name, model_path, backend=None, quantization=None, architecture='resnet50', allow_random=False):
+    """Carga los pesos de un checkpoint y construye su backend de inferencia, sin publicarlo."""
+    random_weights = not os.path.exists(model_path)
+    if random_weights and not allow_random:
+        raise FileNotFoundError(f"No se encontró el archivo {os.path.basename(model_path)} en {model_path}")
+
+    # Cargar modelo
+    if random_weights:
+        torch.manual_seed(0)
+    net = build_classifier(architecture)
+
+    # Cargar pesos entrenados
+    if random_weights:
+        print(f"⚠️ No se encontró {os.path.basename(model_path)}: usando pesos aleatorios (ALLOW_RANDOM_WEIGHTS=1)")
+        model_path = 'pesos aleatorios'
+        fingerprint = 'random-seed0'
+    else:
+        net.load_state_dict(torch.load(model_path, map_location=device))
+        fingerprint = hash_file(model_path)[:16]
+    net = net.to(device)
+    net.eval()
 
-def load_model():
+    # Backend de inferencia construido a partir del mismo state dict
+    version_backend = build_inference_backend(backend, quantization, net, fingerprint, name)
+    return ModelVersion(name, model_path, net, version_backend, fingerprint, device, architecture)
+
+def activate_model_version(version):
+    """Refleja la versión activa en las variables globales."""
+    global model, model_fingerprint, inference_backend
+    model, model_fingerprint, inference_backend = version.model, version.fingerprint, version.backend
+
+model_registry = ModelRegistry(load_model_version, on_activate=activate_model_version)
+
+def model_file_path(filename):
+    """Ruta de un checkpoint dentro de MODEL_FOLDER (o la carpeta padre); None si no existe o sale de ellas."""
+    for folder in (app.config['MODEL_FOLDER'], os.path.dirname(BASE_DIR)):
+        path = safe_join(folder, filename)
+        if path and os.path.isfile(path):
+            return path
+    return None
+
+# Estado deseado del registro, compartido por todos los workers
+registry_sync = RegistrySync(model_registry, app.config['MODEL_REGISTRY_STATE'], model_file_path,
+                             poll_interval=app.config['MODEL_SYNC_INTERVAL_SECONDS'])
+
+def load_model(backend=None, quantization=None):
     """Carga el modelo ResNet50 pre-entrenado una sola vez."""
     # Intenta cargar desde la carpeta actual o la carpeta padre.
     # Reemplaza la capa fully-connected para clasificación multiclase.
-    global model, device, transform
+    # `backend` selecciona el backend de inferencia (por defecto, INFERENCE_BACKEND)
+    # y `quantization` sirve en su lugar la variante INT8 (por defecto, QUANTIZATION).
+    # La versión cargada pasa a ser la activa del registro; si MODEL_CANDIDATE
+    # está configurado, se carga también la candidata y su reparto de tráfico.
+    global device, transform
     
     try:
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        num_threads = configure_threads(app.config['INTRA_OP_THREADS'])
         
         # Buscar el modelo en la carpeta padre o en la carpeta actual
-        nombre_archivo = "best_resnet_multilabel_v5.pt"
+        nombre_archivo = MODEL_FILENAME
         model_path = os.path.join(BASE_DIR, nombre_archivo)
         if not os.path.exists(model_path):
             model_path = os.path.join(os.path.dirname(BASE_DIR), nombre_archivo)
 
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"No se encontró el archivo {nombre_archivo} en {model_path}")
-
-        # Cargar modelo
-        model = resnet50(weights=None)
-        num_features = model.fc.in_features
-        model.fc = nn.Sequential(
-            nn.Linear(num_features, len(CLASS_NAMES)),
-            nn.Sigmoid()  # salida en [0,1] para probabilidades
-        )
+        version = load_model_version(os.path.splitext(nombre_archivo)[0], model_path, backend, quantization,
+                                     allow_random=app.config['ALLOW_RANDOM_WEIGHTS'])
+        model_registry.add(version, activate=True)
         
-        # Cargar pesos entrenados
-        model.load_state_dict(torch.load(model_path, map_location=device))
-        model = model.to(device)
-        model.eval()
-        
-        # Transformaciones estándar de ResNet (224x224 + normalización)
-        transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
+        # Transformaciones estándar de ResNet (224x224 + normalización),
+        # compartidas con Grad-CAM a través de preprocessing_module
+        transform = preprocess_transform
         
-        print(f"Modelo cargado exitosamente desde {model_path} en {device}")
+        print(f"Modelo cargado exitosamente desde {version.path} en {device} "
+              f"(backend: {inference_backend.name}, hilos: {num_threads})")
+
+        candidate = app.config['MODEL_CANDIDATE']
+        if candidate:
+            candidate_path = model_file_path(candidate)
+            if candidate_path is None:
+                raise FileNotFoundError(f"No se encontró el modelo candidato {candidate} en {app.config['MODEL_FOLDER']}")
+            candidate_name = os.path.splitext(os.path.basename(candidate))[0]
+            model_registry.load(candidate_name, candidate_path, background=False, backend=backend, quantization=quantization)
+            model_registry.set_routing(candidate_name, app.config['MODEL_CANDIDATE_PERCENT'],
+                                       app.config['MODEL_CANDIDATE_CAMERAS'])
+            print(f"Modelo candidato {candidate_name}: {model_registry.routing()}")
+
+        # Cambios hechos por /api/models* antes de este arranque (en el proceso
+        # maestro de gunicorn, antes del fork, para que los workers compartan los pesos)
+        if not registry_sync.apply(background=False):
+            print("⚠️ El estado guardado del registro de modelos no se pudo aplicar por completo")
         
     except Exception as e:
         print(f"Error cargando el modelo: {e}")
         raise
 
-def predict_image(image_path):
+def build_inference_backend(backend=None, quantization=None, target_model=None, fingerprint=None, model_name=None):
+    """Construye el backend de inferencia (o la variante INT8) sobre un modelo eager (por defecto, el activo)."""
+    target_model = target_model if target_model is not None else model
+    fingerprint = fingerprint or model_fingerprint
+    model_name = model_name or os.path.splitext(MODEL_FILENAME)[0]
+    quantization = quantization if quantization is not None else app.config['QUANTIZATION']
+    if quantization:
+        from quantization_module import QUANTIZATION_MODES, build_quantized_backend, calibrated_artifact_path
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Modo de cuantización desconocido: {quantization} (opciones: {', '.join(QUANTIZATION_MODES)})")
+        calibration_dir = app.config['QUANTIZATION_CALIBRATION_DIR']
+        calibration_size = app.config['QUANTIZATION_CALIBRATION_SIZE']
+        artifact_path = artifact_path_for(app.config['MODEL_EXPORT_FOLDER'], model_name, fingerprint, f"int8-{quantization}")
+        return build_quantized_backend(
+            target_model, quantization,
+            artifact_path=calibrated_artifact_path(artifact_path, calibration_dir, calibration_size),
+            calibration_dir=calibration_dir,
+            calibration_size=calibration_size
+        )
+
+    return build_backend(
+        backend or app.config['INFERENCE_BACKEND'], target_model, device,
+        export_folder=app.config['MODEL_EXPORT_FOLDER'],
+        model_name=model_name,
+        fingerprint=fingerprint,
+        intra_op_threads=app.config['INTRA_OP_THREADS'],
+        channels_last=app.config['CHANNELS_LAST']
+    )
+
+def build_detailed_probs(all_probs):
+    """Construye la lista de probabilidades por clase, ordenada de mayor a menor."""
+    # Orden con argsort sobre el array (estable: en caso de empate se respeta
+    # el orden de CLASS_NAMES) y conversión a float de Python en una sola
+    # llamada a tolist(), en lugar de float() y una búsqueda por clase.
+    all_probs = np.asarray(all_probs)
+    values = all_probs.tolist()
+    return [
+        {
+            'class_name': CLASS_NAMES[i],                       # identificador crudo
+            'display_name': CLASS_METADATA[i]['display_name'],  # nombre bonito
+            'probability': values[i] * 100
+        }
+        for i in (-all_probs).argsort(kind='stable').tolist()
+    ]
+
+def compact_probs(all_probs):
+    """Probabilidades (0-100) como lista en el orden fijo de CLASS_NAMES (modo compacto)."""
+    return [round(p * 100, 2) for p in np.asarray(all_probs).tolist()]
+
+_timestamp_labels = {}
+
+def timestamp_label(fmt="%Y-%m-%d %H:%M:%S"):
+    """datetime.now().strftime(fmt), formateado como mucho una vez por segundo."""
+    now = int(time.time())
+    cached = _timestamp_labels.get(fmt)
+    if cached is None or cached[0] != now:
+        cached = _timestamp_labels[fmt] = (now, datetime.fromtimestamp(now).strftime(fmt))
+    return cached[1]
+
+def _cache_folder(name):
+    """Subcarpeta del nivel en disco de la caché, o None si está desactivado."""
+    folder = app.config['CACHE_DISK_FOLDER']
+    return os.path.join(folder, name) if folder else None
+
+prediction_cache = ContentCache(
+    app.config['PREDICTION_CACHE_MAX_MB'],
+    disk_folder=_cache_folder('predictions'),
+    disk_max_mb=app.config['CACHE_DISK_MAX_MB'],
+    name='predictions'
+)
+gradcam_cache = ContentCache(
+    app.config['GRADCAM_CACHE_MAX_MB'],
+    disk_folder=_cache_folder('gradcam'),
+    disk_max_mb=app.config['CACHE_DISK_MAX_MB'],
+    name='gradcam'
+)
+
+def backend_cache_tag(backend):
+    """Identificador del backend en las claves de caché (las variantes INT8 incluyen su calibración)."""
+    return getattr(backend, 'cache_tag', backend.name)
+
+def content_cache_key(image_data, *extra, fingerprint=None, backend=None):
+    """Clave de caché: huella del modelo y backend (por defecto, los activos) + hash de la imagen (+ extras)."""
+    # El backend forma parte de la clave: una variante INT8 construida con los
+    # mismos pesos comparte la huella, pero no las salidas.
+    backend = backend or (backend_cache_tag(inference_backend) if inference_backend is not None else 'nobackend')
+    return '_'.join([fingerprint or model_fingerprint or 'nomodel', backend, hash_bytes(image_data)]
+                    + [str(e) for e in extra])
+
+def _read_image_bytes(image):
+    """Bytes de una imagen dada como bytes o ruta; None para imágenes PIL."""
+    if isinstance(image, (bytes, bytearray)):
+        return image
+    if isinstance(image, (str, os.PathLike)):
+        with stage_timer('classify', 'read'), open(image, 'rb') as f:
+            return f.read()
+    return None
+
+def predict_images(images, batch_size=None, version=None):
+    """Realiza predicciones por lotes sobre una lista de rutas, bytes o imágenes PIL."""
+    # Las imágenes se decodifican y apilan por bloques de batch_size, y cada
+    # bloque se procesa con una única llamada al backend de inferencia. Las imágenes ya
+    # vistas (mismo contenido y mismo modelo) se sirven desde prediction_cache
+    # sin pasar por el modelo.
+    # Devuelve una lista alineada con `images`; cada elemento es una tupla
+    # (predicted_class, confidence, detailed_probs) o (None, None, None) si
+    # la imagen no pudo procesarse.
+    # `version` es la versión del modelo (por defecto, la que elija model_registry.route()).
+    version = version or model_registry.route()
+    if version is None:
+        raise RuntimeError("El modelo no está cargado.")
+
+    batch_size = batch_size or app.config['MAX_BATCH_SIZE']
+    batch_size = max(1, min(batch_size, app.config['MAX_BATCH_SIZE']))
+    predictions = [(None, None, None)] * len(images)
+
+    def store_prediction(index, probs, processing_time):
+        pred_index = int(probs.argmax())
+        predicted_class = CLASS_NAMES[pred_index]
+        confidence_percent = float(probs[pred_index]) * 100
+
+        # Actualizar estadísticas (globales y de la versión del modelo)
+        update_stats(predicted_class, confidence_percent, processing_time)
+        version.stats.update(predicted_class, confidence_percent, processing_time)
+        predictions[index] = (predicted_class, confidence_percent, build_detailed_probs(probs))
+
+    for chunk_start in range(0, len(images), batch_size):
+        chunk = images[chunk_start:chunk_start + batch_size]
+        start_time = time.perf_counter()
+
+        # Consultar la caché, y decodificar y transformar el resto;
+        # las imágenes inválidas se descartan del lote
+        tensors = []
+        indices = []
+        cache_keys = []
+        for offset, image in enumerate(chunk):
+            index = chunk_start + offset
+            try:
+                lookup_start = time.perf_counter()
+                image_data = _read_image_bytes(image)
+                cache_key = content_cache_key(image_data, fingerprint=version.fingerprint,
+                                              backend=backend_cache_tag(version.backend)) if image_data is not None else None
+
+                cached_probs = prediction_cache.get(cache_key) if cache_key else None
+                if cached_probs is not None:
+                    store_prediction(index, cached_probs, time.perf_counter() - lookup_start)
+                    continue
+
+                with stage_timer('classify', 'decode'):
+                    decoded = decode_image(image_data if image_data is not None else image)
+                with stage_timer('classify', 'preprocess'):
+                    tensors.append(transform(decoded))
+                indices.append(index)
+                cache_keys.append(cache_key)
+            except Exception as e:
+                print(f"Error preparando la imagen {index + 1}/{len(images)}: {e}")
+
+        if not tensors:
+            continue
+
+        try:
+            with stage_timer('classify', 'to_device'):
+                batch = torch.stack(tensors).to(device)
+            with stage_timer('classify', 'forward'):
+                all_probs = version.backend(batch)   # salida ya está en [0,1] por Sigmoid
+        except Exception as e:
+            print(f"Error en la inferencia del lote: {e}")
+            continue
+
+        # El tiempo del lote se reparte entre sus imágenes
+        processing_time = (time.perf_counter() - start_time) / len(indices)
+
+        with stage_timer('classify', 'postprocess'):
+            for index, cache_key, probs in zip(indices, cache_keys, all_probs):
+                if cache_key:
+                    prediction_cache.put(cache_key, probs)
+                store_prediction(index, probs, processing_time)
+
+        print(f"Lote de {len(indices)} imágenes procesado - Tiempo por imagen: {processing_time:.3f}s")
+
+    return predictions
+
+def tiling_options(aggregation=None, flips=None, max_views=None):
+    """Opciones del modo por teselas, completadas con la configuración y acotadas por TILING_MAX_VIEWS."""
+    # max_views cuenta entradas del forward pass (vista completa + teselas, y
+    # el doble con volteos); un presupuesto que no deja sitio para teselas se
+    # rechaza en lugar de caer en silencio a la vista completa.
+    aggregation = aggregation or app.config['TILING_AGGREGATION']
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Agregación no soportada: {aggregation}")
+    flips = app.config['TILING_FLIPS'] if flips is None else bool(flips)
+    budget = app.config['TILING_MAX_VIEWS']
+    if max_views is not None and max_views < min_views_for_tiles(flips):
+        raise ValueError(f"max_views debe ser al menos {min_views_for_tiles(flips)}"
+                         f"{' con flips=1' if flips else ''} para usar teselas")
+    return {
+        'aggregation': aggregation,
+        'flips': flips,
+        'max_views': min(int(max_views), budget) if max_views else budget
+    }
+
+def predict_image_tiled(image, aggregation='max', flips=False, max_views=16, version=None):
+    """Predicción por teselas solapadas de una imagen (ruta o bytes) en un único forward pass."""
+    # Devuelve (predicted_class, confidence, detailed_probs, tile_map); ver
+    # tiling_module. La caché guarda las salidas de todas las vistas, así que
+    # cambiar solo la agregación no repite la inferencia.
+    version = version or model_registry.route()
+    if version is None:
+        raise RuntimeError("El modelo no está cargado.")
+
+    start_time = time.perf_counter()
+    image_data = _read_image_bytes(image)
+    overlap = app.config['TILING_OVERLAP']
+    cache_key = content_cache_key(image_data, 'tiled', max_views, overlap, int(flips),
+                                  fingerprint=version.fingerprint, backend=backend_cache_tag(version.backend))
+    cached = prediction_cache.get(cache_key)
+    if cached is not None:
+        view_probs, plan = cached
+    else:
+        with stage_timer('classify', 'tiling'):
+            views, plan = build_views(image_data, overlap=overlap, max_views=max_views, flips=flips)
+        with stage_timer('classify', 'to_device'):
+            views = views.to(device)
+        with stage_timer('classify', 'forward'):
+            view_probs = version.backend(views)   # salida ya está en [0,1] por Sigmoid
+        prediction_cache.put(cache_key, (view_probs, plan))
+
+    with stage_timer('classify', 'postprocess'):
+        probs, tile_map = aggregate_tiles(view_probs, plan, CLASS_NAMES, aggregation)
+        pred_index = int(probs.argmax())
+        predicted_class = CLASS_NAMES[pred_index]
+        confidence_percent = float(probs[pred_index]) * 100
+
+    processing_time = time.perf_counter() - start_time
+    update_stats(predicted_class, confidence_percent, processing_time)
+    version.stats.update(predicted_class, confidence_percent, processing_time)
+    print(f"Imagen procesada por teselas ({tile_map['rows']}x{tile_map['cols']}, "
+          f"{tile_map['views']} vistas) - Tiempo: {processing_time:.3f}s")
+    return predicted_class, confidence_percent, build_detailed_probs(probs), tile_map
+
+def predict_image(image_path, tiling=None):
     """Realiza una predicción sobre una única imagen."""
     # Devuelve:
     #   - predicted_class: nombre crudo de la clase más probable
     #   - confidence: probabilidad de la clase ganadora (0–100%)
     #   - detailed_probs: lista de todas las clases con sus probabilidades, ordenadas desc.
-    if not model:
-        raise RuntimeError("El modelo no está cargado.")
+    # Con `tiling` (opciones de tiling_options) se usa el modo por teselas y se
+    # devuelve además el mapa de clases por tesela como cuarto elemento.
+    print(f"Prediciendo imagen: {image_path}")
+    if tiling is not None:
+        try:
+            prediction = predict_image_tiled(image_path, **tiling)
+        except Exception as e:
+            print(f"Error prediciendo la imagen {image_path} por teselas: {e}")
+            return None, None, None, None
+        print(f"Predicción exitosa: {prediction[0]} ({prediction[1]:.1f}%)")
+        return prediction
 
-    try:
-        start_time = datetime.now()
-        print(f"Prediciendo imagen: {image_path}")
-        
-        # Verificar que el archivo existe antes de abrirlo
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"No se encontró la imagen: {image_path}")
-        
-        image = Image.open(image_path).convert('RGB')
-        img_t = transform(image).unsqueeze(0).to(device)
+    predicted_class, confidence_percent, detailed_probs = predict_images([image_path], batch_size=1)[0]
 
-        with torch.no_grad():
-            output = model(img_t)
-            probabilities = output
-            
-            # Obtener todas las probabilidades como array de numpy
-            all_probs = probabilities[0].cpu().numpy()
-            
-            # Obtener la mejor predicción
-            confidence, pred_index = torch.max(probabilities, 1)
-            
-            predicted_class = CLASS_NAMES[pred_index.item()]
-            confidence_percent = confidence.item() * 100
-            
-            # Calcular tiempo de procesamiento
-            processing_time = (datetime.now() - start_time).total_seconds()
-            
-            # Preparar todas las probabilidades para el frontend
-            detailed_probs = []
-            for i, prob in enumerate(all_probs):
-                detailed_probs.append({
-                    'class_name': CLASS_NAMES[i],  # identificador crudo
-                    'display_name': CLASS_DISPLAY_NAMES.get(CLASS_NAMES[i], CLASS_NAMES[i].capitalize()),  # nombre bonito
-                    'probability': float(prob) * 100
-                })
-            
-            # Ordenar por probabilidad descendente
-            detailed_probs.sort(key=lambda x: x['probability'], reverse=True)
-            
-            # Actualizar estadísticas
-            update_stats(predicted_class, confidence_percent, processing_time)
-            
-            print(f"Predicción exitosa: {predicted_class} ({confidence_percent:.1f}%) - Tiempo: {processing_time:.2f}s")
-            return predicted_class, confidence_percent, detailed_probs
+    if predicted_class is None:
+        print(f"Error prediciendo la imagen {image_path}")
+    else:
+        print(f"Predicción exitosa: {predicted_class} ({confidence_percent:.1f}%)")
+    return predicted_class, confidence_percent, detailed_probs
 
-    except Exception as e:
-        print(f"Error prediciendo la imagen {image_path}: {e}")
-        return None, None, None
+def run_camera_batch(items):
+    """Ejecuta un lote de frames de cámara ya transformados, agrupados por versión del modelo."""
+    # Usado por la cola de micro-batching: cada elemento es (versión, tensor) y
+    # se devuelve un array de probabilidades por frame, en el mismo orden.
+    groups = {}
+    for position, (version, _) in enumerate(items):
+        groups.setdefault(version.name, (version, []))[1].append(position)
 
-def allowed_file(filename):
-    """Verifica si la extensión del archivo es permitida."""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    results = [None] * len(items)
+    for version, positions in groups.values():
+        with stage_timer('camera', 'to_device'):
+            batch = torch.stack([items[i][1] for i in positions]).to(device)
+        with stage_timer('camera', 'forward'):
+            all_probs = version.backend(batch)   # salida ya está en [0,1] por Sigmoid
+        for position, probs in zip(positions, all_probs):
+            results[position] = probs
+    return results
 
-def clean_uploads_folder():
-    """Elimina todos los archivos de la carpeta uploads."""
-    # Usado antes de nuevas clasificaciones para no acumular basura.
-    try:
-        if os.path.exists(UPLOAD_FOLDER):
-            for filename in os.listdir(UPLOAD_FOLDER):
-                file_path = os.path.join(UPLOAD_FOLDER, filename)
-                try:
-                    if os.path.isfile(file_path):
-                        os.unlink(file_path)
-                        print(f"Archivo eliminado: {filename}")
-                except Exception as e:
-                    print(f"Error eliminando archivo {filename}: {e}")
-            print("Limpieza de carpeta uploads completada")
-        else:
-            print("La carpeta uploads no existe")
-    except Exception as e:
-        print(f"Error durante la limpieza de uploads: {e}")
+# Escritor en segundo plano para persistir las imágenes subidas
+upload_writer = BackgroundWriter(name='upload-writer', missing_wait=app.config['UPLOAD_WAIT_SECONDS'])
 
-def clean_gradcam_folder():
-    """Elimina todos los archivos de la carpeta gradcam_outputs."""
-    # Similar a clean_uploads_folder pero para Grad-CAM.
-    try:
-        if os.path.exists(GRADCAM_FOLDER):
-            for filename in os.listdir(GRADCAM_FOLDER):
-                file_path = os.path.join(GRADCAM_FOLDER, filename)
-                try:
-                    if os.path.isfile(file_path):
-                        os.unlink(file_path)
-                        print(f"Archivo eliminado: {filename}")
-                except Exception as e:
-                    print(f"Error eliminando archivo {filename}: {e}")
-            print("Limpieza de carpeta gradcam_outputs completada")
-        else:
-            print("La carpeta gradcam_outputs no existe")
-    except Exception as e:
-        print(f"Error durante la limpieza de gradcam_outputs: {e}")
+# Subcarpetas por petición en uploads y gradcam_outputs, con retención en segundo plano
+storage = StorageManager(
+    [UPLOAD_FOLDER, GRADCAM_FOLDER],
+    max_age_seconds=app.config['STORAGE_MAX_AGE_HOURS'] * 3600,
+    max_total_mb=app.config['STORAGE_MAX_MB'],
+    sweep_interval=app.config['STORAGE_SWEEP_INTERVAL_SECONDS']
+)
 
-def clean_old_files(hours=24):
-    """Elimina archivos más antiguos que el número de horas especificado."""
-    # Se ejecuta al inicio del servidor como medida de mantenimiento.
-    folders_to_clean = [UPLOAD_FOLDER, GRADCAM_FOLDER]
+# Cola de inferencia compartida por todos los flujos de cámara
+camera_batcher = MicroBatcher(
+    run_camera_batch,
+    max_batch_size=app.config['CAMERA_MAX_BATCH_SIZE'],
+    window_ms=app.config['CAMERA_BATCH_WINDOW_MS'],
+    name='camera-batcher'
+)
 
-    current_time = datetime.now()
-    cutoff_time = current_time - timedelta(hours=hours)
+# Reutilización de resultados y suavizado por stream de cámara
+camera_streams = TemporalTracker(
+    diff_threshold=app.config['CAMERA_DIFF_THRESHOLD'],
+    ema_alpha=app.config['CAMERA_EMA_ALPHA'],
+    max_reuse_frames=app.config['CAMERA_MAX_REUSE_FRAMES'],
+    ttl_seconds=app.config['CAMERA_STREAM_TTL_SECONDS']
+)
 
-    for folder in folders_to_clean:
-        try:
-            if not os.path.exists(folder):
-                continue
-            
-            for filename in os.listdir(folder):
-                file_path = os.path.join(folder, filename)
-                try:
-                    if os.path.isfile(file_path):
-                        file_time = datetime.fromtimestamp(os.path.getctime(file_path))
-                        if file_time < cutoff_time:
-                            os.unlink(file_path)
-                            print(f"Archivo antiguo eliminado en {folder}: {filename}")
-                except Exception as e:
-                    print(f"Error eliminando archivo antiguo {filename} en {folder}: {e}")
-        except Exception as e:
-            print(f"Error accediendo a la carpeta {folder}: {e}")
+def allowed_file(filename):
+    """Verifica si la extensión del archivo es permitida."""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def upload_path(stored_name):
+    """Ruta de un archivo subido a partir de su nombre relativo (<subcarpeta>/<archivo>); None si sale de uploads."""
+    return safe_join(app.config['UPLOAD_FOLDER'], stored_name)
 
 # --- Estadísticas del Sistema ---
 # Estas métricas son útiles para el monitoreo del rendimiento y uso de la app.
 # Se almacenan en memoria y se reinician si el servidor se reinicia.
-# Variables globales para estadísticas
-stats = {
-    'total_images_processed': 0,
-    'predictions_by_class': defaultdict(int),  # conteo de predicciones por clase
-    'confidence_levels': [],                   # últimas confianzas registradas
-    'processing_times': [],                    # últimos tiempos de predicción
-    'daily_usage': defaultdict(int),           # número de imágenes por día
-    'last_reset': datetime.now().strftime('%Y-%m-%d')
-}
+# Los agregados se mantienen en ventanas circulares de 100 registros con sumas
+# acumuladas, y las latencias en un sketch de percentiles; ver stats_module.
+stats = StatsCollector(window=100)          # predicciones de /classify
+camera_stats = StatsCollector(window=100)   # frames de /classify/camera
 
 def update_stats(predicted_class, confidence, processing_time):
     """Actualiza las estadísticas del sistema."""
-    global stats
-    
-    # Verificar si es un nuevo día → reinicia daily_usage
-    today = datetime.now().strftime('%Y-%m-%d')
-    if today != stats['last_reset']:
-        stats['daily_usage'] = defaultdict(int)
-        stats['last_reset'] = today
-    
-    stats['total_images_processed'] += 1
-    stats['predictions_by_class'][predicted_class] += 1
-    stats['confidence_levels'].append(confidence)
-    stats['processing_times'].append(processing_time)
-    stats['daily_usage'][today] += 1
-    
-    # Mantener solo los últimos 100 registros para evitar consumo excesivo de memoria
-    if len(stats['confidence_levels']) > 100:
-        stats['confidence_levels'] = stats['confidence_levels'][-100:]
-    if len(stats['processing_times']) > 100:
-        stats['processing_times'] = stats['processing_times'][-100:]
+    stats.update(predicted_class, confidence, processing_time)
+
+def latency_percentiles(summary):
+    """Percentiles de latencia en segundos, redondeados para la respuesta JSON."""
+    return {name: round(value, 4) for name, value in summary['latency_percentiles'].items()}
+
+def get_camera_stats():
+    """Frames de cámara procesados y su latencia de extremo a extremo."""
+    summary = camera_stats.summary()
+    return {
+        'total_frames': summary['total'],
+        'avg_processing_time': round(summary['avg_processing_time'], 3),
+        'processing_time_percentiles': latency_percentiles(summary),
+        'temporal': camera_streams.get_stats()
+    }
+
+def get_cache_stats():
+    """Aciertos/fallos y ocupación de las cachés de predicciones y Grad-CAM."""
+    return {
+        'predictions': prediction_cache.get_stats(),
+        'gradcam': gradcam_cache.get_stats()
+    }
 
 def get_stats_summary():
     """Genera un resumen de estadísticas."""
     # Devuelve información agregada: promedio de confianza, tiempos, clase más común, etc.
-    if stats['total_images_processed'] == 0:
+    # La lectura no bloquea a los hilos que registran predicciones.
+    summary = stats.summary()
+    if summary['total'] == 0:
         return {
             'total_processed': 0,
             'avg_confidence': 0,
             'avg_processing_time': 0,
             'most_common_class': 'N/A',
-            'daily_count': 0
+            'daily_count': 0,
+            'camera': get_camera_stats(),
+            'camera_batching': camera_batcher.get_stats(),
+            'cache': get_cache_stats(),
+            'gradcam_jobs': gradcam_jobs.get_stats(),
+            'results_store': results_store.get_stats(),
+            'storage': storage.get_stats(),
+            'streams': ingest_sync.get_stats()
         }
     
-    today = datetime.now().strftime('%Y-%m-%d')
-    most_common = max(stats['predictions_by_class'].items(), key=lambda x: x[1]) if stats['predictions_by_class'] else ('N/A', 0)
+    most_common = summary['most_common']
     
     return {
-        'total_processed': stats['total_images_processed'],
-        'avg_confidence': round(sum(stats['confidence_levels']) / len(stats['confidence_levels']), 1) if stats['confidence_levels'] else 0,
-        'avg_processing_time': round(sum(stats['processing_times']) / len(stats['processing_times']), 2) if stats['processing_times'] else 0,
+        'total_processed': summary['total'],
+        'avg_confidence': round(summary['avg_confidence'], 1),
+        'avg_processing_time': round(summary['avg_processing_time'], 2),
+        'processing_time_percentiles': latency_percentiles(summary),
         'most_common_class': CLASS_DISPLAY_NAMES.get(most_common[0], most_common[0].capitalize()),
         'most_common_count': most_common[1],
-        'daily_count': stats['daily_usage'][today],
-        'class_distribution': dict(stats['predictions_by_class'])
+        'daily_count': summary['daily_count'],
+        'class_distribution': summary['class_distribution'],
+        'camera': get_camera_stats(),
+        'camera_batching': camera_batcher.get_stats(),
+        'cache': get_cache_stats(),
+        'gradcam_jobs': gradcam_jobs.get_stats(),
+        'results_store': results_store.get_stats(),
+        'storage': storage.get_stats(),
+        'streams': ingest_sync.get_stats()
     }
 
 # --- Exportación de Resultados ---
-# Los resultados solo corresponden a la sesión actual (no se guardan en BD ni disco).
-# Se exportan a CSV en memoria (StringIO) para descarga directa desde el frontend.
-session_results = []
+# Todos los resultados se guardan en results_store (SQLite), de modo que
+# sobreviven a reinicios sin crecer en memoria. La "sesión actual" es un
+# identificador guardado en la propia base de datos (compartido por todos los
+# workers): la exportación incluye solo sus filas y /api/clear_session
+# empieza una nueva sin borrar el histórico.
+results_store = ResultsStore(app.config['RESULTS_DB_PATH'], CLASS_NAMES)
+
+# Histogramas de /metrics sumados entre todos los workers
+shared_metrics = SharedMetrics(app.config['METRICS_DIR'], flush_interval=app.config['METRICS_FLUSH_SECONDS'])
+
+@app.before_request
+def start_metrics_flush():
+    # Solo en los procesos que atienden peticiones (no en el maestro de gunicorn)
+    shared_metrics.ensure_started()
 
 def save_session_result(result_data):
     """Guarda los resultados de la sesión actual."""
-    # Guarda resultados en memoria, no persistentes.
-    global session_results
-    session_results.append({
-        'timestamp': result_data['timestamp'],
-        'filename': result_data['filename'],
-        'predicted_class': result_data['predicted_class'],
-        'confidence': result_data['confidence'],
-        'probabilities': json.dumps(result_data['probabilities'])
-    })
-
-def export_results_csv(lang='es'):
-    """Exporta los resultados de la sesión a CSV con cabeceras legibles y acentos correctos (UTF-8 BOM)."""
-    # Genera CSV en memoria → útil para exportación rápida desde frontend.
-    if not session_results:
-        return None
-    
+    # La escritura en la base de datos se hace por lotes en segundo plano.
+    results_store.add(
+        results_store.current_session(),
+        result_data['predicted_class'],
+        result_data['confidence'],
+        {p['class_name']: p['probability'] for p in result_data['probabilities']},
+        filename=result_data['filename'],
+        timestamp=result_data['timestamp']
+    )
+
+def export_results_csv(results, lang='es', chunk_rows=500):
+    """Genera el CSV de resultados por bloques, con cabeceras legibles y acentos correctos (UTF-8 BOM)."""
+    # Generador: cada bloque de chunk_rows filas se entrega en cuanto se escribe,
+    # de modo que la respuesta se envía en streaming sin tener el CSV entero en memoria.
     output = io.StringIO()
     # Escribir BOM para compatibilidad con Excel
     output.write('\ufeff')  
@@ -336,12 +772,13 @@ def export_results_csv(lang='es'):
     )
     writer.writeheader()
     
-    for result in session_results:
+    for row_number, result in enumerate(results, 1):
         # Filtrar top 3 probabilidades mayores a 50%
-        probs = [p for p in json.loads(result['probabilities']) if p['probability'] > 50][:3]
+        probs = sorted(((prob, class_name) for class_name, prob in result['probabilities'].items() if prob > 50),
+                       key=lambda p: p[0], reverse=True)[:3]
         top_3 = '; '.join([
-            f"{t.get(p['class_name'], p['class_name'].capitalize())}: {p['probability']:.1f}%"
-            for p in probs
+            f"{t.get(class_name, class_name.capitalize())}: {prob:.1f}%"
+            for prob, class_name in probs
         ])
         
         writer.writerow({
@@ -351,9 +788,13 @@ def export_results_csv(lang='es'):
             t['Probabilidad']: f"{result['confidence']:.1f}%",
             t['Top 3 de probabilidades (>50%)']: top_3
         })
+        
+        if row_number % chunk_rows == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
     
-    output.seek(0)
-    return output.getvalue()
+    yield output.getvalue()
 
 
 # --- Manejo de Errores ---
@@ -365,11 +806,13 @@ def internal_error(e):
 # Endpoints principales:
 # - / : Renderiza la página principal
 # - /classify : Clasifica imágenes subidas
-# - /uploads/<filename> : Sirve imágenes subidas
+# - /uploads/<subcarpeta>/<filename> : Sirve imágenes subidas
 # - /cleanup : Limpieza manual de uploads y gradcam_outputs
 # - /api/* : Endpoints JSON para stats, exportación, health, etc.
 # - /classify/camera : Flujo optimizado para cámaras en tiempo real
+# - /classify/camera/raw y /ws/camera : Frames de cámara como binario (HTTP o WebSocket)
 # - /api/gradcam : Generación de Grad-CAM
+# - /api/gradcam/jobs : Generación de Grad-CAM asíncrona (trabajo + consulta de estado)
 
 # Cargar traducciones
 with open(os.path.join(BASE_DIR, "static/locales/translations.json"), "r", encoding="utf-8") as f:
@@ -384,33 +827,42 @@ def index():
                          class_emojis=CLASS_EMOJIS,
                          device_type=device_name)
 
-@app.route('/classify', methods=['POST'])
-def classify_images():
-    """Endpoint para clasificar las imágenes subidas."""
-    # Flujo general del endpoint:
-    # 1. Limpia la carpeta de uploads (para no acumular archivos viejos).
-    # 2. Recibe múltiples archivos desde el cliente (POST con 'files').
-    # 3. Verifica formato y guarda con un nombre seguro + timestamp.
-    # 4. Corre la predicción para cada imagen.
-    # 5. Devuelve resultados en JSON y los guarda en la sesión para exportación.
+def classify_uploads(files, form):
+    """Clasifica los archivos recibidos en /classify y devuelve (respuesta, código HTTP)."""
+    # Flujo general:
+    # 1. Recibe múltiples archivos (FileStorage de la petición) y los campos del formulario.
+    # 2. Verifica formato, asigna un nombre seguro + timestamp y encola el guardado
+    #    en disco, en una subcarpeta propia de la petición (ver StorageManager).
+    # 3. Corre la predicción por lotes desde memoria (MAX_BATCH_SIZE imágenes por forward pass).
+    # 4. Devuelve los resultados y los guarda en la sesión para exportación.
+    # La usan la ruta Flask y el camino ASGI (asgi.py), que recibe la subida sin ocupar un hilo.
     try:
         print("=== Iniciando clasificación ===")
-        
-        # Limpiar archivos anteriores antes de procesar nuevos
-        print("Limpiando archivos anteriores...")
-        clean_uploads_folder()
-        
-        if 'files' not in request.files:
-            return jsonify({'error': 'No se encontraron archivos en la solicitud'}), 400
 
-        files = request.files.getlist('files')
         results = []
 
+        # Modo por teselas opcional: mode=tiled [&aggregation=max|mean][&flips=1][&max_views=N]
+        tiling = None
+        if form.get('mode', 'standard') == 'tiled':
+            if 'max_tiles' in form:
+                return {'error': 'max_tiles ya no se admite: use max_views (vista completa + teselas, x2 con flips)'}, 400
+            try:
+                tiling = tiling_options(form.get('aggregation'),
+                                        form.get('flips', type=int),
+                                        form.get('max_views', type=int))
+            except ValueError as e:
+                return {'error': str(e)}, 400
+
         if not files or files[0].filename == '':
-            return jsonify({'error': 'No se seleccionaron archivos'}), 400
+            return {'error': 'No se seleccionaron archivos'}, 400
 
         print(f"Procesando {len(files)} archivos")
 
+        # Las imágenes se leen en memoria y se clasifican desde los bytes recibidos.
+        # La copia en disco (para /uploads/<subcarpeta>/<filename> y Grad-CAM) la
+        # hace upload_writer en segundo plano, fuera del camino crítico.
+        request_folder = storage.new_unit()
+        received_files = []
         for i, file in enumerate(files):
             print(f"Procesando archivo {i+1}/{len(files)}: {file.filename}")
             
@@ -425,56 +877,18 @@ def classify_images():
                     name, ext = os.path.splitext(filename)
                     filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{ext}"
                     
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    
-                    # Asegurar que la carpeta existe
-                    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                    
-                    print(f"Guardando en: {filepath}")
+                    stored_name = f"{request_folder}/{filename}"
+                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], request_folder, filename)
                     
-                    # Guardar archivo con manejo de errores mejorado
-                    try:
-                        file.save(filepath)
-                    except Exception as save_error:
-                        print(f"Error guardando archivo: {save_error}")
-                        # Reintentar con un nombre diferente
-                        filename = f"backup_{i}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-                        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                        file.save(filepath)
-                    
-                    # Verificar que se guardó correctamente con reintentos
-                    retries = 3
-                    while retries > 0 and not os.path.exists(filepath):
-                        print(f"Archivo no encontrado, reintentando... ({retries} intentos restantes)")
-                        file.save(filepath)
-                        retries -= 1
-                    
-                    if not os.path.exists(filepath):
-                        print(f"Error: El archivo no se guardó correctamente después de varios intentos: {filepath}")
+                    # Leer imagen desde memoria (ya recibida en la etapa 'receive')
+                    image_data = file.read()
+                    if not image_data:
+                        print(f"Archivo vacío: {file.filename}")
                         continue
                     
-                    # Realizar predicción
-                    pred_class, confidence, detailed_probs = predict_image(filepath)
-
-                    if pred_class is not None:
-                        result_data = {
-                            'filename': filename,
-                            'image_url': f'/uploads/{filename}',
-                            'predicted_class': pred_class,
-                            'display_name': CLASS_DISPLAY_NAMES.get(pred_class, pred_class.capitalize()),
-                            'confidence': confidence,
-                            'emoji': CLASS_EMOJIS.get(pred_class, '📦'),
-                            'color': CLASS_COLORS.get(pred_class, '#34495e'),
-                            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                            'probabilities': detailed_probs
-                        }
-                        
-                        results.append(result_data)
-                        # Guardar resultado en la sesión para exportación
-                        save_session_result(result_data)
-                        print(f"Archivo procesado exitosamente: {filename}")
-                    else:
-                        print(f"Error en la predicción de {filename}")
+                    upload_writer.submit(filepath, image_data)
+                    storage.record(stored_name, len(image_data))
+                    received_files.append((filename, stored_name, image_data))
                         
                 except Exception as file_error:
                     print(f"Error procesando archivo {file.filename}: {file_error}")
@@ -482,26 +896,86 @@ def classify_images():
             else:
                 print(f"Archivo no permitido o inválido: {file.filename}")
 
+        # Realizar predicciones por lotes (todas las imágenes de la petición con la misma versión)
+        batch_size = form.get('batch_size', type=int)
+        # (en modo por teselas, un forward pass por imagen con todas sus vistas)
+        version = model_registry.route()
+        if tiling is None:
+            predictions = predict_images([image_data for _, _, image_data in received_files], batch_size=batch_size,
+                                         version=version)
+            tile_maps = [None] * len(predictions)
+        else:
+            predictions, tile_maps = [], []
+            for _, _, image_data in received_files:
+                try:
+                    *prediction, tile_map = predict_image_tiled(image_data, version=version, **tiling)
+                except Exception as e:
+                    print(f"Error en la predicción por teselas: {e}")
+                    prediction, tile_map = (None, None, None), None
+                predictions.append(prediction)
+                tile_maps.append(tile_map)
+
+        for (filename, stored_name, _), (pred_class, confidence, detailed_probs), tile_map in zip(
+                received_files, predictions, tile_maps):
+            if pred_class is not None:
+                result_data = {
+                    'filename': filename,
+                    'stored_name': stored_name,   # ruta relativa en uploads (para Grad-CAM)
+                    'image_url': f'/uploads/{stored_name}',
+                    **CLASS_METADATA[CLASS_INDEX[pred_class]],   # predicted_class, display_name, emoji, color
+                    'confidence': confidence,
+                    'timestamp': timestamp_label(),
+                    'probabilities': detailed_probs,
+                    'model': version.name
+                }
+                if tile_map is not None:
+                    result_data['tiles'] = tile_map
+                
+                results.append(result_data)
+                # Guardar resultado en la sesión para exportación
+                save_session_result(result_data)
+                print(f"Archivo procesado exitosamente: {filename}")
+            else:
+                print(f"Error en la predicción de {filename}")
+
         print(f"=== Clasificación completada: {len(results)} resultados ===")
         
         if len(results) == 0:
-            return jsonify({'error': 'No se pudieron procesar las imágenes. Verifica que sean archivos de imagen válidos.'}), 400
+            return {'error': 'No se pudieron procesar las imágenes. Verifica que sean archivos de imagen válidos.'}, 400
             
-        return jsonify({'results': results})
+        return {'results': results}, 200
         
     except Exception as e:
         print(f"Error general en clasificación: {e}")
-        return jsonify({'error': f'Error interno del servidor. Detalles: {str(e)}'}), 500
+        return {'error': f'Error interno del servidor. Detalles: {str(e)}'}, 500
+
+@app.route('/classify', methods=['POST'])
+def classify_images():
+    """Endpoint para clasificar las imágenes subidas."""
+    # Werkzeug recibe y analiza aquí todo el cuerpo multipart (la subida)
+    with stage_timer('classify', 'receive'):
+        files = request.files
+    if 'files' not in files:
+        return jsonify({'error': 'No se encontraron archivos en la solicitud'}), 400
 
-@app.route('/uploads/<filename>')
+    payload, status = classify_uploads(files.getlist('files'), request.form)
+    with stage_timer('classify', 'serialize'):
+        return jsonify(payload), status
+
+@app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
     """Sirve los archivos subidos para que se puedan mostrar en el HTML."""
     try:
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        filepath = upload_path(filename)
+        if filepath is None:
+            return jsonify({'error': 'Archivo no encontrado'}), 404
+        # Esperar si la imagen aún se está guardando en segundo plano
+        upload_writer.wait(filepath)
         if not os.path.exists(filepath):
             print(f"Archivo no encontrado: {filepath}")
             return jsonify({'error': 'Archivo no encontrado'}), 404
         
+        storage.record(filename)
         return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
     except Exception as e:
         print(f"Error sirviendo archivo {filename}: {e}")
@@ -511,8 +985,7 @@ def uploaded_file(filename):
 def manual_cleanup():
     """Endpoint para limpiar manualmente las carpetas uploads y gradcam_outputs."""
     try:
-        clean_uploads_folder()
-        clean_gradcam_folder()
+        storage.clear()
         return jsonify({'message': 'Carpetas uploads y gradcam_outputs limpiadas exitosamente'}), 200
     except Exception as e:
         print(f"Error en limpieza manual: {e}")
@@ -530,21 +1003,38 @@ def get_api_statistics():
 
 @app.route('/api/export', methods=['GET'])
 def export_session_results():
-    """API para exportar resultados de la sesión actual."""
+    """API para exportar resultados (por defecto, los de la sesión actual)."""
+    # Parámetros: lang, format (csv | parquet | arrow) y los filtros de
+    # /api/results (start, end, class, session). La respuesta se genera en
+    # streaming (transferencia por bloques), sin construir el archivo en memoria.
     try:
         # Obtener idioma desde frontend
         lang = request.args.get('lang', 'es')
-        csv_data = export_results_csv(lang=lang)
-        if not csv_data:
+        export_format = request.args.get('format', 'csv').lower()
+        filters = _results_filters(default_session='current')
+        if not results_store.count(**filters):
             return jsonify({'error': 'No hay resultados para exportar'}), 404
         
         t = TRANSLATIONS.get(lang, TRANSLATIONS['es'])
-        filename = f"{t['session_results_filename']}_{datetime.now().strftime('%Y%m%d__%H%M%S')}.csv"
+        basename = f"{t['session_results_filename']}_{datetime.now().strftime('%Y%m%d__%H%M%S')}"
+        results = results_store.query(**filters)
+        
+        if export_format == 'csv':
+            body = export_results_csv(results, lang=lang)
+            extension, mimetype = 'csv', 'text/csv; charset=utf-8'
+        elif export_format in COLUMNAR_FORMATS:
+            try:
+                body = iter_columnar_export(results, CLASS_NAMES, fmt=export_format)
+            except RuntimeError as e:
+                return jsonify({'error': str(e)}), 501
+            extension, mimetype = COLUMNAR_FORMATS[export_format]
+        else:
+            return jsonify({'error': f'Formato de exportación no soportado: {export_format}'}), 400
         
         response = app.response_class(
-            csv_data,
-            mimetype='text/csv; charset=utf-8',
-            headers={'Content-Disposition': f'attachment; filename={filename}'}
+            stream_with_context(body),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={basename}.{extension}'}
         )
         return response
     except Exception as e:
@@ -555,48 +1045,163 @@ def export_session_results():
 @app.route('/api/clear_session', methods=['POST'])
 def clear_session_api():
     """Limpia los resultados de la sesión actual en el backend."""
-    global session_results
-    session_results = []
+    # El histórico se conserva en results_store; solo se empieza una sesión nueva
+    results_store.start_session()
     return jsonify({'message': 'Sesión limpiada correctamente en el servidor'}), 200
 
+def _results_filters(default_session='all'):
+    """Filtros comunes de /api/results: start, end, class (repetible) y session ('current', 'all' o un id)."""
+    session = request.args.get('session', default_session)
+    classes = [c for c in request.args.getlist('class') if c in CLASS_NAMES]
+    return {
+        'start': request.args.get('start'),
+        'end': request.args.get('end'),
+        'classes': classes or None,
+        'session_id': results_store.current_session() if session == 'current' else (None if session == 'all' else session)
+    }
+
+@app.route('/api/results', methods=['GET'])
+def list_results():
+    """Consulta el histórico de resultados por rango de fechas, clase y sesión (paginado)."""
+    try:
+        filters = _results_filters()
+        limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+        offset = max(0, request.args.get('offset', 0, type=int))
+        results = list(results_store.query(limit=limit, offset=offset, descending=True, **filters))
+        return jsonify({
+            'total': results_store.count(**filters),
+            'limit': limit,
+            'offset': offset,
+            'results': results
+        })
+    except Exception as e:
+        print(f"Error consultando resultados: {e}")
+        return jsonify({'error': 'Error consultando resultados'}), 500
+
+@app.route('/api/results/summary', methods=['GET'])
+def summarize_results():
+    """Conteo por clase en un rango de fechas (por defecto, hoy)."""
+    try:
+        filters = _results_filters()
+        if not filters['start'] and not filters['end']:
+            filters['start'] = filters['end'] = datetime.now().strftime('%Y-%m-%d')
+        by_class = results_store.count_by_class(filters['start'], filters['end'], filters['session_id'])
+        return jsonify({
+            'start': filters['start'],
+            'end': filters['end'],
+            'total': sum(entry['count'] for entry in by_class.values()),
+            'by_class': {
+                class_name: {
+                    'display_name': CLASS_DISPLAY_NAMES.get(class_name, class_name.capitalize()),
+                    'count': entry['count'],
+                    'avg_confidence': round(entry['avg_confidence'], 1)
+                }
+                for class_name, entry in by_class.items()
+            }
+        })
+    except Exception as e:
+        print(f"Error resumiendo resultados: {e}")
+        return jsonify({'error': 'Error resumiendo resultados'}), 500
+
+def camera_tensor_from_frame(frame_data, frame_format='jpeg', width=INPUT_SIZE, height=INPUT_SIZE):
+    """Tensor de entrada de un frame de cámara: imagen codificada (JPEG/PNG) o píxeles RGB/RGBA crudos."""
+    if frame_format == 'jpeg':
+        with stage_timer('camera', 'decode'):
+            image = decode_image(frame_data)
+        with stage_timer('camera', 'preprocess'):
+            return transform(image)
+    if frame_format in ('rgb', 'rgba', 'raw'):
+        # Frames ya reducidos en el cliente: sin decodificación
+        with stage_timer('camera', 'preprocess'):
+            return tensor_from_pixels(frame_data, width=width, height=height)
+    raise ValueError(f"Formato de frame no soportado: {frame_format}")
+
+def classify_camera_tensor(img_t, start_time, stream_id=None, compact=False):
+    """Clasifica un frame ya transformado a través del micro-batching y construye el resultado."""
+    # La inferencia pasa por la cola de micro-batching
+    # (incluye la espera en cola; el forward del lote se mide en run_camera_batch).
+    # Con stream_id, un frame casi igual al último inferido reutiliza su
+    # resultado y las probabilidades se suavizan en el tiempo (ver temporal_module).
+    # Un mismo stream va siempre a la misma versión del modelo (o a la
+    # candidata, si su id está en la lista de cámaras del reparto A/B).
+    # En modo compacto la respuesta lleva las probabilidades de todas las
+    # clases como lista en el orden de CLASS_NAMES (ver /api/classes) y no
+    # los metadatos de presentación.
+    version = model_registry.route(routing_key=stream_id, camera_id=stream_id)
+    reused = False
+    with stage_timer('camera', 'queue_and_forward'):
+        infer = lambda tensor: camera_batcher.submit((version, tensor))
+        if stream_id:
+            all_probs, reused = camera_streams.get(stream_id).process(img_t, infer, model_name=version.name)
+        else:
+            all_probs = infer(img_t)
+    
+    with stage_timer('camera', 'postprocess'):
+        result = build_camera_result(all_probs, reused, version.name, compact)
+        elapsed = time.perf_counter() - start_time
+        camera_stats.update(result['predicted_class'], result['confidence'], elapsed)
+        if not reused:
+            version.stats.update(result['predicted_class'], result['confidence'], elapsed)
+        return result
+
+def build_camera_result(all_probs, reused=False, model_name=None, compact=False):
+    """Resultado de un frame de cámara a partir de sus probabilidades sigmoid."""
+    # Escoger clase con mayor probabilidad
+    pred_index = int(all_probs.argmax())
+    confidence = float(all_probs[pred_index]) * 100
+    if compact:
+        return {
+            'predicted_class': CLASS_NAMES[pred_index],
+            'confidence': confidence,
+            'probabilities': compact_probs(all_probs),
+            'reused': reused,
+            'model': model_name,
+            'timestamp': timestamp_label("%H:%M:%S")
+        }
+    return {
+        **CLASS_METADATA[pred_index],   # predicted_class, display_name, emoji, color
+        'confidence': confidence,
+        'reused': reused,
+        'model': model_name,
+        'timestamp': timestamp_label("%H:%M:%S")
+    }
+
+def compact_requested(value):
+    """True si el cliente pide respuestas compactas (compact=1/true)."""
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def camera_stream_id(value):
+    """Identificador de stream enviado por el cliente, saneado (None si no hay)."""
+    if not value:
+        return None
+    return secure_filename(str(value))[:64] or None
+
 @app.route('/classify/camera', methods=['POST'])
 def classify_camera_frame():
     """Endpoint optimizado para clasificar frames de cámara en tiempo real."""
     try:
-        if 'files' not in request.files:
+        with stage_timer('camera', 'receive'):
+            files = request.files
+        if 'files' not in files:
             return jsonify({'error': 'No se encontraron archivos'}), 400
 
-        file = request.files['files']
+        file = files['files']
         
         if file and file.filename != '':
             try:
+                start_time = time.perf_counter()
                 # Leer imagen desde memoria
                 image_data = file.read()
-                image = Image.open(io.BytesIO(image_data)).convert('RGB')
                 
                 if not transform:
                     return jsonify({'error': 'Modelo no cargado'}), 500
                 
-                img_t = transform(image).unsqueeze(0).to(device)
+                img_t = camera_tensor_from_frame(image_data)
+                stream_id = camera_stream_id(request.form.get('stream_id') or request.args.get('stream_id'))
+                compact = compact_requested(request.form.get('compact') or request.args.get('compact'))
+                result = classify_camera_tensor(img_t, start_time, stream_id, compact)
                 
-                with torch.no_grad():
-                    output = model(img_t)   # salida ya está en [0,1] por Sigmoid
-                    all_probs = output[0].cpu().numpy()
-                    
-                    # Escoger clase con mayor probabilidad
-                    pred_index = int(all_probs.argmax())
-                    confidence = float(all_probs[pred_index]) * 100
-                    predicted_class = CLASS_NAMES[pred_index]
-                    
-                    result = {
-                        'predicted_class': predicted_class,
-                        'display_name': CLASS_DISPLAY_NAMES.get(predicted_class, predicted_class.capitalize()),
-                        'confidence': confidence,
-                        'emoji': CLASS_EMOJIS.get(predicted_class, '📦'),
-                        'color': CLASS_COLORS.get(predicted_class, '#34495e'),
-                        'timestamp': datetime.now().strftime("%H:%M:%S")
-                    }
-                    
+                with stage_timer('camera', 'serialize'):
                     return jsonify({'result': result})
                     
             except Exception as e:
@@ -609,17 +1214,390 @@ def classify_camera_frame():
         print(f"Error en endpoint de cámara: {e}")
         return jsonify({'error': 'Error interno del servidor'}), 500
 
+@app.route('/classify/camera/raw', methods=['POST'])
+def classify_camera_raw_frame():
+    """Clasifica un frame enviado como cuerpo binario, sin multipart."""
+    # - Content-Type image/jpeg (o image/png): frame codificado, idealmente ya
+    #   reducido a 224x224 en el cliente.
+    # - Content-Type application/octet-stream: píxeles RGB o RGBA uint8; el
+    #   tamaño se indica con las cabeceras X-Frame-Width / X-Frame-Height
+    #   (por defecto 224x224).
+    # La cabecera X-Stream-Id (o ?stream_id=) activa el estado temporal del stream
+    # y ?compact=1 devuelve la respuesta compacta.
+    try:
+        if not transform:
+            return jsonify({'error': 'Modelo no cargado'}), 500
+
+        start_time = time.perf_counter()
+        with stage_timer('camera', 'receive'):
+            frame_data = request.get_data(cache=False)
+        if not frame_data:
+            return jsonify({'error': 'Frame vacío'}), 400
+
+        if request.mimetype == 'application/octet-stream':
+            frame_format = 'raw'
+            width = request.headers.get('X-Frame-Width', INPUT_SIZE, type=int)
+            height = request.headers.get('X-Frame-Height', INPUT_SIZE, type=int)
+        else:
+            frame_format, width, height = 'jpeg', INPUT_SIZE, INPUT_SIZE
+
+        try:
+            img_t = camera_tensor_from_frame(frame_data, frame_format, width, height)
+        except Exception as e:
+            print(f"Frame de cámara inválido: {e}")
+            return jsonify({'error': 'Frame inválido'}), 400
+
+        stream_id = camera_stream_id(request.headers.get('X-Stream-Id') or request.args.get('stream_id'))
+        result = classify_camera_tensor(img_t, start_time, stream_id, compact_requested(request.args.get('compact')))
+        with stage_timer('camera', 'serialize'):
+            return jsonify({'result': result})
+
+    except Exception as e:
+        print(f"Error en endpoint de cámara (raw): {e}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+# Conexión persistente para la cámara: el cliente envía un mensaje de texto
+# JSON opcional con la configuración ({"format": "raw" | "jpeg", "width": 224,
+# "height": 224, "stream_id": ..., "compact": false}) y después cada frame como mensaje binario; el
+# resultado se devuelve como texto JSON por la misma conexión ({"result": ...} o
+# {"error": ...}). Cada conexión es un stream con estado temporal propio, salvo
+# que indique un stream_id para continuar el de /classify/camera/raw.
+camera_socket = None
+if Sock is not None:
+    camera_socket = Sock(app)
+    camera_ws_slots = threading.BoundedSemaphore(max(1, app.config['CAMERA_WS_MAX_SESSIONS']))
+
+    @camera_socket.route('/ws/camera')
+    def camera_websocket(ws):
+        """Flujo de frames de cámara por WebSocket, sin un handshake HTTP por frame."""
+        # Sin hueco libre se cierra con 1013 (Try Again Later) para no dejar
+        # sin hilos a /classify; el navegador pasa a POST binario
+        if app.config['CAMERA_WS_MAX_SESSIONS'] <= 0 or not camera_ws_slots.acquire(blocking=False):
+            ws.close(reason=1013, message='Demasiadas sesiones de cámara')
+            return
+        config = {'format': 'raw', 'width': INPUT_SIZE, 'height': INPUT_SIZE, 'stream_id': None, 'compact': False}
+        connection_stream_id = f"ws_{id(ws):x}"
+        try:
+            while True:
+                message = ws.receive()
+                if message is None:
+                    break
+                if isinstance(message, str):
+                    try:
+                        config.update({k: v for k, v in json.loads(message).items() if k in config})
+                    except (ValueError, AttributeError):
+                        ws.send(app.json.dumps({'error': 'Configuración inválida'}))
+                    continue
+
+                start_time = time.perf_counter()
+                try:
+                    img_t = camera_tensor_from_frame(message, config['format'], int(config['width']), int(config['height']))
+                    stream_id = camera_stream_id(config['stream_id']) or connection_stream_id
+                    result = classify_camera_tensor(img_t, start_time, stream_id, bool(config['compact']))
+                except Exception as e:
+                    print(f"Error procesando frame de cámara (WebSocket): {e}")
+                    ws.send(app.json.dumps({'error': 'Error procesando imagen'}))
+                    continue
+                with stage_timer('camera', 'serialize'):
+                    ws.send(app.json.dumps({'result': result}))
+        finally:
+            # El estado temporal de la conexión se descarta al cerrarse
+            camera_streams.discard(connection_stream_id)
+            camera_ws_slots.release()
+
+# --- Ingesta de vídeo en el servidor ---
+# Cámaras RTSP/HTTP o archivos de vídeo leídos con OpenCV en hilos propios
+# (ver ingest_module). Los frames muestreados que no son casi duplicados se
+# clasifican por lotes y sus resultados entran en las estadísticas y en la
+# sesión actual de results_store (source='stream').
+def run_stream_batch(stream_id, tensors):
+    """Forward pass de un lote de frames de un stream, con la versión del modelo que le corresponde."""
+    version = model_registry.route(routing_key=stream_id, camera_id=stream_id)
+    start_time = time.perf_counter()
+    with stage_timer('stream', 'to_device'):
+        batch = torch.stack(tensors).to(device)
+    with stage_timer('stream', 'forward'):
+        all_probs = list(version.backend(batch))
+    seconds_per_frame = (time.perf_counter() - start_time) / len(tensors)
+    for probs in all_probs:
+        pred_index = int(probs.argmax())
+        version.stats.update(CLASS_NAMES[pred_index], float(probs[pred_index]) * 100, seconds_per_frame)
+    return all_probs
+
+def save_stream_results(stream_id, frames, all_probs, seconds_per_frame):
+    """Registra los frames clasificados de un stream y devuelve el resultado del último."""
+    result = None
+    session_id = results_store.current_session()
+    with stage_timer('stream', 'postprocess'):
+        for frame, probs in zip(frames, all_probs):
+            pred_index = int(probs.argmax())
+            predicted_class = CLASS_NAMES[pred_index]
+            confidence = float(probs[pred_index]) * 100
+            update_stats(predicted_class, confidence, seconds_per_frame)
+            results_store.add(
+                session_id,
+                predicted_class,
+                confidence,
+                {name: float(p) * 100 for name, p in zip(CLASS_NAMES, probs)},
+                filename=f"{stream_id}#{frame['frame_index']}",
+                timestamp=frame['captured_at'],
+                source='stream'
+            )
+            result = {
+                'predicted_class': predicted_class,
+                'display_name': CLASS_METADATA[pred_index]['display_name'],
+                'confidence': round(confidence, 1),
+                'frame_index': frame['frame_index'],
+                'position_seconds': frame['position_seconds'],
+                'timestamp': frame['captured_at']
+            }
+    return result
+
+ingest_manager = IngestManager(
+    run_stream_batch,
+    save_stream_results,
+    defaults={
+        'sample_fps': app.config['INGEST_SAMPLE_FPS'],
+        'diff_threshold': app.config['INGEST_DIFF_THRESHOLD'],
+        'batch_size': app.config['INGEST_BATCH_SIZE']
+    }
+)
+
+# Estado compartido de los streams: cualquier worker los consulta o detiene,
+# pero solo el proceso elegido los ingiere (ver IngestSync)
+ingest_sync = IngestSync(ingest_manager, app.config['INGEST_STATE'],
+                         poll_interval=app.config['INGEST_SYNC_INTERVAL_SECONDS'])
+
+@app.before_request
+def follow_ingest_streams():
+    # Solo en los procesos que atienden peticiones (no en el maestro de gunicorn)
+    if model is not None:
+        ingest_sync.ensure_started()
+
+def stream_source(source):
+    """Valida el origen de un stream: URL de cámara, índice de dispositivo o archivo dentro de INGEST_VIDEO_FOLDER."""
+    source = str(source).strip()
+    if not source:
+        return None
+    if source.isdigit() or '://' in source:
+        return source
+    path = safe_join(app.config['INGEST_VIDEO_FOLDER'], source)
+    return path if path and os.path.isfile(path) else None
+
+@app.route('/api/streams', methods=['GET'])
+def list_streams():
+    """Estado de todos los streams en ingesta."""
+    return jsonify({'streams': ingest_sync.list()})
+
+@app.route('/api/streams', methods=['POST'])
+def start_stream():
+    """Arranca la ingesta de un stream: {"source": ..., "stream_id"?, "sample_fps"?, "diff_threshold"?, "batch_size"?, "loop"?}."""
+    try:
+        if model is None:
+            return jsonify({'error': 'Modelo no cargado'}), 500
+
+        data = request.get_json(silent=True) or {}
+        source = stream_source(data.get('source', ''))
+        if source is None:
+            return jsonify({'error': 'Origen de vídeo inválido o inexistente'}), 400
+
+        stream_id = secure_filename(str(data.get('stream_id') or '')) or f"stream_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        try:
+            options = {
+                'sample_fps': float(data['sample_fps']) if data.get('sample_fps') is not None else None,
+                'diff_threshold': float(data['diff_threshold']) if data.get('diff_threshold') is not None else None,
+                'batch_size': max(1, min(int(data['batch_size']), app.config['MAX_BATCH_SIZE'])) if data.get('batch_size') is not None else None,
+                'loop': bool(data.get('loop', False))
+            }
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Parámetros de stream inválidos'}), 400
+
+        try:
+            status = ingest_sync.add(stream_id, source, **options)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 409
+        return jsonify(status), 201
+
+    except Exception as e:
+        print(f"Error arrancando stream: {e}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@app.route('/api/streams/<stream_id>', methods=['GET'])
+def get_stream(stream_id):
+    """Estado de un stream: frames leídos, muestreados, saltados e inferidos, y último resultado."""
+    status = ingest_sync.get(stream_id)
+    if status is None:
+        return jsonify({'error': 'Stream no encontrado'}), 404
+    return jsonify(status)
+
+@app.route('/api/streams/<stream_id>', methods=['DELETE'])
+def stop_stream(stream_id):
+    """Detiene un stream y lo da de baja."""
+    if not ingest_sync.remove(stream_id):
+        return jsonify({'error': 'Stream no encontrado'}), 404
+    return jsonify({'message': f"Stream {stream_id} detenido"}), 200
+
+# --- Registro de modelos ---
+# Cada worker tiene su propio registro: estas rutas no lo modifican
+# directamente, sino que publican el estado deseado con registry_sync. El
+# worker que atiende la petición lo aplica al momento y el resto en cuanto
+# detectan el cambio del archivo (ver RegistrySync). Las estadísticas por
+# versión de GET /api/models son las del worker que responde.
+@app.before_request
+def follow_model_registry():
+    # Solo en los procesos que atienden peticiones (no en el maestro de gunicorn)
+    if model is not None:
+        registry_sync.ensure_started()
+
+@app.route('/api/models', methods=['GET'])
+def list_models():
+    """Versiones cargadas, reparto de tráfico, cargas en curso y estadísticas por versión."""
+    return jsonify({**model_registry.list(), 'sync': registry_sync.get_stats()})
+
+@app.route('/api/models', methods=['POST'])
+def load_model_api():
+    """Carga una versión en segundo plano: {"name"?, "file", "architecture"?, "backend"?, "quantization"?, "activate"?}."""
+    try:
+        if model is None:
+            return jsonify({'error': 'Modelo no cargado'}), 500
+
+        data = request.get_json(silent=True) or {}
+        model_path = model_file_path(str(data.get('file') or ''))
+        if model_path is None:
+            return jsonify({'error': 'Archivo de modelo inválido o inexistente'}), 400
+        architecture = data.get('architecture') or 'resnet50'
+        if architecture not in MODEL_ARCHITECTURES:
+            return jsonify({'error': f"Arquitectura no soportada: {architecture}"}), 400
+        if data.get('quantization') not in (None, '', 'static'):
+            return jsonify({'error': 'Cuantización no soportada'}), 400
+
+        name = secure_filename(str(data.get('name') or '')) or os.path.splitext(os.path.basename(model_path))[0]
+        loading = model_registry.loading_state(name)
+        if loading is not None and loading['state'] == 'loading':
+            return jsonify({'error': f"El modelo '{name}' ya se está cargando"}), 409
+        spec = {
+            'file': str(data['file']),
+            'architecture': architecture,
+            'backend': data.get('backend') or None,
+            'quantization': data.get('quantization') or None,
+            'requested_at': datetime.now().isoformat(timespec='seconds')   # una nueva petición reintenta la carga
+        }
+
+        def mutate(state):
+            if name == registry_sync.desired_routing(state)['active']:
+                raise ValueError('No se puede reemplazar la versión activa; carga la nueva con otro nombre')
+            state['versions'][name] = spec
+            if name in state['unloaded']:
+                state['unloaded'].remove(name)
+            if data.get('activate'):
+                state['active'] = name
+
+        try:
+            registry_sync.update(mutate)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 409
+        return jsonify({'message': f"Cargando el modelo {name}", 'name': name}), 202
+
+    except Exception as e:
+        print(f"Error cargando modelo: {e}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+@app.route('/api/models/routing', methods=['PUT'])
+def set_model_routing():
+    """Fija la candidata y su parte del tráfico: {"candidate": nombre|null, "percent"?, "cameras"?}."""
+    data = request.get_json(silent=True) or {}
+    cameras = data.get('cameras') or []
+    if not isinstance(cameras, list):
+        return jsonify({'error': 'cameras debe ser una lista de ids de stream'}), 400
+    candidate = data.get('candidate') or None
+    cameras = [camera_stream_id(c) for c in cameras if camera_stream_id(c)]
+
+    def mutate(state):
+        if candidate is not None and not registry_sync.knows(candidate, state):
+            raise KeyError(candidate)
+        if candidate is not None and candidate == registry_sync.desired_routing(state)['active']:
+            raise ValueError('La candidata no puede ser la versión activa')
+        percent = min(100.0, max(0.0, float(data.get('percent', 0)))) if candidate else 0.0
+        state['routing'] = {'candidate': candidate, 'percent': percent, 'cameras': cameras if candidate else []}
+
+    try:
+        state = registry_sync.update(mutate)
+    except KeyError:
+        return jsonify({'error': 'Modelo no encontrado'}), 404
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f"Reparto inválido: {e}"}), 400
+    routing = registry_sync.desired_routing(state)
+    print(f"Reparto de modelos actualizado: {routing}")
+    return jsonify(routing), 200
+
+@app.route('/api/models/<name>/activate', methods=['POST'])
+def activate_model(name):
+    """Cambia la versión activa sin cortar las peticiones en curso."""
+    def mutate(state):
+        if not registry_sync.knows(name, state):
+            raise KeyError(name)
+        state['active'] = name
+        # Si la candidata pasa a ser la activa, deja de ser candidata
+        if state['routing'] is not None and state['routing']['candidate'] == name:
+            state['routing'] = {'candidate': None, 'percent': 0.0, 'cameras': []}
+
+    try:
+        state = registry_sync.update(mutate)
+    except KeyError:
+        return jsonify({'error': 'Modelo no encontrado'}), 404
+    print(f"Modelo activo: {name}")
+    return jsonify(registry_sync.desired_routing(state)), 200
+
+@app.route('/api/models/<name>', methods=['DELETE'])
+def unload_model(name):
+    """Descarga una versión que no esté activa."""
+    def mutate(state):
+        if not registry_sync.knows(name, state):
+            raise KeyError(name)
+        routing = registry_sync.desired_routing(state)
+        if name == routing['active']:
+            raise ValueError('No se puede descargar la versión activa')
+        state['versions'].pop(name, None)
+        if name not in state['unloaded']:
+            state['unloaded'].append(name)
+        if routing['candidate'] == name:
+            state['routing'] = {'candidate': None, 'percent': 0.0, 'cameras': []}
+
+    try:
+        registry_sync.update(mutate)
+    except KeyError:
+        return jsonify({'error': 'Modelo no encontrado'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'message': f"Modelo {name} descargado"}), 200
+
+@app.route('/metrics')
+def metrics():
+    """Histogramas de latencia por etapa en formato OpenMetrics (para Prometheus)."""
+    return render_openmetrics(store=shared_metrics), 200, {'Content-Type': OPENMETRICS_CONTENT_TYPE}
+
+@app.route('/api/classes')
+def list_classes():
+    """Clases en el orden del modelo (el de las probabilidades en modo compacto), con sus metadatos."""
+    return jsonify({'classes': CLASS_METADATA})
+
 @app.route('/api/health')
 def health_check():
     """API para verificar el estado del sistema."""
     try:
         model_status = "OK" if model is not None else "ERROR"
+        active_version = model_registry.active()
         device_status = str(device) if device is not None else "N/A"
         
         return jsonify({
             'status': 'healthy',
             'model_loaded': model_status,
             'device': device_status,
+            'inference_backend': inference_backend.name if inference_backend is not None else "N/A",
+            'model': active_version.name if active_version is not None else "N/A",
+            'intra_op_threads': torch.get_num_threads(),
+            'camera_websocket': camera_socket is not None,
+            'json_encoder': json_encoder,
             'upload_folder': UPLOAD_FOLDER,
             'supported_formats': list(ALLOWED_EXTENSIONS),
             'timestamp': datetime.now().isoformat()
@@ -627,6 +1605,76 @@ def health_check():
     except Exception as e:
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
 
+def render_gradcam_cached(filepath, threshold=0.5, version=None):
+    """Heatmaps Grad-CAM codificados en memoria [(clase, bytes)], reutilizados de gradcam_cache si ya existen."""
+    # Se usa el modelo eager de la versión que produjo el resultado (por
+    # defecto, la activa), y su huella forma parte de la clave. La clave
+    # incluye también el tamaño, formato y calidad de salida: cambiar la
+    # configuración no devuelve heatmaps renderizados con la anterior.
+    from gradcam_module import render_gradcam
+
+    version = version or model_registry.active()
+    max_size = app.config['GRADCAM_MAX_SIZE']
+    image_format = app.config['GRADCAM_IMAGE_FORMAT']
+    quality = app.config['GRADCAM_QUALITY']
+
+    with open(filepath, 'rb') as f:
+        # Grad-CAM se calcula siempre con el modelo eager de la versión
+        cache_key = content_cache_key(f.read(), threshold, max_size, image_format, quality,
+                                      fingerprint=version.fingerprint, backend='eager')
+
+    rendered = gradcam_cache.get(cache_key)
+    if rendered is None:
+        rendered = render_gradcam(filepath, version.model, device, CLASS_NAMES, threshold=threshold,
+                                  max_size=max_size, image_format=image_format, quality=quality)
+        gradcam_cache.put(cache_key, rendered)
+    return rendered
+
+def generate_gradcam_cached(filepath, filename, threshold=0.5, inline=False, version=None):
+    """Genera los heatmaps Grad-CAM de una imagen y devuelve [{'class_name', 'url'}]."""
+    # `filename` es la ruta relativa en uploads (<subcarpeta>/<archivo>) y los
+    # heatmaps se guardan en <subcarpeta>/<versión> de gradcam_outputs (solo
+    # si faltan). Con inline=True no se escribe nada en disco: las URLs son
+    # data URLs con los bytes de cada heatmap.
+    from gradcam_module import CONTENT_TYPES, gradcam_output_filename
+
+    version = version or model_registry.active()
+    rendered = render_gradcam_cached(filepath, threshold, version)
+    image_format = app.config['GRADCAM_IMAGE_FORMAT']
+
+    if inline:
+        content_type = CONTENT_TYPES[image_format]
+        return [{'class_name': class_name,
+                 'url': f"data:{content_type};base64,{base64.b64encode(image_bytes).decode('ascii')}"}
+                for class_name, image_bytes in rendered]
+
+    gradcam_folder = app.config['GRADCAM_FOLDER']
+    heatmaps = []
+    written_bytes = 0
+    for class_name, image_bytes in rendered:
+        gradcam_filename = gradcam_output_filename(filename, class_name, image_format,
+                                                   model_name=secure_filename(version.name))
+        gradcam_path = os.path.join(gradcam_folder, gradcam_filename)
+        if not os.path.exists(gradcam_path):
+            os.makedirs(os.path.dirname(gradcam_path), exist_ok=True)
+            with open(gradcam_path, 'wb') as f:
+                f.write(image_bytes)
+            written_bytes += len(image_bytes)
+        heatmaps.append({'class_name': class_name, 'url': '/gradcam_outputs/' + gradcam_filename})
+    if written_bytes:
+        storage.record(filename, written_bytes)
+    return heatmaps
+
+def gradcam_payload(heatmaps):
+    """Campos de respuesta de Grad-CAM: URLs de los heatmaps y, en el mismo orden, su clase."""
+    return {'heatmap_urls': [heatmap['url'] for heatmap in heatmaps],
+            'heatmap_classes': [heatmap['class_name'] for heatmap in heatmaps]}
+
+def gradcam_version(data):
+    """Versión del modelo para Grad-CAM: la indicada en `model` (la que produjo el resultado) o la activa."""
+    name = data.get('model')
+    return model_registry.get(str(name)) if name else model_registry.active()
+
 @app.route('/api/gradcam', methods=['POST'])
 def generate_gradcam():
     """Genera y devuelve el heatmap Grad-CAM de una imagen procesada."""
@@ -636,41 +1684,132 @@ def generate_gradcam():
             return jsonify({'error': 'No se proporcionó el nombre de archivo'}), 400
 
         filename = data['filename']
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        filepath = upload_path(filename)
+        if filepath is None:
+            return jsonify({'error': 'Nombre de archivo no válido'}), 400
+        upload_writer.wait(filepath)
 
         if not os.path.exists(filepath):
             return jsonify({'error': 'Archivo no encontrado'}), 404
+        version = gradcam_version(data)
+        if version is None:
+            return jsonify({'error': 'Modelo no encontrado'}), 404
+        storage.record(filename)
 
-        # Carpeta de salida
-        gradcam_folder = os.path.join(BASE_DIR, 'gradcam_outputs')
-        os.makedirs(gradcam_folder, exist_ok=True)
+        # Generar Grad-CAM para las clases con probabilidad >= 50%, con la
+        # versión que clasificó la imagen ("model" en el resultado)
+        # ("inline": true devuelve los heatmaps como data URLs, sin escribirlos en disco)
+        heatmaps = generate_gradcam_cached(filepath, filename, threshold=0.5, inline=bool(data.get('inline')),
+                                               version=version)
 
-        # Generar Grad-CAM para la clase más probable
-        from gradcam_module import generate_gradcam_image
-        gradcam_urls = generate_gradcam_image(image_path=filepath, filename=filename, model=model, device=device, class_names=CLASS_NAMES, output_folder=gradcam_folder, threshold=0.5)
-
-        return jsonify({'heatmap_urls': gradcam_urls}), 200
+        return jsonify(gradcam_payload(heatmaps)), 200
 
     except Exception as e:
         print(f"Error en /api/gradcam: {e}")
         return jsonify({'error': 'Error generando Grad-CAM'}), 500
 
-@app.route('/gradcam_outputs/<filename>')
+# Pool acotado para los trabajos Grad-CAM, separado de la inferencia en tiempo real
+gradcam_jobs = JobManager(
+    max_workers=app.config['GRADCAM_MAX_WORKERS'],
+    max_pending=app.config['GRADCAM_MAX_PENDING_JOBS'],
+    name='gradcam-job',
+    state_dir=os.path.join(GRADCAM_FOLDER, '.jobs')   # estado visible desde todos los workers
+)
+
+@app.route('/api/gradcam/jobs', methods=['POST'])
+def submit_gradcam_job():
+    """Encola la generación de Grad-CAM y devuelve inmediatamente el id del trabajo."""
+    try:
+        data = request.get_json()
+        if not data or 'filename' not in data:
+            return jsonify({'error': 'No se proporcionó el nombre de archivo'}), 400
+
+        filename = data['filename']
+        filepath = upload_path(filename)
+        if filepath is None:
+            return jsonify({'error': 'Nombre de archivo no válido'}), 400
+        upload_writer.wait(filepath)
+
+        if not os.path.exists(filepath):
+            return jsonify({'error': 'Archivo no encontrado'}), 404
+        version = gradcam_version(data)
+        if version is None:
+            return jsonify({'error': 'Modelo no encontrado'}), 404
+        storage.record(filename)
+
+        try:
+            job_id = gradcam_jobs.submit(generate_gradcam_cached, filepath, filename, threshold=0.5,
+                                         inline=bool(data.get('inline')), version=version)
+        except QueueFullError as e:
+            print(f"Trabajo Grad-CAM rechazado: {e}")
+            response = jsonify({'error': 'Demasiados trabajos Grad-CAM en cola. Inténtelo más tarde.'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+
+        return jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/api/gradcam/jobs/{job_id}'
+        }), 202
+
+    except Exception as e:
+        print(f"Error en /api/gradcam/jobs: {e}")
+        return jsonify({'error': 'Error encolando Grad-CAM'}), 500
+
+@app.route('/api/gradcam/jobs/<job_id>', methods=['GET'])
+def get_gradcam_job(job_id):
+    """Devuelve el estado de un trabajo Grad-CAM y, si terminó, las URLs de los heatmaps."""
+    job = gradcam_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    response = {'job_id': job_id, 'status': job['status']}
+    if job['status'] == 'done':
+        response.update(gradcam_payload(job['result']))
+    elif job['status'] == 'error':
+        response['error'] = 'Error generando Grad-CAM'
+    return jsonify(response), 200
+
+@app.route('/gradcam_outputs/<path:filename>')
 def serve_gradcam(filename):
     """Sirve los heatmaps Grad-CAM generados."""
-    gradcam_folder = os.path.join(BASE_DIR, 'gradcam_outputs')
-    return send_from_directory(gradcam_folder, filename)
+    storage.record(filename)
+    return send_from_directory(app.config['GRADCAM_FOLDER'], filename)
 
 # --- Arranque de la Aplicación ---
+# Modo desarrollo: `python app.py` (servidor de Werkzeug con recarga).
+# Modo producción: `gunicorn -c gunicorn.conf.py wsgi:application`; el modelo
+# se carga una vez en el proceso maestro (create_app) antes de crear los
+# workers, que comparten los pesos en copy-on-write, y cada worker ajusta
+# sus hilos con init_worker.
+def create_app(backend=None, quantization=None):
+    """Fábrica de la aplicación: carga el modelo (una sola vez) y devuelve la app Flask."""
+    if model is None:
+        load_model(backend=backend, quantization=quantization)
+        storage.start()               # Retención de archivos (más de STORAGE_MAX_AGE_HOURS)
+    return app
+
+def init_worker(intra_op_threads):
+    """Prepara un worker recién creado con fork: hilos intra-op y backends no compartibles."""
+    configure_threads(intra_op_threads)
+    app.config['INTRA_OP_THREADS'] = intra_op_threads
+
+    # Los hilos internos de ONNX Runtime no sobreviven al fork: se crea una
+    # sesión nueva en cada worker para cada versión (el modelo exportado ya está en disco).
+    model_registry.rebuild_backends(
+        lambda v: build_inference_backend('onnx', '', v.model, v.fingerprint, v.name) if v.backend.name == 'onnx' else v.backend
+    )
+
+    print(f"Worker {os.getpid()} listo (backend: {inference_backend.name}, hilos: {torch.get_num_threads()})")
+
 if __name__ == '__main__':
     try:
         load_model()  # Cargar el modelo al iniciar
         
         # Limpiar archivos antiguos al iniciar (opcional)
         print("Limpiando archivos antiguos al iniciar servidor...")
-        clean_uploads_folder()        # Limpia uploads
-        clean_gradcam_folder()        # Limpia gradcam_outputs
-        clean_old_files(hours=24)     # Elimina archivos de más de 24 horas
+        storage.clear()               # Limpia uploads y gradcam_outputs
+        storage.start()               # Retención de archivos en segundo plano
         
         print(f"Servidor iniciado. Carpeta uploads: {UPLOAD_FOLDER}")
         app.run(debug=True, host='127.0.0.1', port=5000)
@@ -0,0 +1,230 @@
+"""Punto de entrada ASGI para producción, con recepción asíncrona de las subidas.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 2
+
+Con gunicorn (gthread) cada petición a /classify ocupa un hilo durante toda
+la subida; unas pocas tablets subiendo por 4G pueden bloquear todos los hilos
+con la CPU ociosa. Aquí:
+  - POST /classify se recibe en el event loop: el cuerpo multipart se
+    procesa trozo a trozo con el parser sans-io de Werkzeug según llega, sin
+    ocupar ningún hilo mientras el cliente sube;
+  - la clasificación (decodificación + inferencia + guardado) se ejecuta con
+    la misma classify_uploads de app.py en un pool acotado
+    (ASGI_INFERENCE_WORKERS hilos, ASGI_MAX_PENDING peticiones como mucho).
+    Si la cola está llena se responde 503 con Retry-After en lugar de
+    encolar sin límite; si hay demasiadas subidas en recepción
+    (ASGI_MAX_UPLOADS), 429;
+  - el resto de rutas de Flask se sirven con un puente WSGI mínimo en un
+    pool de ASGI_WSGI_THREADS hilos (el cuerpo se recibe antes en el event loop).
+
+El WebSocket de la cámara (flask-sock) solo existe con el servidor WSGI: aquí
+se rechaza y el navegador usa POST /classify/camera/raw.
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.datastructures import FileStorage, Headers, MultiDict
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+from app import classify_uploads, create_app, stage_timer
+from jobs_module import BoundedExecutor, QueueFullError
+
+flask_app = create_app()
+inference_executor = BoundedExecutor(flask_app.config['ASGI_INFERENCE_WORKERS'],
+                                     flask_app.config['ASGI_MAX_PENDING'], name='asgi-inference')
+wsgi_executor = ThreadPoolExecutor(max_workers=flask_app.config['ASGI_WSGI_THREADS'], thread_name_prefix='asgi-wsgi')
+receiving_uploads = 0   # subidas en recepción; solo se modifica desde el event loop
+
+
+# --- Utilidades ASGI ---
+def header(scope, name):
+    """Valor de una cabecera de la petición (o '')."""
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+
+async def send_json(send, payload, status, headers=()):
+    body = flask_app.json.dumps(payload).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode())] + list(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_body(receive):
+    """Cuerpo completo de la petición; None si el cliente se desconecta."""
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def receive_multipart(receive, boundary):
+    """Recibe y analiza un cuerpo multipart/form-data a medida que llega.
+
+    Devuelve (files, form) como MultiDict de FileStorage y de str, o
+    (None, None) si el cliente se desconecta.
+    """
+    decoder = MultipartDecoder(boundary)
+    files, form = MultiDict(), MultiDict()
+    part, chunks = None, []
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None, None
+        more_body = message.get('more_body', False)
+        decoder.receive_data(message.get('body', b''))
+        if not more_body:
+            decoder.receive_data(None)
+
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, (Field, File)):
+                part, chunks = event, []
+            elif isinstance(event, Data):
+                chunks.append(event.data)
+                if not event.more_data:
+                    data = b''.join(chunks)
+                    if isinstance(part, File):
+                        files.add(part.name, FileStorage(io.BytesIO(data), filename=part.filename,
+                                                         name=part.name, headers=Headers(part.headers)))
+                    else:
+                        form.add(part.name, data.decode('utf-8', 'replace'))
+            event = decoder.next_event()
+        if isinstance(event, Epilogue):
+            break
+    return files, form
+
+
+# --- /classify asíncrono ---
+async def classify(scope, receive, send):
+    global receiving_uploads
+    content_type, options = parse_options_header(header(scope, b'content-type'))
+    if content_type != 'multipart/form-data' or not options.get('boundary'):
+        return await send_json(send, {'error': 'No se encontraron archivos en la solicitud'}, 400)
+    if receiving_uploads >= flask_app.config['ASGI_MAX_UPLOADS']:
+        return await send_json(send, {'error': 'Demasiadas subidas simultáneas, inténtalo de nuevo'}, 429,
+                               [(b'retry-after', str(inference_executor.retry_after()).encode())])
+
+    receiving_uploads += 1
+    try:
+        with stage_timer('classify', 'receive'):
+            files, form = await receive_multipart(receive, options['boundary'].encode('latin-1'))
+    except ValueError as e:
+        return await send_json(send, {'error': f'Cuerpo multipart inválido: {e}'}, 400)
+    finally:
+        receiving_uploads -= 1
+    if files is None:
+        return   # el cliente se desconectó durante la subida
+    if 'files' not in files:
+        return await send_json(send, {'error': 'No se encontraron archivos en la solicitud'}, 400)
+
+    try:
+        future = inference_executor.submit(classify_uploads, files.getlist('files'), form)
+    except QueueFullError as e:
+        print(f"/classify rechazada: {e}")
+        return await send_json(send, {'error': 'Servidor ocupado, inténtalo de nuevo más tarde'}, 503,
+                               [(b'retry-after', str(inference_executor.retry_after()).encode())])
+    payload, status = await asyncio.wrap_future(future)
+    with stage_timer('classify', 'serialize'):
+        await send_json(send, payload, status)
+
+
+# --- Puente WSGI para el resto de rutas ---
+def build_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def call_wsgi(scope, receive, send):
+    body = await read_body(receive)
+    if body is None:
+        return
+    environ = build_environ(scope, body)
+    loop = asyncio.get_running_loop()
+
+    def run():
+        # Se ejecuta en wsgi_executor; cada trozo de la respuesta se envía por el event loop
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        result = flask_app(environ, start_response)
+        try:
+            started = False
+            for chunk in result:
+                if not started:
+                    emit({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+                    started = True
+                if chunk:
+                    emit({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not started:
+                emit({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+            emit({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    await loop.run_in_executor(wsgi_executor, run)
+
+
+# --- Aplicación ---
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                inference_executor.shutdown(wait=False)
+                wsgi_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    elif scope['type'] == 'websocket':
+        # Sin WebSocket en este servidor: el navegador pasa a POST binario
+        await send({'type': 'websocket.close', 'code': 1000})
+    elif scope['method'] == 'POST' and scope['path'] == '/classify':
+        await classify(scope, receive, send)
+    else:
+        await call_wsgi(scope, receive, send)
@@ -0,0 +1,109 @@
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Cola de inferencia que agrupa peticiones concurrentes en lotes."""
+    # Cada petición se encola junto con un Future. Un hilo de fondo toma la
+    # primera petición disponible y sigue recogiendo las que lleguen dentro
+    # de la ventana (window_ms) hasta completar max_batch_size. El lote se
+    # procesa con una única llamada a run_batch(items), que debe devolver una
+    # lista de resultados en el mismo orden, y cada resultado se entrega al
+    # Future de la petición que lo espera.
+
+    def __init__(self, run_batch, max_batch_size=8, window_ms=20, name='batcher'):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.window_ms = max(0.0, float(window_ms))
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        # Métricas
+        self._batch_size_histogram = defaultdict(int)
+        self._queue_depth_histogram = defaultdict(int)
+        self._max_queue_depth = 0
+        self._total_batches = 0
+        self._total_items = 0
+
+    def _ensure_started(self):
+        """Arranca el hilo de fondo (también tras un fork del proceso)."""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit(self, item, timeout=None):
+        """Encola un elemento y bloquea hasta obtener su resultado."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future.result(timeout=timeout)
+
+    def _collect_batch(self):
+        """Espera la primera petición y agrupa las que llegan dentro de la ventana."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # Ventana agotada: solo se agrupa lo que ya está en la cola
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect_batch()
+            queue_depth = self._queue.qsize()
+
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+
+            try:
+                results = self.run_batch(items)
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+            except Exception as e:
+                print(f"Error procesando lote en {self.name}: {e}")
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+
+            with self._lock:
+                self._batch_size_histogram[len(batch)] += 1
+                self._queue_depth_histogram[queue_depth] += 1
+                self._max_queue_depth = max(self._max_queue_depth, queue_depth)
+                self._total_batches += 1
+                self._total_items += len(batch)
+
+    def get_stats(self):
+        """Devuelve la configuración y las métricas de la cola."""
+        with self._lock:
+            return {
+                'window_ms': self.window_ms,
+                'max_batch_size': self.max_batch_size,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'total_batches': self._total_batches,
+                'total_items': self._total_items,
+                'avg_batch_size': round(self._total_items / self._total_batches, 2) if self._total_batches else 0,
+                'batch_size_histogram': dict(sorted(self._batch_size_histogram.items())),
+                'queue_depth_histogram': dict(sorted(self._queue_depth_histogram.items()))
+            }
@@ -0,0 +1,142 @@
+"""Benchmark de decodificación: ruta original vs decodificación reducida (draft).
+
+Compara, para imágenes grandes, el tiempo de decodificación + preprocesamiento
+y el pico de memoria (RSS) de:
+  - full:  Image.open(...).convert('RGB') + transform (ruta anterior)
+  - draft: preprocessing_module.load_tensor (Image.draft + reduce + transform)
+
+Cada modo se ejecuta en un subproceso propio para que el pico de RSS no se
+contamine entre modos. Si no se indican imágenes, se generan JPEG sintéticos.
+
+Uso:
+    python benchmarks/bench_decode.py [--images a.jpg b.jpg] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+SYNTHETIC_SIZES = {
+    'VGA': (640, 480),
+    '12MP': (4000, 3000),
+    '24MP': (6000, 4000),
+}
+
+
+def make_synthetic_jpeg(width, height, folder):
+    """Genera un JPEG sintético (gradiente + ruido) del tamaño indicado."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    noise = rng.normal(0, 20, size=(height, width, 3)).astype(np.float32)
+    array = np.clip(base + noise, 0, 255).astype(np.uint8)
+
+    path = os.path.join(folder, f"synthetic_{width}x{height}.jpg")
+    Image.fromarray(array).save(path, quality=90)
+    return path
+
+
+def reset_peak_rss():
+    """Reinicia el pico de RSS del proceso (Linux >= 4.0); devuelve False si no es posible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb():
+    """Pico de RSS del proceso en KB (VmHWM, o ru_maxrss como alternativa)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def current_rss_kb():
+    """RSS actual del proceso en KB."""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def run_mode(mode, image_path, repeat):
+    """Ejecuta un modo dentro del proceso actual y devuelve sus métricas."""
+    from PIL import Image
+    from preprocessing_module import load_tensor, transform
+
+    def decode_full(path):
+        return transform(Image.open(path).convert('RGB'))
+
+    decode = decode_full if mode == 'full' else load_tensor
+
+    # Tras las importaciones (torch eleva mucho el pico), se reinicia el pico
+    # para medir solo la decodificación.
+    reset_peak_rss()
+    baseline_kb = current_rss_kb()
+    times = []
+    tensor = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tensor = decode(image_path)
+        times.append(time.perf_counter() - start)
+    peak_kb = peak_rss_kb()
+
+    return {
+        'mode': mode,
+        'mean_ms': round(1000 * sum(times) / len(times), 2),
+        'min_ms': round(1000 * min(times), 2),
+        'peak_rss_delta_mb': round((peak_kb - baseline_kb) / 1024, 1),
+        'tensor_checksum': float(tensor.abs().sum()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', nargs='*', help='Imágenes a medir (por defecto, JPEG sintéticos)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'IMAGE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(args.child[0], args.child[1], args.repeat)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images = args.images or [make_synthetic_jpeg(w, h, tmp) for w, h in SYNTHETIC_SIZES.values()]
+        report = []
+        for image_path in images:
+            entry = {'image': os.path.basename(image_path), 'modes': {}}
+            for mode in ('full', 'draft'):
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--child', mode, image_path, '--repeat', str(args.repeat)],
+                    check=True, capture_output=True, text=True
+                ).stdout
+                entry['modes'][mode] = json.loads(output.strip().splitlines()[-1])
+            full, draft = entry['modes']['full'], entry['modes']['draft']
+            entry['speedup'] = round(full['mean_ms'] / draft['mean_ms'], 2) if draft['mean_ms'] else None
+            report.append(entry)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
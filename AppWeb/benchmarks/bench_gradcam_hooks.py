@@ -0,0 +1,95 @@
+"""Comprobación de regresión: la latencia de inferencia no debe degradarse tras Grad-CAM.
+
+Mide la latencia de inferencia del modelo, ejecuta N cálculos de Grad-CAM
+sobre el mismo modelo y vuelve a medir. Falla (código de salida 1) si quedan
+hooks registrados en el modelo o si la latencia empeora más de la tolerancia.
+Si no existe best_resnet_multilabel_v5.pt se usan pesos aleatorios.
+
+Uso:
+    python benchmarks/bench_gradcam_hooks.py [--gradcam-calls 20] [--tolerance 0.15]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import torch
+import torch.nn as nn
+from torchvision.models import resnet50
+
+from gradcam_module import get_gradcam_engine
+
+CLASS_COUNT = 6
+MODEL_FILENAME = 'best_resnet_multilabel_v5.pt'
+
+
+def build_model():
+    """Construye el modelo de la aplicación, con pesos entrenados si están disponibles."""
+    model = resnet50(weights=None)
+    model.fc = nn.Sequential(nn.Linear(model.fc.in_features, CLASS_COUNT), nn.Sigmoid())
+    for folder in (APP_DIR, os.path.dirname(APP_DIR)):
+        path = os.path.join(folder, MODEL_FILENAME)
+        if os.path.exists(path):
+            model.load_state_dict(torch.load(path, map_location='cpu'))
+            break
+    return model.eval()
+
+
+def count_hooks(model):
+    """Número total de hooks de forward/backward registrados en el modelo."""
+    return sum(
+        len(module._forward_hooks) + len(module._forward_pre_hooks) + len(module._backward_hooks)
+        for module in model.modules()
+    )
+
+
+def measure_latency(model, x, runs):
+    """Mediana de la latencia de inferencia (ms)."""
+    times = []
+    with torch.no_grad():
+        model(x)  # calentamiento
+        for _ in range(runs):
+            start = time.perf_counter()
+            model(x)
+            times.append(time.perf_counter() - start)
+    return 1000 * statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--gradcam-calls', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Empeoramiento relativo máximo permitido')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = build_model()
+    x = torch.randn(1, 3, 224, 224)
+
+    before_ms = measure_latency(model, x, args.runs)
+    engine = get_gradcam_engine(model)
+    for _ in range(args.gradcam_calls):
+        engine.compute(x, threshold=0.0)
+    after_ms = measure_latency(model, x, args.runs)
+
+    hooks = count_hooks(model)
+    ratio = after_ms / before_ms
+    report = {
+        'gradcam_calls': args.gradcam_calls,
+        'latency_before_ms': round(before_ms, 2),
+        'latency_after_ms': round(after_ms, 2),
+        'ratio': round(ratio, 3),
+        'hooks_left': hooks,
+        'passed': hooks == 0 and ratio <= 1 + args.tolerance,
+    }
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report['passed'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Prueba de extremo a extremo de la ingesta de vídeo (/api/streams) con un archivo local.
+
+Genera un MP4 sintético con tres tramos: escena estática A, escena que cambia
+en cada frame y escena estática B. Lo registra como stream a través del test
+client de Flask, espera a que termine y comprueba que:
+  - se muestrean los frames esperados según sample_fps,
+  - los frames de los tramos estáticos se saltan como duplicados,
+  - los frames inferidos llegan a las estadísticas y a results_store
+    (source='stream') de la sesión actual.
+
+Imprime un informe JSON con los contadores y el throughput, y termina con
+código 1 si alguna comprobación falla. Si no existe best_resnet_multilabel_v5.pt
+se usan pesos aleatorios (ALLOW_RANDOM_WEIGHTS=1); la base de datos y el
+vídeo se crean en una carpeta temporal.
+
+Uso:
+    python benchmarks/bench_ingest.py [--video video.mp4] [--sample-fps 2] [--batch-size 4]
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+# Duración (s) de cada tramo del vídeo sintético: (estático A, cambiante, estático B)
+SEGMENTS = (4, 2, 4)
+
+
+def make_synthetic_video(path, fps=25, size=(640, 480)):
+    """Escribe el vídeo sintético y devuelve cuántos frames tiene."""
+    import cv2
+    import numpy as np
+
+    width, height = size
+    rng = np.random.default_rng(0)
+
+    def blocks():
+        # Bloques grandes de color: la diferencia sobrevive a la miniatura de 32x32
+        grid = rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)
+        return cv2.resize(grid, (width, height), interpolation=cv2.INTER_NEAREST)
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    scene_a, scene_b = blocks(), blocks()
+    frames = 0
+    for seconds, scene in zip(SEGMENTS, (scene_a, None, scene_b)):
+        for _ in range(seconds * fps):
+            writer.write(scene if scene is not None else blocks())
+            frames += 1
+    writer.release()
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', help='Vídeo propio en lugar del sintético (sin comprobaciones de conteo)')
+    parser.add_argument('--sample-fps', type=float, default=2.0)
+    parser.add_argument('--diff-threshold', type=float, default=4.0)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--timeout', type=float, default=300, help='Segundos máximos de espera')
+    parser.add_argument('--verbose', action='store_true', help='Mostrar los mensajes de la aplicación')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video_folder = os.path.dirname(os.path.abspath(args.video)) if args.video else tmp
+        os.environ.setdefault('ALLOW_RANDOM_WEIGHTS', '1')
+        os.environ['INGEST_VIDEO_FOLDER'] = video_folder
+        os.environ['RESULTS_DB_PATH'] = os.path.join(tmp, 'results.db')
+        os.environ['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+        os.environ['GRADCAM_FOLDER'] = os.path.join(tmp, 'gradcam_outputs')
+        os.environ['INGEST_STATE'] = os.path.join(tmp, 'ingest_streams.json')
+
+        if args.video:
+            video_name, total_frames = os.path.basename(args.video), None
+        else:
+            video_name = 'synthetic.mp4'
+            total_frames = make_synthetic_video(os.path.join(tmp, video_name))
+
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+        with quiet:
+            import app as cdw_app
+            from ingest_module import FINAL_STATES
+            cdw_app.load_model()
+            client = cdw_app.app.test_client()
+
+            start = time.perf_counter()
+            response = client.post('/api/streams', json={
+                'source': video_name, 'stream_id': 'bench',
+                'sample_fps': args.sample_fps, 'diff_threshold': args.diff_threshold,
+                'batch_size': args.batch_size
+            })
+            if response.status_code != 201:
+                raise SystemExit(f"No se pudo arrancar el stream: {response.get_json()}")
+            # El estado llega por la API, como lo vería cualquier worker
+            status = client.get('/api/streams/bench').get_json()
+            while status['state'] not in FINAL_STATES and time.perf_counter() - start < args.timeout:
+                time.sleep(0.2)
+                status = client.get('/api/streams/bench').get_json()
+            elapsed = time.perf_counter() - start
+
+            cdw_app.results_store.flush()
+            stored = cdw_app.results_store.count(session_id=cdw_app.results_store.current_session())
+            stats_total = cdw_app.stats.summary()['total']
+            client.delete('/api/streams/bench')
+
+    report = {
+        'video': video_name,
+        'elapsed_s': round(elapsed, 2),
+        'frames_per_s': round(status['frames_read'] / elapsed, 1) if elapsed > 0 else 0,
+        'stored_results': stored,
+        'stats_total': stats_total,
+        'stream': status,
+    }
+
+    checks = {
+        'finished': status['state'] == 'finished',
+        'results_match_inferred': stored == stats_total == status['frames_inferred'],
+    }
+    if total_frames is not None:
+        duration = sum(SEGMENTS)
+        changing = SEGMENTS[1] * args.sample_fps
+        checks.update({
+            'all_frames_read': status['frames_read'] == total_frames,
+            'sampled_at_rate': abs(status['frames_sampled'] - duration * args.sample_fps) <= 1,
+            # Un frame por tramo estático más los del tramo cambiante (±1 en las transiciones)
+            'duplicates_skipped': abs(status['frames_inferred'] - (changing + 2)) <= 1,
+        })
+    report['checks'] = checks
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Microbenchmark de la etapa de postprocesado (de probabilidades a JSON).
+
+Mide, por resultado y sin pasar por el modelo, sobre vectores sigmoid
+aleatorios:
+  - detailed_probs: lista de probabilidades por clase de /classify, con el
+    bucle original (búsquedas en diccionarios + sort) frente a
+    app.build_detailed_probs (tabla de metadatos + argsort);
+  - camera_result: resultado de /classify/camera con la construcción
+    original (búsquedas + strftime por frame) frente a
+    app.build_camera_result, en modo completo y compacto;
+  - serialize: el resultado de cámara con el codificador de Flask (json)
+    frente a orjson, si está instalado.
+
+También comprueba que build_detailed_probs da exactamente la misma lista que
+el bucle original (incluidos los empates). Imprime un informe JSON con los
+microsegundos por resultado y termina con código 1 si la comprobación falla.
+
+Uso:
+    python benchmarks/bench_postprocess.py [--iterations 20000]
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+
+def legacy_detailed_probs(cdw_app, all_probs):
+    """build_detailed_probs tal como estaba antes de la tabla de metadatos."""
+    detailed_probs = []
+    for i, prob in enumerate(all_probs):
+        detailed_probs.append({
+            'class_name': cdw_app.CLASS_NAMES[i],
+            'display_name': cdw_app.CLASS_DISPLAY_NAMES.get(cdw_app.CLASS_NAMES[i], cdw_app.CLASS_NAMES[i].capitalize()),
+            'probability': float(prob) * 100
+        })
+    detailed_probs.sort(key=lambda x: x['probability'], reverse=True)
+    return detailed_probs
+
+
+def legacy_camera_result(cdw_app, all_probs, reused, model_name):
+    """Resultado de cámara tal como se construía antes de la tabla de metadatos."""
+    pred_index = int(all_probs.argmax())
+    confidence = float(all_probs[pred_index]) * 100
+    predicted_class = cdw_app.CLASS_NAMES[pred_index]
+    return {
+        'predicted_class': predicted_class,
+        'display_name': cdw_app.CLASS_DISPLAY_NAMES.get(predicted_class, predicted_class.capitalize()),
+        'confidence': confidence,
+        'emoji': cdw_app.CLASS_EMOJIS.get(predicted_class, '📦'),
+        'color': cdw_app.CLASS_COLORS.get(predicted_class, '#34495e'),
+        'reused': reused,
+        'model': model_name,
+        'timestamp': datetime.now().strftime("%H:%M:%S")
+    }
+
+
+def per_call_us(func, inputs):
+    """Microsegundos medios por llamada de func sobre cada elemento de inputs."""
+    start = time.perf_counter()
+    for item in inputs:
+        func(item)
+    return round((time.perf_counter() - start) / len(inputs) * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    import numpy as np
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['RESULTS_DB_PATH'] = os.path.join(tmp, 'results.db')
+        os.environ['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+        os.environ['GRADCAM_FOLDER'] = os.path.join(tmp, 'gradcam_outputs')
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            import app as cdw_app
+            from flask.json.provider import DefaultJSONProvider
+            from json_module import OrjsonProvider, orjson
+
+        rng = np.random.default_rng(0)
+        probs = list(rng.random((args.iterations, len(cdw_app.CLASS_NAMES)), dtype=np.float32))
+        # Algunos vectores con empates para la comprobación de orden
+        ties = [np.array([0.5, 0.5, 0.1, 0.5, 0.0, 0.1], dtype=np.float32)[:len(cdw_app.CLASS_NAMES)]]
+
+        identical = all(cdw_app.build_detailed_probs(p) == legacy_detailed_probs(cdw_app, p)
+                        for p in probs[:1000] + ties)
+
+        report = {
+            'iterations': args.iterations,
+            'detailed_probs_us': {
+                'legacy': per_call_us(lambda p: legacy_detailed_probs(cdw_app, p), probs),
+                'vectorized': per_call_us(cdw_app.build_detailed_probs, probs),
+            },
+            'camera_result_us': {
+                'legacy': per_call_us(lambda p: legacy_camera_result(cdw_app, p, False, 'bench'), probs),
+                'full': per_call_us(lambda p: cdw_app.build_camera_result(p, False, 'bench'), probs),
+                'compact': per_call_us(lambda p: cdw_app.build_camera_result(p, False, 'bench', compact=True), probs),
+            },
+        }
+
+        results = {
+            'full': [{'result': cdw_app.build_camera_result(p, False, 'bench')} for p in probs],
+            'compact': [{'result': cdw_app.build_camera_result(p, False, 'bench', compact=True)} for p in probs],
+        }
+        providers = {'json': DefaultJSONProvider(cdw_app.app)}
+        if orjson is not None:
+            providers['orjson'] = OrjsonProvider(cdw_app.app)
+        report['serialize_us'] = {
+            f"{mode}_{name}": per_call_us(provider.dumps, payloads)
+            for mode, payloads in results.items()
+            for name, provider in providers.items()
+        }
+        report['payload_bytes'] = {mode: len(providers['json'].dumps(payloads[0]).encode('utf-8'))
+                                   for mode, payloads in results.items()}
+        report['checks'] = {
+            'detailed_probs_identical': identical,
+            'orjson_matches_json': orjson is None or all(
+                json.loads(providers['orjson'].dumps(p)) == json.loads(providers['json'].dumps(p))
+                for p in results['full'][:1000] + results['compact'][:1000]),
+        }
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    sys.exit(0 if all(report['checks'].values()) else 1)
+
+
+if __name__ == '__main__':
+    main()
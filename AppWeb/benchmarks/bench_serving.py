@@ -0,0 +1,110 @@
+"""Benchmark de throughput HTTP contra un servidor en marcha.
+
+Envía la misma imagen a un endpoint con N clientes concurrentes durante un
+tiempo fijo y mide peticiones por segundo y latencias. Sirve para comparar el
+servidor de desarrollo con el modo producción:
+
+    python app.py                                        # desarrollo
+    gunicorn -c gunicorn.conf.py wsgi:application        # producción
+
+    python benchmarks/bench_serving.py --url http://127.0.0.1:5000 --concurrency 8 --duration 30
+
+Solo usa la biblioteca estándar.
+"""
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IMAGE = os.path.join(APP_DIR, 'test images', '10.jpg')
+
+
+def multipart_body(image_bytes, filename):
+    """Cuerpo multipart/form-data con el campo 'files'."""
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + image_bytes + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--endpoint', default='/classify/camera', choices=['/classify/camera', '/classify'])
+    parser.add_argument('--image', default=DEFAULT_IMAGE)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--label', default='', help='Etiqueta del servidor medido (p. ej. dev, gunicorn)')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        body, content_type = multipart_body(f.read(), os.path.basename(args.image))
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def client():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            request = urllib.request.Request(args.url + args.endpoint, data=body,
+                                             headers={'Content-Type': content_type})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=120) as response:
+                    response.read()
+                ok = True
+            except (urllib.error.URLError, OSError):
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    report = {
+        'label': args.label,
+        'endpoint': args.endpoint,
+        'concurrency': args.concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'latency_ms': {
+            'mean': round(1000 * statistics.mean(latencies), 1) if latencies else 0,
+            'p50': round(1000 * percentile(latencies, 50), 1),
+            'p95': round(1000 * percentile(latencies, 95), 1),
+            'p99': round(1000 * percentile(latencies, 99), 1),
+        }
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
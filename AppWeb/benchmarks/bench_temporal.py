@@ -0,0 +1,71 @@
+"""Comprobación del estado temporal de la cámara (reutilización + EMA) ante un cambio de escena.
+
+Simula un stream con una escena estática A seguida de una escena estática B
+y pasa cada frame por temporal_module.StreamState con una inferencia
+simulada (A → clase 0, B → clase 1), sin cargar el modelo. Comprueba que:
+  - los frames estáticos se reutilizan (casi ninguno pasa por el modelo),
+  - tras el cambio a B la etiqueta suavizada cambia en pocos frames, y no
+    solo cuando max_reuse_frames obliga a inferir de nuevo.
+
+Imprime un informe JSON y termina con código 1 si alguna comprobación falla.
+
+Uso:
+    python benchmarks/bench_temporal.py [--frames 60] [--ema-alpha 0.3] [--max-reuse 30] [--max-flip-frames 5]
+"""
+import argparse
+import json
+import os
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=60, help='Frames de cada escena')
+    parser.add_argument('--ema-alpha', type=float, default=0.3)
+    parser.add_argument('--max-reuse', type=int, default=30)
+    parser.add_argument('--max-flip-frames', type=int, default=5,
+                        help='Frames máximos tras el cambio de escena hasta que cambia la etiqueta')
+    args = parser.parse_args()
+
+    import numpy as np
+    import torch
+    from temporal_module import StreamState
+
+    scene_a = torch.full((3, 224, 224), -1.0)
+    scene_b = torch.full((3, 224, 224), 1.0)
+
+    def infer(img_t):
+        probs = np.full(6, 0.05, dtype=np.float32)
+        probs[0 if float(img_t.mean()) < 0 else 1] = 0.95
+        return probs
+
+    state = StreamState(ema_alpha=args.ema_alpha, max_reuse_frames=args.max_reuse)
+    labels, reused = [], []
+    for scene in [scene_a] * args.frames + [scene_b] * args.frames:
+        probs, was_reused = state.process(scene, infer)
+        labels.append(int(np.argmax(probs)))
+        reused.append(was_reused)
+
+    after_change = labels[args.frames:]
+    flip_frames = after_change.index(1) + 1 if 1 in after_change else None
+    report = {
+        'frames': len(labels),
+        'inferred': state.inferred,
+        'reused': sum(reused),
+        'label_flip_frames': flip_frames,
+        'checks': {
+            'static_frames_reused': sum(reused[:args.frames]) >= 0.9 * args.frames,
+            'label_flips_quickly': flip_frames is not None and flip_frames <= args.max_flip_frames,
+            'label_stays_flipped': flip_frames is not None and all(label == 1 for label in after_change[flip_frames - 1:]),
+        }
+    }
+
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if all(report['checks'].values()) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Suite de benchmarks reproducible para los caminos de inferencia y HTTP.
+
+Genera imágenes JPEG sintéticas de VGA a 24 MP y mide, dentro del proceso:
+  - funciones: predict_image (normal y por teselas), el camino de cámara
+    (decode + transform + micro-batching) y generate_gradcam_image, por resolución;
+  - HTTP: /classify, /classify/camera y /api/gradcam a través del test
+    client de Flask, con los niveles de concurrencia indicados.
+
+Cada escenario reporta throughput, latencias p50/p95/p99 y pico de RSS en
+JSON, para comparar backends y detectar regresiones. Si no existe
+best_resnet_multilabel_v5.pt se usan pesos aleatorios (ALLOW_RANDOM_WEIGHTS=1),
+de modo que funciona en cualquier máquina Linux solo con CPU. Las cachés de
+predicciones y Grad-CAM se desactivan salvo con --with-cache, y las
+subidas y heatmaps se escriben en una carpeta temporal.
+
+Uso:
+    python benchmarks/run_benchmarks.py [--backend eager|torchscript|onnx] [--quantization static]
+        [--sizes VGA 2MP 12MP] [--repeat 5] [--concurrency 1 4] [--requests 32] [--output informe.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from bench_decode import current_rss_kb, make_synthetic_jpeg, peak_rss_kb, reset_peak_rss
+from bench_serving import percentile
+
+SYNTHETIC_SIZES = {
+    'VGA': (640, 480),
+    '2MP': (1600, 1200),
+    '8MP': (3264, 2448),
+    '12MP': (4000, 3000),
+    '24MP': (6000, 4000),
+}
+HTTP_ENDPOINTS = ('/classify', '/classify/camera', '/api/gradcam')
+
+
+def summarize(latencies, elapsed, errors=0, baseline_kb=0):
+    """Métricas de un escenario a partir de las latencias (s) y el tiempo total."""
+    peak_kb = peak_rss_kb()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_per_s': round(len(latencies) / elapsed, 2) if elapsed > 0 else 0,
+        'latency_ms': {
+            'mean': round(1000 * sum(latencies) / len(latencies), 1) if latencies else 0,
+            'p50': round(1000 * percentile(latencies, 50), 1),
+            'p95': round(1000 * percentile(latencies, 95), 1),
+            'p99': round(1000 * percentile(latencies, 99), 1),
+        },
+        'peak_rss_mb': round(peak_kb / 1024, 1),
+        'peak_rss_delta_mb': round((peak_kb - baseline_kb) / 1024, 1),
+    }
+
+
+def measure(func, repeat):
+    """Ejecuta func() `repeat` veces y devuelve el resumen del escenario."""
+    reset_peak_rss()
+    baseline_kb = current_rss_kb()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        call_start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_start)
+    return summarize(latencies, time.perf_counter() - start, baseline_kb=baseline_kb)
+
+
+def run_function_benchmarks(cdw_app, images, repeat, threshold):
+    """Mide predict_image (normal y por teselas), el camino de cámara y generate_gradcam_image por resolución."""
+    from gradcam_module import generate_gradcam_image
+
+    results = []
+    for label, path in images.items():
+        with open(path, 'rb') as f:
+            image_bytes = f.read()
+
+        def camera_path():
+            tensor = cdw_app.transform(cdw_app.decode_image(image_bytes))
+            return cdw_app.camera_batcher.submit((cdw_app.model_registry.active(), tensor))
+
+        def gradcam():
+            return generate_gradcam_image(image_path=path, filename=os.path.basename(path),
+                                          model=cdw_app.model, device=cdw_app.device,
+                                          class_names=cdw_app.CLASS_NAMES,
+                                          output_folder=cdw_app.app.config['GRADCAM_FOLDER'],
+                                          threshold=threshold,
+                                          max_size=cdw_app.app.config['GRADCAM_MAX_SIZE'],
+                                          image_format=cdw_app.app.config['GRADCAM_IMAGE_FORMAT'],
+                                          quality=cdw_app.app.config['GRADCAM_QUALITY'])
+
+        scenarios = {
+            'predict_image': lambda: cdw_app.predict_image(path),
+            'predict_image_tiled': lambda: cdw_app.predict_image(path, tiling=cdw_app.tiling_options()),
+            'camera_path': camera_path,
+            'generate_gradcam_image': gradcam,
+        }
+        for name, func in scenarios.items():
+            func()   # calentamiento
+            results.append({'scenario': name, 'image': label, **measure(func, repeat)})
+    return results
+
+
+def upload_for_gradcam(client, image_bytes):
+    """Sube una imagen por /classify y devuelve el nombre con el que quedó guardada."""
+    response = client.post('/classify', data={'files': (io.BytesIO(image_bytes), 'bench.jpg')},
+                           content_type='multipart/form-data')
+    return response.get_json()['results'][0]['stored_name']
+
+
+def run_http_benchmark(cdw_app, endpoint, image_bytes, concurrency, total_requests):
+    """Lanza total_requests peticiones con `concurrency` clientes del test client de Flask."""
+    gradcam_filename = None
+    if endpoint == '/api/gradcam':
+        gradcam_filename = upload_for_gradcam(cdw_app.app.test_client(), image_bytes)
+
+    def one_request(_):
+        client = cdw_app.app.test_client()
+        start = time.perf_counter()
+        if gradcam_filename:
+            response = client.post(endpoint, json={'filename': gradcam_filename})
+        else:
+            response = client.post(endpoint, data={'files': (io.BytesIO(image_bytes), 'bench.jpg')},
+                                   content_type='multipart/form-data')
+        return response.status_code == 200, time.perf_counter() - start
+
+    one_request(None)   # calentamiento
+    reset_peak_rss()
+    baseline_kb = current_rss_kb()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one_request, range(total_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for ok, latency in outcomes if ok]
+    errors = sum(1 for ok, _ in outcomes if not ok)
+    return {'endpoint': endpoint, 'concurrency': concurrency,
+            **summarize(latencies, elapsed, errors=errors, baseline_kb=baseline_kb)}
+
+
+def environment_info(cdw_app):
+    import torch
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'intra_op_threads': torch.get_num_threads(),
+        'device': str(cdw_app.device),
+        'inference_backend': cdw_app.inference_backend.name,
+        'random_weights': cdw_app.model_fingerprint == 'random-seed0',
+        'cache_enabled': cdw_app.app.config['PREDICTION_CACHE_MAX_MB'] > 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', default=None, help='Backend de inferencia (por defecto, INFERENCE_BACKEND)')
+    parser.add_argument('--quantization', default=None, choices=['', 'static'])
+    parser.add_argument('--sizes', nargs='+', default=list(SYNTHETIC_SIZES), choices=list(SYNTHETIC_SIZES))
+    parser.add_argument('--repeat', type=int, default=5, help='Repeticiones por escenario de función')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Umbral de clases para Grad-CAM')
+    parser.add_argument('--http-size', default='2MP', choices=list(SYNTHETIC_SIZES),
+                        help='Resolución de la imagen enviada en los escenarios HTTP')
+    parser.add_argument('--endpoints', nargs='+', default=list(HTTP_ENDPOINTS), choices=HTTP_ENDPOINTS)
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--requests', type=int, default=32, help='Peticiones por escenario HTTP')
+    parser.add_argument('--skip-functions', action='store_true')
+    parser.add_argument('--skip-http', action='store_true')
+    parser.add_argument('--with-cache', action='store_true', help='Mantener activas las cachés por contenido')
+    parser.add_argument('--output', help='Ruta donde guardar el informe JSON')
+    parser.add_argument('--verbose', action='store_true', help='Mostrar los mensajes de la aplicación')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # La configuración de la aplicación se lee al importarla
+        os.environ.setdefault('ALLOW_RANDOM_WEIGHTS', '1')
+        os.environ['UPLOAD_FOLDER'] = os.path.join(tmp, 'uploads')
+        os.environ['GRADCAM_FOLDER'] = os.path.join(tmp, 'gradcam_outputs')
+        if not args.with_cache:
+            os.environ['PREDICTION_CACHE_MAX_MB'] = '0'
+            os.environ['GRADCAM_CACHE_MAX_MB'] = '0'
+            os.environ.pop('CACHE_DISK_FOLDER', None)
+
+        sizes = set(args.sizes) | (set() if args.skip_http else {args.http_size})
+        images = {label: make_synthetic_jpeg(*SYNTHETIC_SIZES[label], tmp)
+                  for label in SYNTHETIC_SIZES if label in sizes}
+
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+        with quiet:
+            import app as cdw_app
+            cdw_app.load_model(backend=args.backend, quantization=args.quantization)
+
+            report = {'environment': environment_info(cdw_app), 'functions': [], 'http': []}
+            if not args.skip_functions:
+                function_images = {label: images[label] for label in args.sizes}
+                report['functions'] = run_function_benchmarks(cdw_app, function_images, args.repeat, args.threshold)
+
+            if not args.skip_http:
+                with open(images[args.http_size], 'rb') as f:
+                    image_bytes = f.read()
+                for endpoint in args.endpoints:
+                    for concurrency in args.concurrency:
+                        result = run_http_benchmark(cdw_app, endpoint, image_bytes, concurrency, args.requests)
+                        report['http'].append({'image': args.http_size, **result})
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
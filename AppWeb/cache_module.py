@@ -0,0 +1,268 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def hash_bytes(data):
+    """Hash de contenido (SHA-256) usado como clave de caché."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Hash SHA-256 de un archivo, leído por bloques."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _sizeof(value):
+    """Estimación del tamaño en bytes de un valor cacheado."""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, dict):
+        return sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_sizeof(v) for v in value)
+    return 64
+
+
+# --- Formato del nivel en disco ---
+# Los valores se guardan como un archivo .npz (np.savez, leído con
+# allow_pickle=False): los arrays y los bytes van como arrays propios y la
+# estructura que los contiene (listas, tuplas, dicts, números, textos) como
+# JSON en el array "structure". Leer la caché no ejecuta código aunque la
+# carpeta sea escribible por otros.
+_STRUCTURE = 'structure'
+
+
+def _encode(value, arrays):
+    """Estructura JSON de `value`; los arrays y bytes se añaden a `arrays`."""
+    if isinstance(value, np.ndarray):
+        arrays.append(value)
+        return {'__array__': len(arrays) - 1}
+    if isinstance(value, (bytes, bytearray)):
+        arrays.append(np.frombuffer(bytes(value), dtype=np.uint8))
+        return {'__bytes__': len(arrays) - 1}
+    if isinstance(value, tuple):
+        return {'__tuple__': [_encode(v, arrays) for v in value]}
+    if isinstance(value, list):
+        return [_encode(v, arrays) for v in value]
+    if isinstance(value, dict):
+        if not all(isinstance(k, str) for k in value):
+            raise TypeError('Solo se pueden guardar en disco dicts con claves de texto')
+        return {'__dict__': {k: _encode(v, arrays) for k, v in value.items()}}
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    raise TypeError(f"Tipo no soportado en la caché en disco: {type(value).__name__}")
+
+
+def _decode(structure, arrays):
+    if isinstance(structure, list):
+        return [_decode(v, arrays) for v in structure]
+    if isinstance(structure, dict):
+        if '__array__' in structure:
+            return arrays[f"a{structure['__array__']}"]
+        if '__bytes__' in structure:
+            return arrays[f"a{structure['__bytes__']}"].tobytes()
+        if '__tuple__' in structure:
+            return tuple(_decode(v, arrays) for v in structure['__tuple__'])
+        return {k: _decode(v, arrays) for k, v in structure['__dict__'].items()}
+    return structure
+
+
+def dumps_value(value):
+    """Serializa un valor cacheado a bytes (.npz, sin pickle)."""
+    arrays = []
+    structure = _encode(value, arrays)
+    buffer = io.BytesIO()
+    np.savez(buffer, **{f"a{i}": array for i, array in enumerate(arrays)},
+             **{_STRUCTURE: np.frombuffer(json.dumps(structure).encode('utf-8'), dtype=np.uint8)})
+    return buffer.getvalue()
+
+
+def loads_value(data):
+    """Inverso de dumps_value."""
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        arrays = {name: npz[name] for name in npz.files}
+    return _decode(json.loads(arrays.pop(_STRUCTURE).tobytes().decode('utf-8')), arrays)
+
+
+class ContentCache:
+    """Caché LRU acotada en MB, con un nivel opcional en disco."""
+    # El nivel en memoria guarda los valores más recientes; al expulsar una
+    # entrada se vuelca al nivel en disco (si está configurado), que también
+    # está acotado y se recorre en orden LRU. Un acierto en disco promueve la
+    # entrada de nuevo a memoria. Ver dumps_value para el formato en disco.
+
+    def __init__(self, max_mb, disk_folder=None, disk_max_mb=0, name='cache'):
+        self.name = name
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.disk_folder = disk_folder
+        self.disk_max_bytes = int(disk_max_mb * 1024 * 1024)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()   # clave -> (valor, tamaño)
+        self._memory_bytes = 0
+        self._disk = OrderedDict()     # clave -> tamaño en disco
+        self._disk_bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_folder and self.disk_max_bytes > 0:
+            os.makedirs(self.disk_folder, exist_ok=True)
+            self._load_disk_index()
+        else:
+            self.disk_folder = None
+
+    # --- Nivel en disco ---
+    def _disk_path(self, key):
+        return os.path.join(self.disk_folder, f"{key}.npz")
+
+    def _load_disk_index(self):
+        """Reconstruye el índice del nivel en disco (más antiguos primero)."""
+        entries = []
+        for filename in os.listdir(self.disk_folder):
+            path = os.path.join(self.disk_folder, filename)
+            if filename.endswith('.pkl'):
+                # Formato anterior (pickle): no se lee, se elimina
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                continue
+            if not filename.endswith('.npz'):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), filename[:-4], os.path.getsize(path)))
+            except OSError:
+                continue
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _write_disk(self, key, value):
+        data = dumps_value(value)
+        if len(data) > self.disk_max_bytes:
+            return
+        tmp_path = f"{self._disk_path(key)}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._disk_path(key))
+
+        evicted = []
+        with self._lock:
+            if key in self._disk:
+                self._disk_bytes -= self._disk.pop(key)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.disk_max_bytes and self._disk:
+                old_key, old_size = self._disk.popitem(last=False)
+                self._disk_bytes -= old_size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.unlink(self._disk_path(old_key))
+            except OSError:
+                pass
+
+    def _read_disk(self, key):
+        with self._lock:
+            if key not in self._disk:
+                return None
+            self._disk.move_to_end(key)
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return loads_value(f.read())
+        except Exception as e:
+            print(f"Error leyendo la caché en disco {self.name}/{key}: {e}")
+            with self._lock:
+                if key in self._disk:
+                    self._disk_bytes -= self._disk.pop(key)
+            return None
+
+    # --- API pública ---
+    def get(self, key):
+        """Devuelve el valor cacheado o None si no existe."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        value = self._read_disk(key) if self.disk_folder else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """Guarda un valor; las entradas expulsadas de memoria pasan al disco."""
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            if self.disk_folder:
+                self._write_disk(key, value)
+            return
+
+        evicted = []
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[1]
+            self._memory[key] = (value, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_bytes and self._memory:
+                old_key, (old_value, old_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= old_size
+                evicted.append((old_key, old_value))
+
+        if self.disk_folder:
+            for old_key, old_value in evicted:
+                with self._lock:
+                    on_disk = old_key in self._disk
+                if not on_disk:
+                    try:
+                        self._write_disk(old_key, old_value)
+                    except Exception as e:
+                        print(f"Error escribiendo la caché en disco {self.name}/{old_key}: {e}")
+
+    def clear(self):
+        """Vacía el nivel en memoria (el nivel en disco se conserva)."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def get_stats(self):
+        """Contadores de aciertos/fallos y ocupación."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(100 * self.hits / lookups, 1) if lookups else 0,
+                'entries': len(self._memory),
+                'memory_mb': round(self._memory_bytes / (1024 * 1024), 2),
+                'max_memory_mb': round(self.max_bytes / (1024 * 1024), 2),
+                'disk_entries': len(self._disk),
+                'disk_mb': round(self._disk_bytes / (1024 * 1024), 2)
+            }
@@ -0,0 +1,277 @@
+"""Clasificación por lotes de una carpeta o de un archivo ZIP/tar, sin pasar por la interfaz web.
+
+Pensado para auditorías nocturnas de decenas de miles de fotos archivadas:
+  - las imágenes se decodifican y preprocesan en un pool de procesos
+    (decodificación reducida de preprocessing_module, la misma `transform`
+    que usa app.py);
+  - el proceso principal carga el modelo con app.load_model y ejecuta la
+    inferencia por lotes, alimentado por una cola de prefetch acotada (como
+    mucho --prefetch imágenes en vuelo, para que la memoria no crezca con el
+    tamaño del archivo);
+  - los resultados se escriben en streaming a un CSV y/o al histórico de
+    resultados (results_store, source='cli').
+
+Tras cada lote se guarda un checkpoint JSON con las imágenes completadas y la
+posición del CSV. Si la ejecución se interrumpe, volver a lanzar el mismo
+comando continúa donde se quedó: el CSV se trunca a la última posición
+confirmada (sin filas duplicadas) y el histórico puede repetir como mucho el
+último lote. Con --restart se empieza de cero.
+
+Uso:
+    python classify_cli.py <carpeta|archivo.zip|archivo.tar[.gz]> [--output resultados.csv] [--store]
+        [--batch-size 16] [--workers 4] [--prefetch 64] [--backend onnx] [--checkpoint ruta.json] [--restart]
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# Solo el preprocesado se importa a nivel de módulo: los procesos del pool
+# (spawn) importan este archivo y no necesitan la aplicación ni el modelo.
+from preprocessing_module import load_tensor
+
+
+# --- Procesos del pool ---
+_zip_handles = {}
+
+
+def _init_worker():
+    import torch
+    # Un hilo por proceso: el paralelismo lo da el pool
+    torch.set_num_threads(1)
+
+
+def _read_zip_member(archive_path, member):
+    archive = _zip_handles.get(archive_path)
+    if archive is None:
+        archive = _zip_handles[archive_path] = zipfile.ZipFile(archive_path)
+    return archive.read(member)
+
+
+def preprocess_item(payload):
+    """Decodifica y preprocesa una imagen: ruta, bytes o (zip, miembro). Devuelve (array, error)."""
+    try:
+        if isinstance(payload, tuple):
+            payload = _read_zip_member(*payload)
+        return load_tensor(payload).numpy(), None
+    except Exception as e:
+        return None, str(e)
+
+
+# --- Enumeración de imágenes ---
+def source_kind(source):
+    if os.path.isdir(source):
+        return 'dir'
+    if zipfile.is_zipfile(source):
+        return 'zip'
+    if tarfile.is_tarfile(source):
+        return 'tar'
+    raise ValueError(f"{source} no es una carpeta ni un archivo ZIP/tar")
+
+
+def list_images(source, kind, is_image):
+    """Nombres de las imágenes en un orden estable (necesario para reanudar)."""
+    if kind == 'dir':
+        names = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            names.extend(os.path.relpath(os.path.join(root, f), source) for f in sorted(files) if is_image(f))
+        return names
+    if kind == 'zip':
+        with zipfile.ZipFile(source) as archive:
+            return sorted(i.filename for i in archive.infolist() if not i.is_dir() and is_image(i.filename))
+    with tarfile.open(source) as archive:
+        return [m.name for m in archive if m.isfile() and is_image(m.name)]
+
+
+def iter_payloads(source, kind, names, start):
+    """(nombre, payload para preprocess_item) desde la imagen `start` en adelante."""
+    if kind == 'dir':
+        for name in names[start:]:
+            yield name, os.path.join(source, name)
+    elif kind == 'zip':
+        for name in names[start:]:
+            yield name, (source, name)
+    else:
+        # Los tar comprimidos no admiten acceso aleatorio: se leen en orden
+        # en el proceso principal y los workers reciben los bytes
+        wanted = set(names[start:])
+        with tarfile.open(source, mode='r|*') as archive:
+            for member in archive:
+                if member.name in wanted:
+                    yield member.name, archive.extractfile(member).read()
+
+
+# --- Checkpoint ---
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    """Escritura atómica: un corte a mitad nunca deja un checkpoint corrupto."""
+    checkpoint['updated_at'] = datetime.now().isoformat(timespec='seconds')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# --- Salida ---
+class CsvSink:
+    """CSV en streaming que se puede reanudar desde una posición confirmada."""
+
+    def __init__(self, path, class_names, offset=0):
+        self.class_names = class_names
+        resume = offset > 0 and os.path.exists(path)
+        self.file = open(path, 'r+' if resume else 'w', newline='', encoding='utf-8')
+        if resume:
+            # Descarta las filas escritas después del último checkpoint
+            self.file.seek(offset)
+            self.file.truncate()
+        self.writer = csv.writer(self.file)
+        if not resume:
+            self.writer.writerow(['filename', 'predicted_class', 'confidence']
+                                 + [f"prob_{name}" for name in class_names] + ['error'])
+
+    def write(self, rows):
+        for name, probs, error in rows:
+            if probs is None:
+                self.writer.writerow([name, '', ''] + [''] * len(self.class_names) + [error])
+            else:
+                index = int(probs.argmax())
+                self.writer.writerow([name, self.class_names[index], f"{probs[index] * 100:.2f}"]
+                                     + [f"{p * 100:.2f}" for p in probs] + [''])
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Carpeta, archivo .zip o archivo .tar/.tar.gz con imágenes')
+    parser.add_argument('--output', help='CSV donde escribir los resultados')
+    parser.add_argument('--store', action='store_true', help='Guardar los resultados en el histórico (RESULTS_DB_PATH)')
+    parser.add_argument('--batch-size', type=int, default=None, help='Imágenes por forward pass (por defecto, MAX_BATCH_SIZE)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Procesos de decodificación')
+    parser.add_argument('--prefetch', type=int, default=None, help='Imágenes en vuelo como máximo (por defecto, 4 lotes)')
+    parser.add_argument('--backend', default=None, help='Backend de inferencia (por defecto, INFERENCE_BACKEND)')
+    parser.add_argument('--quantization', default=None, choices=['', 'static'])
+    parser.add_argument('--checkpoint', help='Ruta del checkpoint (por defecto, junto a --output o al origen)')
+    parser.add_argument('--restart', action='store_true', help='Ignorar el checkpoint y empezar de cero')
+    args = parser.parse_args()
+
+    if not args.output and not args.store:
+        parser.error('Indica --output, --store o ambos')
+
+    import numpy as np
+    import torch
+    import app as cdw_app
+    from results_module import new_session_id
+
+    source = os.path.abspath(args.source)
+    kind = source_kind(source)
+    names = list_images(source, kind, cdw_app.allowed_file)
+    batch_size = max(1, args.batch_size or cdw_app.app.config['MAX_BATCH_SIZE'])
+    prefetch = max(batch_size, args.prefetch or 4 * batch_size)
+
+    checkpoint_path = args.checkpoint or (args.output or source.rstrip(os.sep)) + '.checkpoint.json'
+    checkpoint = None if args.restart else load_checkpoint(checkpoint_path)
+    if checkpoint is not None:
+        completed = checkpoint['completed']
+        if checkpoint['source'] != source or checkpoint['total'] != len(names) or \
+                (completed and names[completed - 1] != checkpoint['last_item']):
+            sys.exit(f"El checkpoint {checkpoint_path} no corresponde a {source}; usa --restart")
+        if completed >= len(names):
+            print(f"Ya estaban clasificadas las {len(names)} imágenes ({checkpoint_path})")
+            return
+        print(f"Reanudando desde la imagen {completed + 1} de {len(names)}")
+    else:
+        checkpoint = {'source': source, 'total': len(names), 'completed': 0, 'last_item': None,
+                      'csv_offset': 0, 'session_id': new_session_id(),
+                      'started_at': datetime.now().isoformat(timespec='seconds')}
+
+    cdw_app.load_model(backend=args.backend, quantization=args.quantization)
+    class_names = cdw_app.CLASS_NAMES
+    sink = CsvSink(args.output, class_names, checkpoint['csv_offset']) if args.output else None
+    store = cdw_app.results_store if args.store else None
+
+    def run_chunk(chunk):
+        """Infiere un lote, escribe sus filas y confirma el checkpoint."""
+        arrays = [array for _, array, _ in chunk if array is not None]
+        probs = iter(cdw_app.inference_backend(torch.from_numpy(np.stack(arrays))) if arrays else [])
+        rows = [(name, next(probs) if array is not None else None, error) for name, array, error in chunk]
+
+        if store is not None:
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            for name, row_probs, _ in rows:
+                if row_probs is not None:
+                    index = int(row_probs.argmax())
+                    store.add(checkpoint['session_id'], class_names[index], float(row_probs[index]) * 100,
+                              {c: float(p) * 100 for c, p in zip(class_names, row_probs)},
+                              filename=name, timestamp=timestamp, source='cli')
+            store.flush()
+        if sink is not None:
+            checkpoint['csv_offset'] = sink.write(rows)
+        checkpoint['completed'] += len(chunk)
+        checkpoint['last_item'] = chunk[-1][0]
+        save_checkpoint(checkpoint_path, checkpoint)
+        return sum(1 for _, row_probs, _ in rows if row_probs is None)
+
+    start_index = checkpoint['completed']
+    work = iter_payloads(source, kind, names, start_index)
+    pending = deque()   # (nombre, future) en el orden original, como mucho `prefetch`
+    errors = 0
+    start = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers), mp_context=context,
+                                 initializer=_init_worker) as pool:
+            def refill():
+                while len(pending) < prefetch:
+                    item = next(work, None)
+                    if item is None:
+                        return
+                    pending.append((item[0], pool.submit(preprocess_item, item[1])))
+
+            refill()
+            chunk = []
+            while pending:
+                name, future = pending.popleft()
+                refill()
+                array, error = future.result()
+                chunk.append((name, array, error))
+                if len(chunk) == batch_size or not pending:
+                    errors += run_chunk(chunk)
+                    chunk = []
+                    done = checkpoint['completed'] - start_index
+                    elapsed = time.perf_counter() - start
+                    print(f"{checkpoint['completed']}/{len(names)} imágenes "
+                          f"({done / elapsed:.1f} img/s, {errors} errores)", flush=True)
+    except KeyboardInterrupt:
+        print(f"\nInterrumpido: {checkpoint['completed']}/{len(names)} imágenes confirmadas en {checkpoint_path}")
+        sys.exit(130)
+    finally:
+        if sink is not None:
+            sink.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Clasificadas {checkpoint['completed'] - start_index} imágenes en {elapsed:.1f} s "
+          f"({errors} con error). Sesión: {checkpoint['session_id']}")
+
+
+if __name__ == '__main__':
+    main()
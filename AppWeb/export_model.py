@@ -0,0 +1,81 @@
+"""Exporta el modelo a TorchScript / ONNX y verifica la paridad numérica con el modelo eager.
+
+Los artefactos se generan a partir del mismo state dict que usa la aplicación
+(best_resnet_multilabel_v5.pt) y se guardan en MODEL_EXPORT_FOLDER, donde
+load_model(backend=...) los reutiliza. La verificación compara las
+probabilidades de cada backend con las del modelo eager sobre las imágenes de
+'test images' (o la carpeta indicada).
+
+Uso:
+    python export_model.py [--backend torchscript onnx] [--images "test images"] [--atol 1e-4]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+import app as cdw_app
+from inference_module import BACKENDS, EagerBackend, artifact_path_for, build_backend
+from preprocessing_module import load_tensor
+
+
+def load_test_batch(folder):
+    """Carga y preprocesa todas las imágenes permitidas de una carpeta."""
+    names = sorted(f for f in os.listdir(folder) if cdw_app.allowed_file(f))
+    tensors = [load_tensor(os.path.join(folder, name)) for name in names]
+    return names, torch.stack(tensors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', nargs='+', default=['torchscript', 'onnx'],
+                        choices=[b for b in BACKENDS if b != 'eager'])
+    parser.add_argument('--images', default=os.path.join(cdw_app.BASE_DIR, 'test images'))
+    parser.add_argument('--atol', type=float, default=1e-4, help='Diferencia absoluta máxima permitida')
+    parser.add_argument('--force', action='store_true', help='Re-exportar aunque el artefacto exista')
+    args = parser.parse_args()
+
+    cdw_app.load_model(backend='eager')
+    model_name = os.path.splitext(cdw_app.MODEL_FILENAME)[0]
+    model, device = cdw_app.model, cdw_app.device
+    names, batch = load_test_batch(args.images)
+    print(f"{len(names)} imágenes de prueba cargadas desde {args.images}")
+
+    reference = EagerBackend(model, device, channels_last=False)(batch)
+
+    failed = False
+    for backend_name in args.backend:
+        artifact_path = artifact_path_for(cdw_app.app.config['MODEL_EXPORT_FOLDER'], model_name,
+                                          cdw_app.model_fingerprint, backend_name)
+        if args.force and os.path.exists(artifact_path):
+            os.unlink(artifact_path)
+
+        backend = build_backend(backend_name, model, device,
+                                export_folder=cdw_app.app.config['MODEL_EXPORT_FOLDER'],
+                                model_name=model_name,
+                                fingerprint=cdw_app.model_fingerprint,
+                                intra_op_threads=cdw_app.app.config['INTRA_OP_THREADS'])
+
+        start = time.perf_counter()
+        probabilities = backend(batch)
+        elapsed_ms = 1000 * (time.perf_counter() - start)
+
+        max_diff = float(np.abs(probabilities - reference).max())
+        same_argmax = int((probabilities.argmax(1) == reference.argmax(1)).sum())
+        same_labels = int(((probabilities >= 0.5) == (reference >= 0.5)).all(1).sum())
+        ok = max_diff <= args.atol and same_argmax == len(names)
+        failed |= not ok
+
+        print(f"[{backend_name}] {artifact_path}")
+        print(f"  diferencia máxima: {max_diff:.2e} (tolerancia {args.atol:.0e})")
+        print(f"  misma clase ganadora: {same_argmax}/{len(names)}, mismas etiquetas (>50%): {same_labels}/{len(names)}")
+        print(f"  tiempo del lote: {elapsed_ms:.1f} ms -> {'OK' if ok else 'FALLO'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
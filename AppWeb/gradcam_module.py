@@ -1,87 +1,237 @@
+import threading
+import weakref
 import torch
+import torch.nn.functional as F
 import numpy as np
 import cv2
-from PIL import Image
-from torchvision import transforms
 import os
-
-# Transformaciones
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                         std=[0.229, 0.224, 0.225])
-])
-
-def set_relu_inplace(module):
-    for child in module.children():
-        if isinstance(child, torch.nn.ReLU):
-            child.inplace = False
-        else:
-            set_relu_inplace(child)
-
-def generate_gradcam_image(image_path, filename, model, device, class_names, output_folder, threshold=0.5):
+from preprocessing_module import decode_image, load_tensor
+from metrics_module import stage_timer
+
+# Formatos de salida de los heatmaps: extensión y parámetro de calidad de cv2.imencode
+IMAGE_FORMATS = {
+    'jpeg': ('jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('webp', cv2.IMWRITE_WEBP_QUALITY),
+    'png': ('png', None),
+}
+CONTENT_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'png': 'image/png'}
+
+# Paleta JET de OpenCV (256 colores BGR) como tabla para indexar en torch
+_JET_LUT = torch.from_numpy(
+    cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), cv2.COLORMAP_JET).reshape(256, 3).copy()
+)
+# Píxeles (clases x alto x ancho) que se superponen a la vez en la GPU; acota
+# la memoria cuando se renderiza a resolución completa
+RENDER_PIXEL_BUDGET = 8 * 1024 * 1024
+
+
+class GradCAMEngine:
+    """Calcula Grad-CAM para varias clases con un único forward pass."""
+    # El hook de forward se registra solo durante el cálculo (handle con
+    # ámbito) y únicamente captura las activaciones del hilo que lo instaló,
+    # de modo que las inferencias concurrentes sobre el mismo modelo no se
+    # ven afectadas ni interfieren. Los gradientes de todas las clases se
+    # obtienen con una sola llamada a torch.autograd.grad sobre los one-hot
+    # apilados, y los mapas se combinan con operaciones tensoriales.
+
+    def __init__(self, model, target_layer=None):
+        self.model = model
+        self.target_layer = target_layer if target_layer is not None else model.layer4[-1].conv3
+        self._local = threading.local()
+
+    def _forward_hook(self, module, input, output):
+        if getattr(self._local, 'capturing', False):
+            self._local.activations = output
+
+    def _forward(self, input_tensor):
+        """Forward con grafo de gradientes; devuelve (salida, activaciones)."""
+        # El tensor de entrada exige gradiente para que las activaciones estén
+        # en el grafo aunque los parámetros del modelo estén congelados.
+        input_tensor = input_tensor.detach().requires_grad_(True)
+
+        self._local.capturing = True
+        self._local.activations = None
+        handle = self.target_layer.register_forward_hook(self._forward_hook)
+        try:
+            with torch.enable_grad():
+                output = self.model(input_tensor)
+        finally:
+            handle.remove()
+            self._local.capturing = False
+
+        activations = self._local.activations
+        self._local.activations = None
+        return output, activations
+
+    def _class_gradients(self, output, activations, class_indices):
+        """Gradientes de cada clase respecto a las activaciones, con forma (K, C, h, w)."""
+        one_hot = torch.zeros((len(class_indices),) + tuple(output.shape), device=output.device)
+        for k, class_idx in enumerate(class_indices):
+            one_hot[k, 0, class_idx] = 1
+
+        try:
+            gradients, = torch.autograd.grad(output, activations, grad_outputs=one_hot,
+                                             retain_graph=True, is_grads_batched=True)
+            return gradients[:, 0]
+        except RuntimeError:
+            # Alternativa si alguna operación no admite gradientes por lotes:
+            # un backward por clase sobre el mismo grafo (solo recorre las capas
+            # posteriores a target_layer).
+            gradients = []
+            for class_idx in class_indices:
+                gradient, = torch.autograd.grad(output[0, class_idx], activations, retain_graph=True)
+                gradients.append(gradient[0])
+            return torch.stack(gradients)
+
+    def compute(self, input_tensor, threshold=0.5):
+        """Devuelve (probabilidades, índices de clase >= threshold, mapas normalizados (K, h, w))."""
+        output, activations = self._forward(input_tensor)
+        probabilities = output.detach()[0].cpu().numpy()
+
+        class_indices = [i for i, prob in enumerate(probabilities) if prob >= threshold]
+        if not class_indices:
+            return probabilities, [], np.zeros((0,) + tuple(activations.shape[2:]), dtype=np.float32)
+
+        gradients = self._class_gradients(output, activations, class_indices)
+
+        # Peso de cada canal = gradiente medio; mapa = media ponderada de canales
+        weights = gradients.mean(dim=(2, 3))                                   # (K, C)
+        cams = torch.einsum('kc,chw->khw', weights, activations[0].detach())
+        cams = (cams / activations.shape[1]).clamp(min=0)
+
+        # Normalizar cada mapa a [0, 1]
+        max_values = cams.amax(dim=(1, 2), keepdim=True)
+        cams = torch.where(max_values > 0, cams / max_values.clamp(min=1e-12), cams)
+
+        return probabilities, class_indices, cams.cpu().numpy()
+
+
+# Un motor por modelo; se libera automáticamente si el modelo desaparece
+_engines = weakref.WeakKeyDictionary()
+_engines_lock = threading.Lock()
+
+
+def get_gradcam_engine(model):
+    """Devuelve (creándolo si hace falta) el motor Grad-CAM asociado a un modelo."""
+    with _engines_lock:
+        engine = _engines.get(model)
+        if engine is None:
+            engine = GradCAMEngine(model)
+            _engines[model] = engine
+        return engine
+
+
+def gradcam_output_filename(filename, class_name, image_format='jpeg', model_name=None):
+    """Nombre del archivo de salida del heatmap de una clase (conserva la subcarpeta de la imagen).
+
+    Con model_name, los heatmaps de cada versión del modelo van a su propia
+    subcarpeta dentro de la de la imagen.
+    """
+    directory, basename = os.path.split(filename)
+    if directory and model_name:
+        directory = f"{directory}/{model_name}"
+    output_name = f"gradcam_{basename.split('.')[0]}_{class_name}.{IMAGE_FORMATS[image_format][0]}"
+    return f"{directory}/{output_name}" if directory else output_name
+
+
+def load_overlay_base(image_path, max_size=1024):
+    """Imagen base BGR de la superposición, reducida para que su lado mayor no supere max_size."""
+    # Con max_size, la decodificación ya se hace reducida (Image.draft) y
+    # nunca se crea el buffer a resolución completa. max_size=0 → original.
+    draft_size = (max_size, max_size) if max_size else None
+    img_pil = decode_image(image_path, draft_size=draft_size)
+    base = cv2.cvtColor(np.asarray(img_pil), cv2.COLOR_RGB2BGR)   # una sola conversión
+    height, width = base.shape[:2]
+    scale = max_size / max(height, width) if max_size else 1.0
+    if scale < 1.0:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        base = cv2.resize(base, size, interpolation=cv2.INTER_AREA)
+    return base
+
+
+def render_overlays(base_bgr, cams, device=None, alpha=0.4):
+    """Superpone todos los mapas (K, h, w) sobre la imagen base; devuelve uint8 (K, H, W, 3) en BGR.
+
+    Equivale, para cada clase, a resize + applyColorMap(JET) + addWeighted(0.6, 0.4).
+    Si el modelo está en CUDA, interpolación, paleta y mezcla se hacen por lotes
+    en la GPU; en CPU las funciones nativas de OpenCV (LUT y mezcla en C) son
+    más rápidas que el indexado de torch, y se aplican sobre la base ya convertida.
+    """
+    height, width = base_bgr.shape[:2]
+    if len(cams) == 0:
+        return np.zeros((0, height, width, 3), dtype=np.uint8)
+
+    if device is None or torch.device(device).type != 'cuda':
+        overlays = np.empty((len(cams), height, width, 3), dtype=np.uint8)
+        for k, cam in enumerate(cams):
+            heatmap = cv2.applyColorMap(np.uint8(255 * cv2.resize(cam, (width, height))), cv2.COLORMAP_JET)
+            cv2.addWeighted(base_bgr, 1 - alpha, heatmap, alpha, 0, dst=overlays[k])
+        return overlays
+
+    base = torch.from_numpy(np.ascontiguousarray(base_bgr)).to(device).float().mul_(1 - alpha)
+    lut = _JET_LUT.to(device).float().mul_(alpha)
+    cams = torch.as_tensor(cams, dtype=torch.float32).to(device)
+
+    chunk = max(1, RENDER_PIXEL_BUDGET // (height * width))
+    rendered = []
+    for start in range(0, len(cams), chunk):
+        heat = F.interpolate(cams[start:start + chunk].unsqueeze(1), size=(height, width),
+                             mode='bilinear', align_corners=False)[:, 0]
+        # Misma cuantización que np.uint8(255 * heatmap) antes de applyColorMap
+        indices = (heat.clamp_(0, 1) * 255).long()
+        blended = lut[indices].add_(base).round_().clamp_(0, 255).to(torch.uint8)
+        rendered.append(blended.cpu())
+    return torch.cat(rendered).numpy()
+
+
+def encode_image(image_bgr, image_format='jpeg', quality=90):
+    """Codifica un array BGR en memoria (JPEG, WebP o PNG)."""
+    extension, quality_flag = IMAGE_FORMATS[image_format]
+    params = [quality_flag, int(quality)] if quality_flag is not None else []
+    ok, buffer = cv2.imencode('.' + extension, image_bgr, params)
+    if not ok:
+        raise RuntimeError(f"No se pudo codificar el heatmap como {image_format}")
+    return buffer.tobytes()
+
+
+def render_gradcam(image_path, model, device, class_names, threshold=0.5, max_size=1024,
+                   image_format='jpeg', quality=90):
+    """Calcula Grad-CAM y devuelve los heatmaps codificados en memoria: [(clase, bytes)]."""
+    # El tensor de entrada se obtiene con el mismo preprocesamiento (decodificación
+    # reducida) que la predicción; la superposición usa la imagen reducida a max_size.
+    with stage_timer('gradcam', 'preprocess'):
+        img_tensor = load_tensor(image_path).unsqueeze(0)
+    with stage_timer('gradcam', 'to_device'):
+        img_tensor = img_tensor.to(device)
+
+    engine = get_gradcam_engine(model)
+    with stage_timer('gradcam', 'gradcam'):
+        _, class_indices, cams = engine.compute(img_tensor, threshold=threshold)
+    if not class_indices:
+        return []
+
+    with stage_timer('gradcam', 'decode'):
+        base = load_overlay_base(image_path, max_size)
+    with stage_timer('gradcam', 'postprocess'):
+        overlays = render_overlays(base, cams, device)
+    with stage_timer('gradcam', 'serialize'):
+        return [(class_names[class_idx], encode_image(overlay, image_format, quality))
+                for class_idx, overlay in zip(class_indices, overlays)]
+
+
+def generate_gradcam_image(image_path, filename, model, device, class_names, output_folder, threshold=0.5,
+                           max_size=1024, image_format='jpeg', quality=90):
     """Genera y guarda heatmaps Grad-CAM para clases relevantes."""
-    os.makedirs(output_folder, exist_ok=True)
-    set_relu_inplace(model)
-
-    gradients = None
-    activations = None
-
-    def save_gradient(module, grad_input, grad_output):
-        nonlocal gradients
-        gradients = grad_output[0]
-
-    def forward_hook(module, input, output):
-        nonlocal activations
-        activations = output
-
-    target_layer = model.layer4[-1].conv3
-    target_layer.register_forward_hook(forward_hook)
-    target_layer.register_full_backward_hook(save_gradient)
-
-    img_pil = Image.open(image_path).convert("RGB")
-    original_size = img_pil.size
-
-    img_tensor = transform(img_pil).unsqueeze(0).to(device)
-    output = model(img_tensor)
-    output_np = output.detach().cpu().numpy()[0]
+    rendered = render_gradcam(image_path, model, device, class_names, threshold=threshold,
+                              max_size=max_size, image_format=image_format, quality=quality)
 
     heatmap_urls = []
-
-    for class_idx in range(len(class_names)):
-        prob = output_np[class_idx]
-        if prob < threshold:
-            continue
-
-        # Re-forward
-        model.zero_grad()
-        img_tensor = transform(img_pil).unsqueeze(0).to(device)
-        output = model(img_tensor)
-
-        one_hot = torch.zeros_like(output)
-        one_hot[0, class_idx] = 1
-        output.backward(gradient=one_hot)
-
-        pooled_gradients = torch.mean(gradients, dim=[0, 2, 3])
-        activations_cam = activations.squeeze(0).detach()
-        for i in range(activations_cam.shape[0]):
-            activations_cam[i, :, :] *= pooled_gradients[i]
-
-        heatmap = torch.mean(activations_cam, dim=0).cpu().numpy()
-        heatmap = np.maximum(heatmap, 0)
-        if heatmap.max() != 0:
-            heatmap /= heatmap.max()
-
-        img_cv = cv2.cvtColor(np.array(img_pil), cv2.COLOR_RGB2BGR)
-        heatmap_resized = cv2.resize(heatmap, (img_cv.shape[1], img_cv.shape[0]))
-        heatmap_colored = cv2.applyColorMap(np.uint8(255 * heatmap_resized), cv2.COLORMAP_JET)
-        superimposed_img = cv2.addWeighted(img_cv, 0.6, heatmap_colored, 0.4, 0)
-
-        gradcam_filename = f"gradcam_{filename.split('.')[0]}_{class_names[class_idx]}.jpg"
+    for class_name, image_bytes in rendered:
+        gradcam_filename = gradcam_output_filename(filename, class_name, image_format)
         gradcam_path = os.path.join(output_folder, gradcam_filename)
-        cv2.imwrite(gradcam_path, superimposed_img)
-
+        os.makedirs(os.path.dirname(gradcam_path), exist_ok=True)
+        with open(gradcam_path, 'wb') as f:
+            f.write(image_bytes)
         heatmap_urls.append('/gradcam_outputs/' + gradcam_filename)
 
     return heatmap_urls
@@ -0,0 +1,53 @@
+"""Configuración de gunicorn para el modo producción.
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+Variables de entorno:
+    WEB_BIND       dirección de escucha (por defecto 0.0.0.0:5000)
+    WEB_WORKERS    número de procesos worker (por defecto 2)
+    WEB_THREADS    hilos por worker (por defecto 4)
+    WEB_TIMEOUT    timeout de petición en segundos (por defecto 300)
+    INTRA_OP_THREADS  hilos de PyTorch/ONNX Runtime por worker; si no se
+                      indica, los núcleos disponibles se reparten entre los
+                      workers para no sobresuscribir la CPU.
+"""
+import gc
+import os
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_WORKERS', 2))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('WEB_TIMEOUT', 300))
+
+# El modelo se carga en el proceso maestro antes de crear los workers, que
+# comparten los pesos en copy-on-write.
+preload_app = True
+
+
+def available_cpus():
+    """Núcleos disponibles para este proceso (respeta la afinidad de CPU)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def intra_op_threads_per_worker():
+    configured = int(os.environ.get('INTRA_OP_THREADS', 0))
+    if configured > 0:
+        return configured
+    return max(1, available_cpus() // workers)
+
+
+def when_ready(server):
+    # Congelar los objetos ya creados (modelo incluido) para que el recolector
+    # de basura no los toque en los workers y las páginas sigan compartidas.
+    gc.freeze()
+    server.log.info(f"Modelo precargado; {workers} workers x {threads} hilos, "
+                    f"{intra_op_threads_per_worker()} hilos intra-op por worker")
+
+
+def post_fork(server, worker):
+    from app import init_worker
+    init_worker(intra_op_threads_per_worker())
@@ -0,0 +1,146 @@
+import os
+import threading
+import torch
+
+# --- Backends de inferencia ---
+# Todos los backends se construyen a partir del mismo modelo eager (cargado
+# desde el state dict) y exponen la misma interfaz: backend(batch) recibe un
+# tensor (N, 3, 224, 224) y devuelve un array numpy (N, num_clases) con las
+# probabilidades de la Sigmoid.
+BACKENDS = ('eager', 'torchscript', 'onnx')
+
+
+def configure_threads(intra_op_threads):
+    """Fija el número de hilos intra-op de PyTorch (0 = valor por defecto)."""
+    if intra_op_threads and intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    return torch.get_num_threads()
+
+
+class EagerBackend:
+    """Modelo PyTorch en modo eager, con channels_last e inference_mode."""
+    name = 'eager'
+
+    def __init__(self, model, device, channels_last=True):
+        self.device = device
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.model = model.to(memory_format=self.memory_format)
+
+    def __call__(self, batch):
+        batch = batch.to(self.device).contiguous(memory_format=self.memory_format)
+        with torch.inference_mode():
+            return self.model(batch).float().cpu().numpy()
+
+
+class TorchScriptBackend(EagerBackend):
+    """Modelo trazado con TorchScript y congelado (torch.jit.freeze)."""
+    name = 'torchscript'
+
+    def __init__(self, model, device, artifact_path=None, channels_last=True):
+        self.device = device
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
+        if artifact_path and os.path.exists(artifact_path):
+            self.model = torch.jit.load(artifact_path, map_location=device)
+            print(f"Modelo TorchScript cargado desde {artifact_path}")
+        else:
+            self.model = export_torchscript(model, device, artifact_path, channels_last=channels_last)
+        self.model.eval()
+
+
+class OnnxBackend:
+    """Modelo exportado a ONNX y ejecutado con ONNX Runtime."""
+    name = 'onnx'
+
+    def __init__(self, model, device, artifact_path, intra_op_threads=0):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("El backend 'onnx' requiere onnxruntime (pip install onnxruntime)") from e
+
+        if not os.path.exists(artifact_path):
+            export_onnx(model, device, artifact_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads and intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+
+        providers = ['CPUExecutionProvider']
+        if device.type == 'cuda' and 'CUDAExecutionProvider' in ort.get_available_providers():
+            providers.insert(0, 'CUDAExecutionProvider')
+
+        self.session = ort.InferenceSession(artifact_path, sess_options=options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        # InferenceSession.run es seguro entre hilos, pero se serializa para
+        # no multiplicar los hilos intra-op con peticiones concurrentes.
+        self._lock = threading.Lock()
+        print(f"Modelo ONNX cargado desde {artifact_path} ({', '.join(providers)})")
+
+    def __call__(self, batch):
+        inputs = {self.input_name: batch.detach().cpu().numpy()}
+        with self._lock:
+            return self.session.run(None, inputs)[0]
+
+
+def export_torchscript(model, device, artifact_path=None, channels_last=True):
+    """Traza y congela el modelo; si se indica artifact_path, lo guarda en disco."""
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    example = torch.randn(1, 3, 224, 224, device=device).contiguous(memory_format=memory_format)
+
+    model = model.to(memory_format=memory_format).eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        frozen = torch.jit.freeze(traced)
+
+    if artifact_path:
+        os.makedirs(os.path.dirname(artifact_path), exist_ok=True)
+        torch.jit.save(frozen, artifact_path)
+        print(f"Modelo TorchScript exportado a {artifact_path}")
+    return frozen
+
+
+def export_onnx(model, device, artifact_path, opset_version=17):
+    """Exporta el modelo a ONNX con el tamaño de lote dinámico."""
+    os.makedirs(os.path.dirname(artifact_path), exist_ok=True)
+    example = torch.randn(1, 3, 224, 224, device=device)
+    export_kwargs = dict(
+        input_names=['input'],
+        output_names=['probabilities'],
+        dynamic_axes={'input': {0: 'batch'}, 'probabilities': {0: 'batch'}},
+        opset_version=opset_version
+    )
+
+    model = model.to(memory_format=torch.contiguous_format).eval()
+    tmp_path = f"{artifact_path}.tmp"
+    with torch.no_grad():
+        try:
+            torch.onnx.export(model, example, tmp_path, dynamo=False, **export_kwargs)
+        except TypeError:
+            # Versiones de PyTorch sin el parámetro `dynamo`
+            torch.onnx.export(model, example, tmp_path, **export_kwargs)
+    os.replace(tmp_path, artifact_path)
+    print(f"Modelo ONNX exportado a {artifact_path}")
+
+
+def artifact_path_for(export_folder, model_name, fingerprint, backend):
+    """Ruta del artefacto exportado; incluye la huella de los pesos para invalidarlo si cambian."""
+    extension = {
+        'torchscript': 'torchscript.pt',
+        'onnx': 'onnx',
+        'int8-static': 'int8-static.torchscript.pt'
+    }[backend]
+    return os.path.join(export_folder, f"{model_name}.{fingerprint}.{extension}")
+
+
+def build_backend(name, model, device, export_folder, model_name, fingerprint, intra_op_threads=0, channels_last=True):
+    """Construye el backend de inferencia indicado a partir del modelo eager."""
+    if name not in BACKENDS:
+        raise ValueError(f"Backend de inferencia desconocido: {name} (opciones: {', '.join(BACKENDS)})")
+
+    if name == 'eager':
+        return EagerBackend(model, device, channels_last=channels_last)
+    artifact_path = artifact_path_for(export_folder, model_name, fingerprint, name)
+    if name == 'torchscript':
+        return TorchScriptBackend(model, device, artifact_path, channels_last=channels_last)
+    return OnnxBackend(model, device, artifact_path, intra_op_threads=intra_op_threads)
@@ -0,0 +1,539 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from preprocessing_module import INPUT_SIZE, tensor_from_pixels
+
+# Bloqueo entre procesos para elegir el proceso que ingiere (no existe en Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# --- Ingesta de vídeo en el servidor ---
+# Cada stream (cámara RTSP/HTTP o archivo de vídeo) se lee con OpenCV en su
+# propio hilo. De todos los frames solo se decodifican los que tocan según
+# sample_fps (el resto se descarta con grab(), sin decodificar); los que son
+# casi idénticos al último frame inferido se saltan con una diferencia de
+# píxeles sobre una miniatura en escala de grises, y los restantes se
+# clasifican por lotes de hasta batch_size frames.
+
+# Estados en los que un stream ya no lee frames
+FINAL_STATES = ('finished', 'stopped', 'error')
+
+LIVE_PREFIXES = ('rtsp://', 'rtsps://', 'rtmp://', 'http://', 'https://', 'udp://', 'tcp://')
+
+
+def is_live_source(source):
+    """True para cámaras (URL o índice de dispositivo); False para archivos de vídeo."""
+    return isinstance(source, int) or str(source).isdigit() or str(source).lower().startswith(LIVE_PREFIXES)
+
+
+class FrameDiffFilter:
+    """Detecta frames casi duplicados comparando miniaturas en escala de grises."""
+
+    def __init__(self, threshold=4.0, size=(32, 32)):
+        self.threshold = threshold   # diferencia media absoluta (0-255) por debajo de la cual se salta
+        self.size = size
+        self._reference = None
+
+    def thumbnail(self, frame_bgr):
+        gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY) if frame_bgr.ndim == 3 else frame_bgr
+        return cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def difference(self, thumbnail):
+        """Diferencia media de una miniatura frente a la referencia (inf si aún no hay referencia)."""
+        if self._reference is None:
+            return float('inf')
+        return float(np.abs(thumbnail - self._reference).mean())
+
+    def is_duplicate(self, frame):
+        """True si el frame apenas cambia; si no, pasa a ser la nueva referencia."""
+        thumbnail = self.thumbnail(frame)
+        if self.threshold > 0 and self.difference(thumbnail) < self.threshold:
+            return True
+        self._reference = thumbnail
+        return False
+
+    def reset(self):
+        self._reference = None
+
+
+def frame_to_tensor(frame_bgr):
+    """Tensor de entrada del modelo a partir de un frame BGR de OpenCV."""
+    resized = cv2.resize(frame_bgr, (INPUT_SIZE, INPUT_SIZE), interpolation=cv2.INTER_AREA)
+    rgb = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+    return tensor_from_pixels(rgb.tobytes())
+
+
+class StreamIngestor:
+    """Lee un stream o archivo de vídeo en un hilo, muestrea frames y los clasifica por lotes."""
+
+    def __init__(self, stream_id, source, run_batch, on_results, sample_fps=1.0, diff_threshold=4.0,
+                 batch_size=8, batch_timeout=1.0, reconnect_delay=5.0, loop=False):
+        self.stream_id = stream_id
+        self.source = int(source) if str(source).isdigit() else source
+        self.live = is_live_source(self.source)
+        self.run_batch = run_batch     # run_batch(stream_id, tensores) -> probabilidades por frame
+        self.on_results = on_results   # on_results(stream_id, frames, probabilidades, segundos_por_frame)
+        self.sample_interval = 1.0 / sample_fps if sample_fps and sample_fps > 0 else 0.0
+        self.batch_size = max(1, int(batch_size))
+        self.batch_timeout = batch_timeout
+        self.reconnect_delay = reconnect_delay
+        self.loop = loop
+        self.diff_filter = FrameDiffFilter(diff_threshold)
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pending = []            # [(info del frame, tensor)]
+        self._pending_since = None
+
+        self.state = 'created'
+        self.error = None
+        self.started_at = None
+        self.frames_read = 0
+        self.frames_sampled = 0
+        self.frames_skipped = 0
+        self.frames_inferred = 0
+        self.batches = 0
+        self.last_result = None
+
+    # --- Ciclo de vida ---
+    def start(self):
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self._thread = threading.Thread(target=self._run, name=f"ingest-{self.stream_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def wait(self, timeout=None):
+        """Espera a que termine el hilo (p. ej. al final de un archivo)."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return not self.is_alive()
+
+    def status(self):
+        with self._lock:
+            return {
+                'stream_id': self.stream_id,
+                'source': str(self.source),
+                'live': self.live,
+                'state': self.state,
+                'error': self.error,
+                'started_at': self.started_at,
+                'sample_fps': round(1.0 / self.sample_interval, 3) if self.sample_interval else None,
+                'diff_threshold': self.diff_filter.threshold,
+                'batch_size': self.batch_size,
+                'frames_read': self.frames_read,
+                'frames_sampled': self.frames_sampled,
+                'frames_skipped_duplicate': self.frames_skipped,
+                'frames_inferred': self.frames_inferred,
+                'batches': self.batches,
+                'last_result': self.last_result
+            }
+
+    def _set_state(self, state, error=None):
+        with self._lock:
+            self.state = state
+            self.error = error
+
+    # --- Lectura ---
+    def _open(self):
+        capture = cv2.VideoCapture(self.source)
+        if self.live:
+            # Búfer mínimo: interesa el frame más reciente, no los atrasados
+            capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return capture
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                self._set_state('connecting')
+                capture = self._open()
+                if not capture.isOpened():
+                    capture.release()
+                    if not self.live:
+                        self._set_state('error', f"No se pudo abrir {self.source}")
+                        return
+                    self._set_state('reconnecting', f"No se pudo conectar a {self.source}")
+                    self._stop.wait(self.reconnect_delay)
+                    continue
+
+                self._set_state('running')
+                self._read_frames(capture)
+                capture.release()
+                self._flush()
+
+                if self._stop.is_set():
+                    break
+                if not self.live and not self.loop:
+                    self._set_state('finished')
+                    return
+                if self.live:
+                    self._set_state('reconnecting', 'Se perdió la conexión con la cámara')
+                    self._stop.wait(self.reconnect_delay)
+                self.diff_filter.reset()
+            self._set_state('stopped')
+        except Exception as e:
+            print(f"Error en la ingesta del stream {self.stream_id}: {e}")
+            self._set_state('error', str(e))
+
+    def _read_frames(self, capture):
+        """Lee hasta el final del archivo, la pérdida de conexión o stop()."""
+        next_sample = 0.0
+        frame_index = -1
+        wall_start = time.monotonic()
+        while not self._stop.is_set():
+            # grab() avanza sin decodificar; solo se decodifican los frames muestreados
+            if not capture.grab():
+                return
+            frame_index += 1
+            with self._lock:
+                self.frames_read += 1
+
+            # En archivos se muestrea por la marca de tiempo del vídeo (se procesan
+            # tan rápido como se pueda); en cámaras, por el reloj real.
+            if self.live:
+                position = time.monotonic() - wall_start
+            else:
+                position = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            if position + 1e-6 < next_sample:
+                self._flush_if_stale()
+                continue
+            next_sample = position + self.sample_interval if self.sample_interval else 0.0
+
+            ok, frame = capture.retrieve()
+            if not ok or frame is None:
+                continue
+            with self._lock:
+                self.frames_sampled += 1
+
+            if self.diff_filter.is_duplicate(frame):
+                with self._lock:
+                    self.frames_skipped += 1
+                self._flush_if_stale()
+                continue
+
+            info = {'frame_index': frame_index, 'position_seconds': round(position, 3),
+                    'captured_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+            self._enqueue(info, frame_to_tensor(frame))
+
+    # --- Lotes ---
+    def _enqueue(self, info, tensor):
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        self._pending.append((info, tensor))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def _flush_if_stale(self):
+        # En cámaras con poco movimiento, no retener frames más de batch_timeout
+        if self._pending and time.monotonic() - self._pending_since >= self.batch_timeout:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        start = time.perf_counter()
+        try:
+            all_probs = self.run_batch(self.stream_id, [tensor for _, tensor in batch])
+        except Exception as e:
+            print(f"Error en la inferencia del stream {self.stream_id}: {e}")
+            return
+        seconds_per_frame = (time.perf_counter() - start) / len(batch)
+        frames = [info for info, _ in batch]
+
+        last = self.on_results(self.stream_id, frames, all_probs, seconds_per_frame)
+        with self._lock:
+            self.frames_inferred += len(batch)
+            self.batches += 1
+            if last is not None:
+                self.last_result = last
+
+
+class IngestManager:
+    """Registro de los streams en ingesta, con alta, baja y estado."""
+
+    def __init__(self, run_batch, on_results, defaults=None):
+        self.run_batch = run_batch
+        self.on_results = on_results
+        self.defaults = dict(defaults or {})
+        self._lock = threading.Lock()
+        self._streams = {}
+
+    def build(self, stream_id, source, **options):
+        """Ingestor sin arrancar, con las opciones por defecto donde no se indican."""
+        settings = {**self.defaults, **{k: v for k, v in options.items() if v is not None}}
+        return StreamIngestor(stream_id, source, self.run_batch, self.on_results, **settings)
+
+    def add(self, stream_id, source, **options):
+        """Arranca la ingesta de un stream; falla si ya hay uno activo con ese id."""
+        with self._lock:
+            current = self._streams.get(stream_id)
+            if current is not None and current.is_alive():
+                raise ValueError(f"Ya existe un stream activo con id '{stream_id}'")
+            ingestor = self.build(stream_id, source, **options)
+            self._streams[stream_id] = ingestor
+        return ingestor.start()
+
+    def get(self, stream_id):
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def remove(self, stream_id):
+        """Detiene y da de baja un stream; devuelve False si no existe."""
+        with self._lock:
+            ingestor = self._streams.pop(stream_id, None)
+        if ingestor is None:
+            return False
+        ingestor.stop()
+        return True
+
+    def list(self):
+        with self._lock:
+            ingestors = list(self._streams.values())
+        return [ingestor.status() for ingestor in ingestors]
+
+    def stop_all(self):
+        with self._lock:
+            ingestors = list(self._streams.values())
+            self._streams.clear()
+        for ingestor in ingestors:
+            ingestor.stop()
+
+    def get_stats(self):
+        statuses = self.list()
+        return {
+            'streams': len(statuses),
+            'running': sum(1 for s in statuses if s['state'] == 'running'),
+            'frames_inferred': sum(s['frames_inferred'] for s in statuses),
+            'frames_skipped_duplicate': sum(s['frames_skipped_duplicate'] for s in statuses)
+        }
+
+
+class IngestSync:
+    """Streams deseados en un archivo compartido; un único proceso elegido los ingiere."""
+    # Con varios workers (gunicorn o uvicorn) las rutas /api/streams no
+    # arrancan la ingesta en el proceso que las atiende: escriben los streams
+    # deseados (origen, opciones y fecha de la petición) en `path`, con un
+    # bloqueo exclusivo y escritura atómica. Solo ingiere el proceso que
+    # consigue el bloqueo exclusivo de <path>.runner.lock; su hilo aplica el
+    # archivo al IngestManager (arranca los nuevos, detiene los retirados) y
+    # publica cada poll_interval segundos el estado de sus streams en
+    # <path>.status, que es lo que devuelven las consultas en cualquier worker.
+    # Así un id no puede ejecutarse dos veces y cualquier worker puede
+    # consultar o detener un stream. Si el proceso que ingiere termina, el
+    # sistema libera el bloqueo y otro worker lo toma y vuelve a arrancar los
+    # streams que no habían terminado. Sin fcntl (Windows) cada proceso
+    # ingiere por su cuenta.
+
+    def __init__(self, manager, path, poll_interval=1.0, name='ingest-sync'):
+        self.manager = manager
+        self.path = path
+        self.status_path = f"{path}.status"
+        self.lock_path = f"{path}.runner.lock"
+        self.poll_interval = poll_interval
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._started = {}        # stream_id -> requested_at del stream arrancado en este proceso
+        self._thread = None
+        self._pid = None
+        self._runner_file = None
+        self._runner_pid = None
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    # --- Archivos compartidos ---
+    @staticmethod
+    def _read_json(path, default):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+        except (OSError, ValueError) as e:
+            print(f"Error leyendo {path}: {e}")
+            return default
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def read(self):
+        """Streams deseados: stream_id -> {'source', 'options', 'requested_at'}."""
+        return self._read_json(self.path, {}).get('streams', {})
+
+    def read_status(self):
+        """Último estado publicado por el proceso que ingiere: stream_id -> estado."""
+        return self._read_json(self.status_path, {})
+
+    def _update(self, mutate):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{self.path}.lock", 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            streams = self.read()
+            result = mutate(streams)
+            self._write_json(self.path, {'streams': streams})
+        # El proceso que ingiere aplica el cambio al momento; el resto lo deja a su hilo
+        if self.is_runner():
+            self.reconcile()
+        return result
+
+    # --- API (cualquier worker) ---
+    def add(self, stream_id, source, **options):
+        """Pide la ingesta de un stream y devuelve su estado; falla si ya hay uno activo con ese id."""
+        spec = {'source': str(source), 'options': {k: v for k, v in options.items() if v is not None},
+                'requested_at': datetime.now().isoformat(timespec='microseconds')}
+
+        def mutate(streams):
+            if stream_id in streams and not self._finished(stream_id, streams[stream_id]):
+                raise ValueError(f"Ya existe un stream activo con id '{stream_id}'")
+            streams[stream_id] = spec
+
+        self._update(mutate)
+        return self.get(stream_id)
+
+    def remove(self, stream_id):
+        """Detiene y da de baja un stream; devuelve False si no existe."""
+        def mutate(streams):
+            return streams.pop(stream_id, None) is not None
+        return self._update(mutate)
+
+    def get(self, stream_id):
+        """Estado de un stream deseado (None si no existe)."""
+        spec = self.read().get(stream_id)
+        if spec is None:
+            return None
+        return self._status(stream_id, spec, self.read_status())
+
+    def list(self):
+        statuses = self.read_status()
+        return [self._status(stream_id, spec, statuses) for stream_id, spec in self.read().items()]
+
+    def get_stats(self):
+        statuses = self.list()
+        return {
+            'streams': len(statuses),
+            'running': sum(1 for s in statuses if s['state'] == 'running'),
+            'frames_inferred': sum(s['frames_inferred'] for s in statuses),
+            'frames_skipped_duplicate': sum(s['frames_skipped_duplicate'] for s in statuses),
+            'runner': self.is_runner()
+        }
+
+    def _status(self, stream_id, spec, statuses):
+        status = statuses.get(stream_id)
+        if status is not None and status.get('requested_at') == spec['requested_at']:
+            return status
+        # Aún no lo ha recogido el proceso que ingiere
+        status = self.manager.build(stream_id, spec['source'], **spec['options']).status()
+        status.update({'state': 'pending', 'requested_at': spec['requested_at']})
+        return status
+
+    def _finished(self, stream_id, spec, statuses=None):
+        status = (statuses if statuses is not None else self.read_status()).get(stream_id)
+        return status is not None and status.get('requested_at') == spec['requested_at'] \
+            and status['state'] in FINAL_STATES
+
+    # --- Proceso que ingiere ---
+    def is_runner(self):
+        """True si este proceso es el que ingiere los streams."""
+        return fcntl is None or (self._runner_file is not None and self._runner_pid == os.getpid())
+
+    def _acquire_runner_lock(self):
+        if self.is_runner():
+            return True
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.lock_path)), exist_ok=True)
+            lock_file = open(self.lock_path, 'a')
+        except OSError as e:
+            print(f"Error abriendo {self.lock_path}: {e}")
+            return False
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()   # otro proceso ya ingiere
+            return False
+        self._runner_file, self._runner_pid = lock_file, os.getpid()
+        print(f"Proceso {os.getpid()} ingiere los streams de vídeo")
+        return True
+
+    def reconcile(self):
+        """Lleva el IngestManager de este proceso hacia los streams deseados y publica su estado."""
+        with self._lock:
+            streams = self.read()
+            previous = self.read_status()
+            for stream_id, spec in streams.items():
+                if self._started.get(stream_id) == spec['requested_at']:
+                    continue
+                self.manager.remove(stream_id)
+                self._started[stream_id] = spec['requested_at']
+                # Terminado antes de un reinicio (p. ej. un archivo ya leído): no se repite
+                if self._finished(stream_id, spec, previous):
+                    continue
+                try:
+                    self.manager.add(stream_id, spec['source'], **spec['options'])
+                except Exception as e:
+                    print(f"Error arrancando el stream {stream_id}: {e}")
+            for stream_id in list(self._started):
+                if stream_id not in streams:
+                    del self._started[stream_id]
+                    self.manager.remove(stream_id)
+
+            statuses = {}
+            for stream_id, spec in streams.items():
+                ingestor = self.manager.get(stream_id)
+                if ingestor is not None:
+                    statuses[stream_id] = {**ingestor.status(), 'requested_at': spec['requested_at']}
+                elif stream_id in previous:
+                    statuses[stream_id] = previous[stream_id]
+            try:
+                self._write_json(self.status_path, statuses)
+            except OSError as e:
+                print(f"Error publicando el estado de los streams en {self.status_path}: {e}")
+
+    def ensure_started(self):
+        """Arranca el hilo que elige el proceso que ingiere y sigue el archivo (también tras un fork)."""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._started = {}
+            self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+            self._thread.start()
+        # El primer proceso que atiende una petición ingiere desde ya
+        if self._acquire_runner_lock():
+            self.reconcile()
+
+    def _worker(self):
+        while True:
+            try:
+                if self._acquire_runner_lock():
+                    self.reconcile()
+            except Exception as e:
+                print(f"Error sincronizando los streams de vídeo: {e}")
+            time.sleep(self.poll_interval)
@@ -0,0 +1,244 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+_JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class QueueFullError(Exception):
+    """Se lanza cuando la cola de trabajos ha alcanzado su límite."""
+
+
+class JobManager:
+    """Ejecuta trabajos en un pool acotado de hilos y guarda su estado para consultarlo."""
+    # Los trabajos pasan por los estados queued → running → done / error.
+    # max_workers limita cuántos se ejecutan a la vez (para no quitar CPU a la
+    # inferencia en tiempo real) y max_pending cuántos pueden esperar en cola.
+    # Los trabajos terminados se conservan hasta max_finished o ttl_seconds.
+    #
+    # Con state_dir, cada cambio de estado se escribe además en
+    # <state_dir>/<job_id>.json (con escritura atómica), y get() lee ese archivo
+    # cuando el trabajo no es de este proceso: con varios workers de gunicorn,
+    # la consulta del estado puede llegar a un worker distinto del que aceptó
+    # el trabajo. Los contadores de get_stats son los del proceso.
+
+    def __init__(self, max_workers=1, max_pending=32, max_finished=500, ttl_seconds=3600, name='jobs',
+                 state_dir=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(1, int(max_pending))
+        self.max_finished = max_finished
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self.state_dir = state_dir
+
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()   # job_id -> dict de estado
+        self._last_state_sweep = 0.0
+        self._active = 0             # trabajos en cola o en ejecución
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        """Crea el pool de hilos (también tras un fork del proceso)."""
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def _prune(self):
+        """Elimina los trabajos terminados más antiguos (llamar con el lock tomado)."""
+        now = time.time()
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in ('done', 'error')]
+        expired = [job_id for job_id in finished if now - self._jobs[job_id]['finished_at'] > self.ttl_seconds]
+        overflow = finished[:max(0, len(finished) - self.max_finished)]
+        removed = set(expired) | set(overflow)
+        for job_id in removed:
+            del self._jobs[job_id]
+        if self.state_dir:
+            for job_id in removed:
+                self._remove_state(job_id)
+            if now - self._last_state_sweep > 60:
+                # Archivos que dejaron otros procesos (p. ej. workers ya reiniciados)
+                self._last_state_sweep = now
+                self._sweep_state_dir(now)
+
+    # --- Estado compartido entre procesos ---
+    def _state_path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _save_state(self, job):
+        if not self.state_dir:
+            return
+        path = self._state_path(job['job_id'])
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.state_dir, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(job, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error guardando el estado del trabajo {job['job_id']} de {self.name}: {e}")
+
+    def _load_state(self, job_id):
+        if not self.state_dir or not _JOB_ID.match(job_id):
+            return None
+        try:
+            with open(self._state_path(job_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _remove_state(self, job_id):
+        try:
+            os.unlink(self._state_path(job_id))
+        except OSError:
+            pass
+
+    def _sweep_state_dir(self, now):
+        try:
+            names = os.listdir(self.state_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.state_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl_seconds:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+    def submit(self, fn, *args, **kwargs):
+        """Encola fn(*args, **kwargs) y devuelve el id del trabajo."""
+        with self._lock:
+            if self._active >= self.max_pending:
+                raise QueueFullError(f"La cola {self.name} está llena ({self.max_pending} trabajos)")
+            self._prune()
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'status': 'queued',
+                'created_at': time.time(),
+                'finished_at': None,
+                'result': None,
+                'error': None
+            }
+            self._active += 1
+            executor = self._get_executor()
+            job = dict(self._jobs[job_id])
+
+        self._save_state(job)
+        executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        with self._lock:
+            self._jobs[job_id]['status'] = 'running'
+            job = dict(self._jobs[job_id])
+        self._save_state(job)
+        try:
+            result = fn(*args, **kwargs)
+            update = {'status': 'done', 'result': result}
+        except Exception as e:
+            print(f"Error en el trabajo {job_id} de {self.name}: {e}")
+            update = {'status': 'error', 'error': str(e)}
+
+        with self._lock:
+            self._jobs[job_id].update(update, finished_at=time.time())
+            self._active -= 1
+            job = dict(self._jobs[job_id])
+        self._save_state(job)
+
+    def get(self, job_id):
+        """Devuelve una copia del estado del trabajo, o None si no existe."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        # Trabajo aceptado por otro proceso
+        return self._load_state(job_id)
+
+    def get_stats(self):
+        """Configuración y ocupación de la cola."""
+        with self._lock:
+            statuses = [job['status'] for job in self._jobs.values()]
+            return {
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'queued': statuses.count('queued'),
+                'running': statuses.count('running'),
+                'done': statuses.count('done'),
+                'error': statuses.count('error')
+            }
+
+
+class BoundedExecutor:
+    """Pool acotado de hilos que rechaza trabajo nuevo en lugar de encolarlo sin límite."""
+    # A diferencia de JobManager, no guarda estado consultable: devuelve un
+    # Future. Como mucho max_pending tareas esperan o se ejecutan a la vez; por
+    # encima, submit lanza QueueFullError y retry_after() estima en cuántos
+    # segundos habrá hueco, a partir de la duración media reciente (EMA) de las tareas.
+
+    def __init__(self, max_workers=1, max_pending=16, name='executor'):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(self.max_workers, int(max_pending))
+        self.name = name
+        self._lock = threading.Lock()
+        self._active = 0
+        self._rejected = 0
+        self._completed = 0
+        self._avg_seconds = None
+        self._executor = None
+        self._pid = None
+
+    def submit(self, fn, *args, **kwargs):
+        """Encola fn(*args, **kwargs) y devuelve su Future; QueueFullError si no hay hueco."""
+        with self._lock:
+            if self._active >= self.max_pending:
+                self._rejected += 1
+                raise QueueFullError(f"La cola {self.name} está llena ({self.max_pending} tareas)")
+            self._active += 1
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+            executor = self._executor
+        return executor.submit(self._run, fn, args, kwargs)
+
+    def _run(self, fn, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+                self._avg_seconds = elapsed if self._avg_seconds is None else 0.8 * self._avg_seconds + 0.2 * elapsed
+
+    def retry_after(self):
+        """Segundos estimados hasta que se libere un hueco (al menos 1)."""
+        with self._lock:
+            waves = self._active / self.max_workers
+            return max(1, int(waves * (self._avg_seconds or 1.0) + 0.999))
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'active': self._active,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'avg_task_seconds': round(self._avg_seconds, 4) if self._avg_seconds is not None else None
+            }
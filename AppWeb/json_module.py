@@ -0,0 +1,43 @@
+from flask.json.provider import DefaultJSONProvider
+
+# Codificador JSON rápido opcional (pip install orjson)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# --- Serialización JSON ---
+# Con orjson instalado, jsonify (y app.json.dumps) lo usan en lugar del módulo
+# json de la biblioteca estándar. La salida es equivalente: mismas claves (y
+# en el mismo orden si app.json.sort_keys), y las fechas y demás tipos que no
+# son JSON nativo pasan por el mismo `default` de Flask. orjson escribe UTF-8
+# directamente en lugar de escapar los caracteres no ASCII.
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask respaldado por orjson."""
+
+    def _options(self, indent=False):
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        data = orjson.dumps(obj, default=self.default, option=self._options(indent)) + b'\n'
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+
+def install_json_provider(app, enabled=True):
+    """Usa orjson en la app si está habilitado e instalado; devuelve el nombre del codificador."""
+    if enabled and orjson is not None:
+        app.json = OrjsonProvider(app)
+        return 'orjson'
+    return 'json'
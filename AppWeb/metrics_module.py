@@ -0,0 +1,249 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# --- Métricas en formato OpenMetrics ---
+# Histogramas de latencia por etapa del pipeline (recepción del cuerpo, lectura
+# de disco, decodificación,
+# preprocesado, copia al dispositivo, forward, postproceso, Grad-CAM y
+# serialización), expuestos en /metrics para el scraping de Prometheus.
+# Cada proceso worker acumula sus propios valores y SharedMetrics los suma a
+# través de archivos, de modo que cualquier worker que atienda el scrape
+# devuelve los totales de todo el servidor.
+
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Límites de las cubetas en segundos, de 0.5 ms a 10 s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Histograma con etiquetas, seguro entre hilos."""
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS, unit=''):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.unit = unit
+        self._lock = threading.Lock()
+        # valores de etiquetas -> [conteos por cubeta (no acumulados) + desbordamiento, suma, total]
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _format_labels(self, label_values, extra=()):
+        pairs = list(zip(self.label_names, label_values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def snapshot(self):
+        """Copia de las series: valores de etiquetas -> (conteos por cubeta, suma, total)."""
+        with self._lock:
+            return {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+
+    def render(self, series=None):
+        """Líneas OpenMetrics del histograma (metadatos + series); por defecto, las de este proceso."""
+        if series is None:
+            series = self.snapshot()
+
+        lines = [f"# TYPE {self.name} histogram"]
+        if self.unit:
+            lines.append(f"# UNIT {self.name} {self.unit}")
+        lines.append(f"# HELP {self.name} {_escape(self.documentation)}")
+
+        for label_values in sorted(series):
+            counts, total, count = series[label_values]
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = self._format_labels(label_values, [('le', _format_float(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = self._format_labels(label_values, [('le', '+Inf')])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = self._format_labels(label_values)
+            lines.append(f"{self.name}_count{labels} {count}")
+            lines.append(f"{self.name}_sum{labels} {_format_float(total)}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_float(value):
+    return repr(float(value))
+
+
+# Histograma compartido por todas las etapas instrumentadas
+STAGE_LATENCY = Histogram(
+    'cdw_stage_duration_seconds',
+    'Duración de cada etapa del pipeline de clasificación y Grad-CAM.',
+    label_names=('pipeline', 'stage'),
+    unit='seconds'
+)
+
+REGISTRY = [STAGE_LATENCY]
+
+
+def observe_stage(pipeline, stage, seconds):
+    """Registra la duración de una etapa ya medida."""
+    STAGE_LATENCY.observe(seconds, pipeline, stage)
+
+
+@contextmanager
+def stage_timer(pipeline, stage):
+    """Mide con perf_counter el bloque y lo registra como etapa del pipeline."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(pipeline, stage, time.perf_counter() - start)
+
+
+def _process_alive(pid):
+    # os.kill en Windows termina el proceso: ahí solo cuenta el id de servidor
+    if os.name != 'posix' or not isinstance(pid, int):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedMetrics:
+    """Suma los histogramas de todos los procesos worker a través de un directorio."""
+    # Cada proceso vuelca sus series en <directorio>/<servidor>_<pid>_<inicio>.json
+    # cada flush_interval segundos (si han cambiado) y al salir. El id de
+    # servidor se crea al importar el módulo, así que con preload_app todos los
+    # workers de gunicorn lo heredan del maestro. collect() suma los archivos
+    # con el mismo id de servidor y los de procesos aún vivos (workers de
+    # uvicorn, que importan la aplicación cada uno). Así cada scrape devuelve
+    # los totales del servidor sea cual sea el worker que lo atiende, y con
+    # gunicorn los contadores de un worker que termina no se pierden (las
+    # series siguen siendo monótonas). Los archivos de ejecuciones anteriores
+    # se ignoran y se borran. Los valores de los otros workers llegan con un
+    # retraso de como mucho flush_interval.
+
+    def __init__(self, directory, registry=None, flush_interval=5.0, name='metrics-flush'):
+        self.directory = directory
+        self.registry = registry if registry is not None else REGISTRY
+        self.flush_interval = flush_interval
+        self.name = name
+        self.server_id = uuid.uuid4().hex
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._path = None
+        self._last = None
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Arranca el volcado periódico de este proceso (también tras un fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._path = os.path.join(self.directory, f"{self.server_id}_{os.getpid()}_{time.time_ns()}.json")
+            self._last = None
+            self._pid = os.getpid()
+            threading.Thread(target=self._worker, name=self.name, daemon=True).start()
+            atexit.register(self.flush)
+
+    def _snapshot(self):
+        return {metric.name: [[list(labels), counts, total, count]
+                              for labels, (counts, total, count) in sorted(metric.snapshot().items())]
+                for metric in self.registry}
+
+    def flush(self):
+        """Escribe las series de este proceso si han cambiado desde el último volcado."""
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            snapshot = self._snapshot()
+            if snapshot == self._last:
+                return
+            state = {'server': self.server_id, 'pid': os.getpid(), 'metrics': snapshot}
+            tmp_path = f"{self._path}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self._path)
+                self._last = snapshot
+            except OSError as e:
+                print(f"Error guardando métricas en {self._path}: {e}")
+
+    def _worker(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def collect(self):
+        """Series de todos los workers del servidor, sumadas: nombre de métrica -> series."""
+        self.ensure_started()
+        self.flush()
+        merged = {metric.name: {} for metric in self.registry}
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path, encoding='utf-8') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if state.get('server') != self.server_id and not _process_alive(state.get('pid')):
+                # Volcado de una ejecución anterior del servidor
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            for name, series in state.get('metrics', {}).items():
+                target = merged.get(name)
+                if target is None:
+                    continue
+                for labels, counts, total, count in series:
+                    current = target.get(tuple(labels))
+                    if current is not None:
+                        counts = [a + b for a, b in zip(current[0], counts)]
+                        total += current[1]
+                        count += current[2]
+                    target[tuple(labels)] = (counts, total, count)
+        return merged
+
+
+def render_openmetrics(registry=None, store=None):
+    """Exposición completa en formato OpenMetrics, terminada en '# EOF'.
+
+    Con `store` (SharedMetrics) las series son las de todos los workers sumadas.
+    """
+    merged = store.collect() if store is not None else {}
+    lines = []
+    for metric in (registry if registry is not None else REGISTRY):
+        lines.extend(metric.render(merged.get(metric.name)))
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
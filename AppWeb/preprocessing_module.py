@@ -0,0 +1,84 @@
+import io
+import os
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from torchvision import transforms
+
+# --- Preprocesamiento compartido ---
+# Implementación única de decodificación + transformación usada por
+# predict_image, /classify/camera y Grad-CAM.
+INPUT_SIZE = 224
+NORMALIZE_MEAN = [0.485, 0.456, 0.406]
+NORMALIZE_STD = [0.229, 0.224, 0.225]
+
+# Transformaciones estándar de ResNet (224x224 + normalización)
+transform = transforms.Compose([
+    transforms.Resize((INPUT_SIZE, INPUT_SIZE)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=NORMALIZE_MEAN, std=NORMALIZE_STD)
+])
+_MEAN = torch.tensor(NORMALIZE_MEAN).view(3, 1, 1)
+_STD = torch.tensor(NORMALIZE_STD).view(3, 1, 1)
+
+
+def decode_image(source, draft_size=(INPUT_SIZE, INPUT_SIZE)):
+    """Decodifica una imagen (ruta, bytes o PIL) en RGB, reduciéndola cerca de draft_size."""
+    # Para JPEG se usa Image.draft: libjpeg decodifica directamente a escala
+    # 1/2, 1/4 o 1/8 (la menor que siga siendo >= draft_size), sin llegar a
+    # crear el buffer RGB a resolución completa. Si la imagen sigue siendo
+    # mucho mayor (otros formatos), se aplica Image.reduce dejando al menos
+    # 2x draft_size para que el Resize final conserve la calidad.
+    # Con draft_size=None la imagen se decodifica a resolución completa.
+    if isinstance(source, Image.Image):
+        image = source
+    elif isinstance(source, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(source))
+    else:
+        # Verificar que el archivo existe antes de abrirlo
+        if isinstance(source, (str, os.PathLike)) and not os.path.exists(source):
+            raise FileNotFoundError(f"No se encontró la imagen: {source}")
+        image = Image.open(source)
+
+    if draft_size is not None and image.format == 'JPEG':
+        image.draft('RGB', draft_size)
+    image = image.convert('RGB')
+
+    if draft_size is not None:
+        factor = min(image.width // (2 * draft_size[0]), image.height // (2 * draft_size[1]))
+        if factor >= 2:
+            image = image.reduce(factor)
+
+    return image
+
+
+def preprocess(image):
+    """Convierte una imagen PIL en RGB al tensor normalizado de entrada del modelo."""
+    return transform(image)
+
+
+def load_tensor(source):
+    """Decodifica (con reducción temprana) y preprocesa una imagen en un solo paso."""
+    return preprocess(decode_image(source))
+
+
+def tensor_from_pixels(buffer, width=INPUT_SIZE, height=INPUT_SIZE):
+    """Tensor de entrada a partir de un frame crudo uint8 (RGB o RGBA, fila a fila).
+
+    Pensado para frames ya reducidos en el cliente (p. ej. getImageData de un
+    canvas de 224x224): no hay decodificación y, si el tamaño ya es el de
+    entrada, tampoco redimensionado. El número de canales se deduce de la
+    longitud del buffer; el canal alfa se descarta.
+    """
+    pixels = width * height
+    if pixels <= 0 or len(buffer) not in (pixels * 3, pixels * 4):
+        raise ValueError(f"El frame no es RGB/RGBA de {width}x{height}: {len(buffer)} bytes")
+    channels = len(buffer) // pixels
+
+    frame = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, channels)[:, :, :3]
+    tensor = torch.from_numpy(frame.astype(np.float32)).permute(2, 0, 1).div_(255.0)
+    if (height, width) != (INPUT_SIZE, INPUT_SIZE):
+        tensor = F.interpolate(tensor.unsqueeze(0), size=(INPUT_SIZE, INPUT_SIZE), mode='bilinear',
+                               align_corners=False, antialias=True).squeeze(0)
+    return (tensor - _MEAN) / _STD
@@ -0,0 +1,192 @@
+import copy
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig, prepare, convert
+from torchvision.models.quantization import resnet50 as quantizable_resnet50
+
+from inference_module import EagerBackend
+from preprocessing_module import load_tensor
+
+# --- Cuantización post-entrenamiento (INT8, solo CPU) ---
+# 'static': fusiona conv-bn-relu y cuantiza pesos y activaciones de toda la
+#           red, calibrando los rangos con imágenes de una carpeta. La Sigmoid
+#           final se calcula en float, por lo que las salidas siguen siendo
+#           probabilidades en [0, 1] en el mismo orden que CLASS_NAMES.
+# No hay modo dinámico: en esta red solo cuantizaría la capa fc, y el coste
+# está en las convoluciones, así que no acelera la inferencia.
+QUANTIZATION_MODES = ('static',)
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'webp'}
+
+
+def select_quantized_engine():
+    """Selecciona el motor de operaciones cuantizadas disponible (x86/fbgemm/qnnpack)."""
+    supported = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in supported:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError("Esta instalación de PyTorch no soporta operaciones cuantizadas")
+
+
+class QuantizedMultilabelResNet(nn.Module):
+    """ResNet50 cuantizada con la Sigmoid multilabel aplicada en float."""
+
+    def __init__(self, net):
+        super().__init__()
+        self.net = net
+
+    def forward(self, x):
+        return torch.sigmoid(self.net(x))
+
+
+def list_images(folder, limit=None):
+    """Rutas de las imágenes de una carpeta (orden estable)."""
+    names = sorted(f for f in os.listdir(folder) if f.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS)
+    paths = [os.path.join(folder, name) for name in names]
+    return paths[:limit] if limit else paths
+
+
+def calibration_key(calibration_dir, calibration_size=64):
+    """Huella corta del conjunto de calibración: imágenes elegidas (nombre, tamaño, fecha) y límite."""
+    paths = list_images(calibration_dir, limit=calibration_size) if calibration_dir and os.path.isdir(calibration_dir) else []
+    entries = []
+    for path in paths:
+        stat = os.stat(path)
+        entries.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    payload = json.dumps({'size': calibration_size, 'images': entries}).encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()[:12]
+
+
+def calibrated_artifact_path(artifact_path, calibration_dir, calibration_size=64):
+    """Ruta del artefacto INT8 con la huella de la calibración, para no reutilizar uno calibrado con otras imágenes."""
+    root, extension = os.path.splitext(artifact_path)
+    return f"{root}.cal-{calibration_key(calibration_dir, calibration_size)}{extension}"
+
+
+def iter_batches(paths, batch_size=16):
+    """Tensores preprocesados por lotes."""
+    for start in range(0, len(paths), batch_size):
+        yield torch.stack([load_tensor(path) for path in paths[start:start + batch_size]])
+
+
+def quantizable_copy(float_model):
+    """Copia del modelo float en CPU, para no modificar el modelo que usa Grad-CAM."""
+    return copy.deepcopy(float_model).to('cpu', memory_format=torch.contiguous_format).eval()
+
+
+def build_static_quantized_model(float_model, calibration_paths, batch_size=16):
+    """Cuantización estática: fusión conv-bn-relu, calibración y conversión a INT8."""
+    if not calibration_paths:
+        raise ValueError("La cuantización estática necesita al menos una imagen de calibración")
+
+    engine = select_quantized_engine()
+    num_classes = float_model.fc[0].out_features
+
+    # Misma arquitectura en su versión cuantizable, con la cabeza Linear sin Sigmoid
+    net = quantizable_resnet50(weights=None, quantize=False)
+    net.fc = nn.Linear(net.fc.in_features, num_classes)
+    state_dict = {
+        (key.replace('fc.0.', 'fc.', 1) if key.startswith('fc.0.') else key): value.detach().cpu()
+        for key, value in float_model.state_dict().items()
+    }
+    net.load_state_dict(state_dict)
+    net.eval()
+
+    net.fuse_model(is_qat=False)
+    net.qconfig = get_default_qconfig(engine)
+    prepare(net, inplace=True)
+
+    with torch.inference_mode():
+        for batch in iter_batches(calibration_paths, batch_size):
+            net(batch)
+
+    convert(net, inplace=True)
+    return QuantizedMultilabelResNet(net).eval()
+
+
+def build_quantized_model(float_model, mode, calibration_dir=None, calibration_size=64):
+    """Construye la variante INT8 del modelo float según el modo indicado."""
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Modo de cuantización desconocido: {mode} (opciones: {', '.join(QUANTIZATION_MODES)})")
+
+    if not calibration_dir or not os.path.isdir(calibration_dir):
+        raise FileNotFoundError(f"No se encontró la carpeta de calibración: {calibration_dir}")
+    calibration_paths = list_images(calibration_dir, limit=calibration_size)
+    print(f"Calibrando cuantización estática con {len(calibration_paths)} imágenes de {calibration_dir}")
+    return build_static_quantized_model(quantizable_copy(float_model), calibration_paths)
+
+
+def load_or_build_quantized_model(float_model, mode, artifact_path, calibration_dir=None, calibration_size=64):
+    """Reutiliza el modelo cuantizado guardado (TorchScript) o lo construye y lo guarda.
+
+    `artifact_path` debe identificar también la calibración (ver calibrated_artifact_path).
+    """
+    select_quantized_engine()
+    if artifact_path and os.path.exists(artifact_path):
+        print(f"Modelo INT8 ({mode}) cargado desde {artifact_path}")
+        return torch.jit.load(artifact_path, map_location='cpu').eval()
+
+    quantized = build_quantized_model(float_model, mode, calibration_dir, calibration_size)
+    if artifact_path:
+        os.makedirs(os.path.dirname(artifact_path), exist_ok=True)
+        with torch.inference_mode():
+            traced = torch.jit.trace(quantized, torch.randn(1, 3, 224, 224))
+        torch.jit.save(traced, artifact_path)
+        print(f"Modelo INT8 ({mode}) guardado en {artifact_path}")
+    return quantized
+
+
+def build_quantized_backend(float_model, mode, artifact_path, calibration_dir=None, calibration_size=64):
+    """Backend de inferencia (siempre en CPU) sobre la variante INT8 del modelo."""
+    quantized = load_or_build_quantized_model(float_model, mode, artifact_path, calibration_dir, calibration_size)
+    backend = EagerBackend(quantized, torch.device('cpu'), channels_last=False)
+    backend.name = f"int8-{mode}"
+    # Las cachés de predicciones distinguen también la calibración
+    backend.cache_tag = f"{backend.name}-{calibration_key(calibration_dir, calibration_size)}"
+    return backend
+
+
+def accuracy_delta_report(float_backend, quantized_backend, image_paths, class_names, threshold=0.5, batch_size=16):
+    """Compara las salidas INT8 con las fp32 sobre un conjunto de imágenes."""
+    float_probs, quantized_probs = [], []
+    float_time = quantized_time = 0.0
+
+    for batch in iter_batches(image_paths, batch_size):
+        start = time.perf_counter()
+        float_probs.append(float_backend(batch))
+        float_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        quantized_probs.append(quantized_backend(batch))
+        quantized_time += time.perf_counter() - start
+
+    float_probs = np.concatenate(float_probs)
+    quantized_probs = np.concatenate(quantized_probs)
+    diff = np.abs(float_probs - quantized_probs)
+
+    float_labels = float_probs >= threshold
+    quantized_labels = quantized_probs >= threshold
+
+    return {
+        'images': len(image_paths),
+        'top1_agreement': round(float((float_probs.argmax(1) == quantized_probs.argmax(1)).mean()) * 100, 2),
+        'label_agreement': round(float((float_labels == quantized_labels).all(1).mean()) * 100, 2),
+        'mean_abs_prob_diff': round(float(diff.mean()), 5),
+        'max_abs_prob_diff': round(float(diff.max()), 5),
+        'per_class': {
+            class_name: {
+                'mean_abs_prob_diff': round(float(diff[:, i].mean()), 5),
+                'label_agreement': round(float((float_labels[:, i] == quantized_labels[:, i]).mean()) * 100, 2)
+            }
+            for i, class_name in enumerate(class_names)
+        },
+        'fp32_ms_per_image': round(1000 * float_time / len(image_paths), 2),
+        'int8_ms_per_image': round(1000 * quantized_time / len(image_paths), 2),
+        'speedup': round(float_time / quantized_time, 2) if quantized_time else None
+    }
@@ -0,0 +1,58 @@
+"""Construye la variante INT8 del modelo y genera el informe de precisión frente a fp32.
+
+El modelo cuantizado se construye a partir de best_resnet_multilabel_v5.pt y
+se guarda en MODEL_EXPORT_FOLDER, de donde lo reutiliza la aplicación al
+arrancar con QUANTIZATION=static si QUANTIZATION_CALIBRATION_DIR y
+QUANTIZATION_CALIBRATION_SIZE eligen las mismas imágenes de calibración (su
+huella forma parte del nombre del archivo). El informe compara las
+probabilidades INT8 con las fp32 (acuerdo de clase ganadora y de etiquetas
+>50%, diferencias por clase) y la latencia de ambos modelos.
+
+Uso:
+    python quantize_model.py --mode static --calibration-dir datos/calibracion --eval-dir datos/validacion [--report informe.json]
+"""
+import argparse
+import json
+import os
+
+import app as cdw_app
+from inference_module import artifact_path_for
+from quantization_module import (QUANTIZATION_MODES, accuracy_delta_report, build_quantized_backend,
+                                  calibrated_artifact_path, list_images)
+
+
+def main():
+    default_images = os.path.join(cdw_app.BASE_DIR, 'test images')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=QUANTIZATION_MODES, default='static')
+    parser.add_argument('--calibration-dir', default=default_images)
+    parser.add_argument('--calibration-size', type=int, default=cdw_app.app.config['QUANTIZATION_CALIBRATION_SIZE'])
+    parser.add_argument('--eval-dir', default=default_images, help='Imágenes para comparar INT8 con fp32')
+    parser.add_argument('--report', help='Ruta donde guardar el informe JSON')
+    parser.add_argument('--force', action='store_true', help='Recalibrar aunque el modelo INT8 ya exista')
+    args = parser.parse_args()
+
+    cdw_app.load_model(backend='eager', quantization='')
+    model_name = os.path.splitext(cdw_app.MODEL_FILENAME)[0]
+    artifact_path = artifact_path_for(cdw_app.app.config['MODEL_EXPORT_FOLDER'], model_name,
+                                      cdw_app.model_fingerprint, f"int8-{args.mode}")
+    artifact_path = calibrated_artifact_path(artifact_path, args.calibration_dir, args.calibration_size)
+    if args.force and os.path.exists(artifact_path):
+        os.unlink(artifact_path)
+
+    quantized_backend = build_quantized_backend(cdw_app.model, args.mode, artifact_path,
+                                                calibration_dir=args.calibration_dir,
+                                                calibration_size=args.calibration_size)
+
+    report = accuracy_delta_report(cdw_app.inference_backend, quantized_backend,
+                                   list_images(args.eval_dir), cdw_app.CLASS_NAMES)
+    report = {'mode': args.mode, 'artifact': artifact_path, **report}
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
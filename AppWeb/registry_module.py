@@ -0,0 +1,426 @@
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+from stats_module import StatsCollector
+
+# Bloqueo entre procesos para modificar el estado compartido (no existe en Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# --- Registro de modelos ---
+# Varias versiones del modelo pueden estar cargadas a la vez, compartiendo el
+# preprocesamiento. Una es la activa (la que recibe el tráfico por defecto) y
+# opcionalmente otra es la candidata, que recibe un porcentaje del tráfico o
+# el de cámaras concretas (A/B). Las versiones nuevas se cargan en un hilo de
+# fondo y solo entonces se publican; activar una versión o cambiar el reparto
+# es una única asignación de referencia, de modo que las peticiones en curso
+# terminan con la versión que tomaron y las nuevas usan la nueva, sin cortes.
+
+Routing = namedtuple('Routing', ['active', 'candidate', 'percent', 'cameras'])
+
+
+class ModelVersion:
+    """Una versión cargada: modelo eager, backend de inferencia y estadísticas propias."""
+
+    def __init__(self, name, path, model, backend, fingerprint, device, architecture='resnet50'):
+        self.name = name
+        self.path = path
+        self.model = model              # modelo eager (Grad-CAM)
+        self.backend = backend          # backend de inferencia (eager/torchscript/onnx/int8)
+        self.fingerprint = fingerprint  # forma parte de las claves de caché
+        self.device = device
+        self.architecture = architecture
+        self.loaded_at = datetime.now().isoformat(timespec='seconds')
+        self.stats = StatsCollector(window=100)   # latencia y distribución de clases de esta versión
+
+    def info(self):
+        summary = self.stats.summary()
+        return {
+            'name': self.name,
+            'path': self.path,
+            'architecture': self.architecture,
+            'backend': self.backend.name,
+            'fingerprint': self.fingerprint,
+            'loaded_at': self.loaded_at,
+            'stats': {
+                'total': summary['total'],
+                'avg_confidence': round(summary['avg_confidence'], 1),
+                'avg_processing_time': round(summary['avg_processing_time'], 4),
+                'processing_time_percentiles': {k: round(v, 4) for k, v in summary['latency_percentiles'].items()},
+                'class_distribution': summary['class_distribution']
+            }
+        }
+
+
+class ModelRegistry:
+    """Versiones de modelo cargadas, versión activa y reparto de tráfico hacia la candidata."""
+
+    def __init__(self, loader, on_activate=None):
+        self.loader = loader              # loader(name, path, **opciones) -> ModelVersion
+        self.on_activate = on_activate    # on_activate(version) tras cada cambio de versión activa
+        self._lock = threading.Lock()
+        self._versions = {}               # se reemplaza (copia) en cada cambio; lectura sin lock
+        self._loading = {}                # name -> estado de las cargas en segundo plano
+        self._routing = Routing(None, None, 0.0, frozenset())
+
+    # --- Consulta ---
+    def get(self, name):
+        return self._versions.get(name)
+
+    def loading_state(self, name):
+        """Estado de la última carga en segundo plano de `name` ('loading'/'error'), o None."""
+        with self._lock:
+            state = self._loading.get(name)
+            return dict(state) if state is not None else None
+
+    def active(self):
+        return self._versions.get(self._routing.active)
+
+    def route(self, routing_key=None, camera_id=None):
+        """Versión que debe atender una petición.
+
+        Las cámaras listadas van siempre a la candidata; el resto, con la
+        probabilidad configurada. Con routing_key (p. ej. el id de un stream)
+        la decisión es determinista, para que un stream no alterne entre modelos.
+        """
+        routing, versions = self._routing, self._versions
+        candidate = versions.get(routing.candidate) if routing.candidate else None
+        if candidate is not None:
+            if camera_id is not None and camera_id in routing.cameras:
+                return candidate
+            if routing.percent > 0:
+                if routing_key is not None:
+                    bucket = zlib.crc32(str(routing_key).encode('utf-8')) % 10000 / 100.0
+                else:
+                    bucket = random.random() * 100
+                if bucket < routing.percent:
+                    return candidate
+        return versions.get(routing.active)
+
+    # --- Altas, activación y reparto ---
+    def add(self, version, activate=False):
+        """Publica una versión ya cargada (reemplaza a otra con el mismo nombre)."""
+        with self._lock:
+            versions = dict(self._versions)
+            versions[version.name] = version
+            self._versions = versions
+            self._loading.pop(version.name, None)
+            if activate or self._routing.active is None:
+                self._activate_locked(version.name)
+            elif self._routing.active == version.name and self.on_activate is not None:
+                # Recarga de la versión activa con el mismo nombre
+                self.on_activate(version)
+        return version
+
+    def load(self, name, path, activate=False, background=True, **options):
+        """Carga una versión (por defecto en un hilo de fondo) y la publica al terminar."""
+        with self._lock:
+            state = self._loading.get(name)
+            if state is not None and state['state'] == 'loading':
+                raise ValueError(f"El modelo '{name}' ya se está cargando")
+            self._loading[name] = {'state': 'loading', 'path': path, 'error': None,
+                                   'started_at': datetime.now().isoformat(timespec='seconds')}
+
+        def run():
+            try:
+                version = self.loader(name, path, **options)
+                self.add(version, activate=activate)
+                print(f"Modelo '{name}' cargado desde {path}" + (" y activado" if activate else ""))
+            except Exception as e:
+                print(f"Error cargando el modelo '{name}': {e}")
+                with self._lock:
+                    self._loading[name] = {**self._loading.get(name, {}), 'state': 'error', 'error': str(e)}
+                if not background:
+                    raise
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name=f"model-loader-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def activate(self, name):
+        """Cambia la versión activa de forma atómica."""
+        with self._lock:
+            if name not in self._versions:
+                raise KeyError(name)
+            self._activate_locked(name)
+
+    def _activate_locked(self, name):
+        routing = self._routing
+        # Si la candidata pasa a ser la activa, deja de ser candidata
+        candidate = None if routing.candidate == name else routing.candidate
+        self._routing = routing._replace(active=name, candidate=candidate,
+                                         percent=routing.percent if candidate else 0.0,
+                                         cameras=routing.cameras if candidate else frozenset())
+        if self.on_activate is not None:
+            self.on_activate(self._versions[name])
+
+    def set_routing(self, candidate=None, percent=0.0, cameras=()):
+        """Configura la candidata y su parte del tráfico (porcentaje y/o cámaras)."""
+        with self._lock:
+            if candidate is not None and candidate not in self._versions:
+                raise KeyError(candidate)
+            if candidate is not None and candidate == self._routing.active:
+                raise ValueError('La candidata no puede ser la versión activa')
+            percent = min(100.0, max(0.0, float(percent))) if candidate else 0.0
+            self._routing = self._routing._replace(candidate=candidate, percent=percent,
+                                                   cameras=frozenset(cameras) if candidate else frozenset())
+            return self.routing()
+
+    def remove(self, name):
+        """Descarga una versión que no esté activa; devuelve False si no existe."""
+        with self._lock:
+            if name == self._routing.active:
+                raise ValueError('No se puede descargar la versión activa')
+            if name not in self._versions:
+                self._loading.pop(name, None)
+                return False
+            versions = dict(self._versions)
+            del versions[name]
+            self._versions = versions
+            if self._routing.candidate == name:
+                self._routing = self._routing._replace(candidate=None, percent=0.0, cameras=frozenset())
+            return True
+
+    def rebuild_backends(self, build):
+        """Reconstruye el backend de cada versión con build(version) (p. ej. tras un fork)."""
+        with self._lock:
+            for version in self._versions.values():
+                version.backend = build(version)
+            active = self._versions.get(self._routing.active)
+            if active is not None and self.on_activate is not None:
+                self.on_activate(active)
+
+    # --- Estado ---
+    def routing(self):
+        routing = self._routing
+        return {
+            'active': routing.active,
+            'candidate': routing.candidate,
+            'percent': routing.percent,
+            'cameras': sorted(routing.cameras)
+        }
+
+    def list(self):
+        routing = self._routing
+        versions = []
+        for version in self._versions.values():
+            info = version.info()
+            info['state'] = 'active' if version.name == routing.active else (
+                'candidate' if version.name == routing.candidate else 'loaded')
+            versions.append(info)
+        with self._lock:
+            loading = [{'name': name, **state} for name, state in self._loading.items()]
+        return {'routing': self.routing(), 'models': versions, 'loading': loading}
+
+
+class RegistrySync:
+    """Estado deseado del registro en un archivo JSON compartido por todos los procesos."""
+    # Con varios workers (gunicorn o uvicorn) cada proceso tiene su propio
+    # registro. Las rutas /api/models* no lo modifican directamente: escriben
+    # el estado deseado (versiones extra con sus opciones, versión activa,
+    # candidata y reparto) en `path`, con un bloqueo exclusivo y escritura
+    # atómica, y cada proceso lo aplica a su registro: el que atendió la
+    # petición al momento y el resto al detectar el cambio (un hilo consulta
+    # la fecha de modificación cada poll_interval segundos). Las versiones que
+    # faltan se cargan en segundo plano; la activación y el reparto que las
+    # usan se aplican en cuanto están publicadas. El archivo sobrevive a los
+    # reinicios: al arrancar se aplica igual que cualquier cambio.
+    #
+    # Las versiones cargadas al arrancar (MODEL_FILENAME y MODEL_CANDIDATE) no
+    # figuran en `versions`; para descargarlas se anotan en `unloaded`.
+    # `active` y `routing` valen None mientras nadie los cambie por la API: en
+    # ese caso se respeta lo configurado al arrancar.
+
+    def __init__(self, registry, path, resolve_path, poll_interval=2.0, name='registry-sync'):
+        self.registry = registry
+        self.path = path
+        self.resolve_path = resolve_path   # resolve_path(file) -> ruta del checkpoint o None
+        self.poll_interval = poll_interval
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._applied = None      # (revisión, aplicada por completo)
+        self._specs = {}          # nombre -> opciones con las que se cargó la versión en este proceso
+        self._failed = {}         # nombre -> opciones cuya carga falló (no se reintenta)
+        self._mtime = None
+        self._thread = None
+        self._pid = None
+
+    @staticmethod
+    def empty_state():
+        return {'revision': 0, 'versions': {}, 'unloaded': [], 'active': None, 'routing': None}
+
+    # --- Archivo compartido ---
+    def read(self):
+        """Estado deseado actual (vacío si el archivo no existe o no se puede leer)."""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return {**self.empty_state(), **json.load(f)}
+        except FileNotFoundError:
+            return self.empty_state()
+        except (OSError, ValueError) as e:
+            print(f"Error leyendo el estado del registro {self.path}: {e}")
+            return self.empty_state()
+
+    def update(self, mutate):
+        """Aplica mutate(state) al estado compartido y lo publica; devuelve el nuevo estado.
+
+        mutate puede lanzar KeyError/ValueError para rechazar el cambio (no se
+        escribe nada).
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{self.path}.lock", 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            state = self.read()
+            mutate(state)
+            state['revision'] += 1
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp_path, self.path)
+        self.apply(state)
+        return state
+
+    def knows(self, name, state):
+        """True si `name` es una versión del estado deseado (extra, o de arranque y no descargada)."""
+        return name in state['versions'] or (self.registry.get(name) is not None and name not in state['unloaded'])
+
+    def desired_routing(self, state):
+        """Reparto deseado, con lo configurado al arrancar donde el estado no dice nada."""
+        current = self.registry.routing()
+        routing = state['routing'] or current
+        active = state['active'] or current['active']
+        return {
+            'active': active,
+            'candidate': routing['candidate'] if routing['candidate'] != active else None,
+            'percent': routing['percent'] if routing['candidate'] not in (None, active) else 0.0,
+            'cameras': sorted(routing['cameras']) if routing['candidate'] not in (None, active) else []
+        }
+
+    # --- Aplicación al registro de este proceso ---
+    def apply(self, state=None, background=True):
+        """Lleva el registro de este proceso hacia el estado deseado; True si ya coincide."""
+        state = state or self.read()
+        with self._lock:
+            if self._applied == (state['revision'], True):
+                return True
+            complete = self._apply_locked(state, background)
+            self._applied = (state['revision'], complete)
+            return complete
+
+    def _apply_locked(self, state, background):
+        registry = self.registry
+        complete = True
+
+        # 1. Versiones que faltan o cuyas opciones cambiaron
+        for name, spec in state['versions'].items():
+            version = registry.get(name)
+            loading = registry.loading_state(name)
+            if version is not None and self._specs.get(name, spec) == spec:
+                self._specs[name] = spec
+                continue
+            if self._failed.get(name) == spec:
+                continue
+            if loading is not None and loading['state'] == 'loading':
+                complete = False
+                continue
+            if loading is not None and loading['state'] == 'error' and self._specs.get(name) == spec:
+                print(f"Sincronización del registro: no se pudo cargar '{name}': {loading['error']}")
+                self._failed[name] = spec
+                continue
+            path = self.resolve_path(spec['file'])
+            if path is None:
+                print(f"Sincronización del registro: no se encontró el archivo {spec['file']} de '{name}'")
+                self._failed[name] = spec
+                continue
+            self._specs[name] = spec
+            try:
+                registry.load(name, path, background=background, backend=spec.get('backend'),
+                              quantization=spec.get('quantization'), architecture=spec.get('architecture') or 'resnet50')
+            except Exception as e:
+                print(f"Sincronización del registro: error cargando '{name}': {e}")
+                self._failed[name] = spec
+                continue
+            complete = complete and not background
+
+        # 2. Versión activa
+        active = state['active']
+        if active and registry.routing()['active'] != active:
+            if registry.get(active) is not None:
+                registry.activate(active)
+            elif self._failed.get(active) is None:
+                complete = False
+
+        # 3. Candidata y reparto
+        routing = state['routing']
+        candidate = routing['candidate'] if routing else None
+        if routing is None:
+            pass
+        elif candidate is None or registry.get(candidate) is not None:
+            wanted = {'candidate': candidate, 'percent': float(routing['percent']) if candidate else 0.0,
+                      'cameras': sorted(routing['cameras']) if candidate else []}
+            current = registry.routing()
+            if {key: current[key] for key in wanted} != wanted and candidate != current['active']:
+                registry.set_routing(candidate, wanted['percent'], wanted['cameras'])
+        elif self._failed.get(candidate) is None:
+            complete = False
+
+        # 4. Versiones descargadas (nunca la activa ni la candidata actuales)
+        routing = registry.routing()
+        for name in state['unloaded']:
+            if registry.get(name) is not None and name not in state['versions'] \
+                    and name not in (routing['active'], routing['candidate']):
+                registry.remove(name)
+        for name in list(self._specs):
+            if name not in state['versions']:
+                del self._specs[name]
+                if registry.get(name) is not None and name not in (routing['active'], routing['candidate']):
+                    registry.remove(name)
+        return complete
+
+    # --- Hilo de consulta ---
+    def ensure_started(self):
+        """Arranca el hilo que sigue los cambios del archivo (también tras un fork del proceso)."""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _worker(self):
+        while True:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+            try:
+                if mtime != self._mtime or self._applied is None or not self._applied[1]:
+                    self._mtime = mtime
+                    self.apply()
+            except Exception as e:
+                print(f"Error sincronizando el registro de modelos: {e}")
+            time.sleep(self.poll_interval)
+
+    def get_stats(self):
+        applied = self._applied
+        return {
+            'state_file': self.path,
+            'revision': applied[0] if applied else None,
+            'in_sync': bool(applied and applied[1]),
+            'failed': sorted(self._failed)
+        }
@@ -0,0 +1,363 @@
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+# --- Almacén persistente de resultados ---
+# Cada clasificación se guarda como una fila de SQLite con las probabilidades
+# por clase en columnas tipadas (prob_<clase>, en %). La base de datos usa WAL:
+# un único hilo de fondo escribe por lotes (una transacción por lote) y los
+# lectores consultan en paralelo con su propia conexión, sin bloquear al
+# escritor. Los índices sobre timestamp y (predicted_class, timestamp) permiten
+# responder consultas por rango de fechas y por clase sin recorrer la tabla.
+# La tabla meta guarda el id de la sesión actual, de modo que todos los
+# workers de gunicorn escriben y exportan la misma sesión.
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+_IDENTIFIER = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+
+def new_session_id():
+    """Identificador de una sesión de clasificación."""
+    return uuid.uuid4().hex
+
+
+def normalize_time_bound(value, end=False):
+    """Normaliza un límite de tiempo ('YYYY-MM-DD' o 'YYYY-MM-DD[ T]HH:MM[:SS]') al formato almacenado."""
+    if not value:
+        return None
+    value = value.strip().replace('T', ' ')
+    if len(value) == 10:
+        return value + (' 23:59:59' if end else ' 00:00:00')
+    if len(value) == 16:
+        return value + (':59' if end else ':00')
+    return value[:19]
+
+
+class ResultsStore:
+    """Resultados de clasificación en SQLite (modo WAL) con inserciones por lotes."""
+
+    def __init__(self, db_path, class_names, batch_size=64, flush_interval=0.5, name='results-writer'):
+        for class_name in class_names:
+            if not _IDENTIFIER.match(class_name):
+                raise ValueError(f"Nombre de clase no válido como columna: {class_name}")
+
+        self.db_path = db_path
+        self.class_names = list(class_names)
+        self.prob_columns = [f"prob_{c}" for c in self.class_names]
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._thread = None
+        self._pid = None
+        self.total_written = 0
+
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            with conn:
+                self._create_schema(conn)
+        finally:
+            conn.close()
+
+    # --- Conexiones y esquema ---
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _reader(self):
+        """Conexión de lectura propia de cada hilo (y de cada proceso tras un fork)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _create_schema(self, conn):
+        prob_columns = ',\n'.join(f"    {column} REAL" for column in self.prob_columns)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                source TEXT NOT NULL DEFAULT 'upload',
+                filename TEXT,
+                predicted_class TEXT NOT NULL,
+                confidence REAL NOT NULL,
+            {prob_columns}
+            )
+        """)
+        # Columnas de clases añadidas después de crear la tabla
+        existing = {row['name'] for row in conn.execute('PRAGMA table_info(results)')}
+        for column in self.prob_columns:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE results ADD COLUMN {column} REAL")
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_results_timestamp ON results (timestamp)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_results_class_timestamp ON results (predicted_class, timestamp)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_results_session ON results (session_id, id)')
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('current_session', ?)", (new_session_id(),))
+
+    # --- Sesión actual ---
+    def current_session(self):
+        """Id de la sesión actual (se lee en cada llamada: otro proceso puede haberla cambiado)."""
+        row = self._reader().execute("SELECT value FROM meta WHERE key = 'current_session'").fetchone()
+        return row[0]
+
+    def start_session(self):
+        """Empieza una sesión nueva para todos los procesos y devuelve su id."""
+        session_id = new_session_id()
+        conn = self._reader()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('current_session', ?)", (session_id,))
+        return session_id
+
+    # --- Escritura ---
+    def _ensure_started(self):
+        """Arranca el hilo escritor (también tras un fork del proceso)."""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+            self._thread.start()
+
+    def add(self, session_id, predicted_class, confidence, probabilities, filename=None,
+            timestamp=None, source='upload'):
+        """Encola un resultado; `probabilities` es {clase: probabilidad en %}."""
+        self._ensure_started()
+        row = (
+            session_id,
+            timestamp or time.strftime(TIMESTAMP_FORMAT),
+            source,
+            filename,
+            predicted_class,
+            float(confidence),
+            *[float(probabilities.get(c, 0.0)) for c in self.class_names]
+        )
+        self._queue.put(row)
+
+    def flush(self, timeout=30):
+        """Espera a que todos los resultados encolados hasta ahora estén escritos."""
+        if self._thread is None or self._pid != os.getpid():
+            return True
+        event = threading.Event()
+        self._queue.put(event)
+        return event.wait(timeout)
+
+    def _insert(self, conn, rows):
+        columns = ['session_id', 'timestamp', 'source', 'filename', 'predicted_class', 'confidence'] + self.prob_columns
+        sql = f"INSERT INTO results ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        with conn:
+            conn.executemany(sql, rows)
+        self.total_written += len(rows)
+
+    def _worker(self):
+        conn = self._connect()
+        while True:
+            rows, events = [], []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            # Agrupar lo que llegue dentro del intervalo, hasta batch_size filas
+            while True:
+                if isinstance(item, threading.Event):
+                    events.append(item)
+                    break
+                rows.append(item)
+                if len(rows) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if rows:
+                for attempt in range(3):
+                    try:
+                        self._insert(conn, rows)
+                        break
+                    except sqlite3.Error as e:
+                        print(f"Error guardando {len(rows)} resultados (intento {attempt + 1}/3): {e}")
+                        time.sleep(0.1 * (attempt + 1))
+            for event in events:
+                event.set()
+
+    # --- Consultas ---
+    def _where(self, start=None, end=None, classes=None, session_id=None):
+        clauses, params = [], []
+        start, end = normalize_time_bound(start), normalize_time_bound(end, end=True)
+        if start:
+            clauses.append('timestamp >= ?')
+            params.append(start)
+        if end:
+            clauses.append('timestamp <= ?')
+            params.append(end)
+        if classes:
+            clauses.append(f"predicted_class IN ({', '.join('?' * len(classes))})")
+            params.extend(classes)
+        if session_id:
+            clauses.append('session_id = ?')
+            params.append(session_id)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def _to_dict(self, row):
+        result = {key: row[key] for key in ('id', 'session_id', 'timestamp', 'source', 'filename',
+                                             'predicted_class', 'confidence')}
+        result['probabilities'] = {c: row[column] for c, column in zip(self.class_names, self.prob_columns)}
+        return result
+
+    def query(self, start=None, end=None, classes=None, session_id=None, limit=None, offset=0,
+              descending=False, chunk_size=500):
+        """Itera los resultados que cumplen los filtros, en orden de inserción.
+
+        Las filas se leen del cursor por bloques de chunk_size, de modo que
+        recorrer todo el histórico no lo carga entero en memoria.
+        """
+        self.flush()
+        where, params = self._where(start, end, classes, session_id)
+        sql = f"SELECT * FROM results{where} ORDER BY id {'DESC' if descending else 'ASC'}"
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params += [int(limit), int(offset)]
+        cursor = self._reader().execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self._to_dict(row)
+        finally:
+            cursor.close()
+
+    def count(self, start=None, end=None, classes=None, session_id=None):
+        """Número de resultados que cumplen los filtros."""
+        self.flush()
+        where, params = self._where(start, end, classes, session_id)
+        return self._reader().execute(f"SELECT COUNT(*) FROM results{where}", params).fetchone()[0]
+
+    def count_by_class(self, start=None, end=None, session_id=None):
+        """Resultados por clase predicha (p. ej. cuánto asfáltico hoy), resueltos con los índices."""
+        self.flush()
+        where, params = self._where(start, end, None, session_id)
+        rows = self._reader().execute(
+            f"SELECT predicted_class, COUNT(*) AS n, AVG(confidence) AS avg_confidence "
+            f"FROM results{where} GROUP BY predicted_class", params
+        ).fetchall()
+        return {row['predicted_class']: {'count': row['n'], 'avg_confidence': row['avg_confidence']} for row in rows}
+
+    def get_stats(self):
+        return {
+            'db_path': self.db_path,
+            'pending_writes': self._queue.qsize(),
+            'written': self.total_written
+        }
+
+
+# --- Exportación columnar (Parquet / Arrow) ---
+COLUMNAR_FORMATS = {
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrows', 'application/vnd.apache.arrow.stream'),
+}
+
+
+class _ChunkSink:
+    """Destino de escritura que acumula los bytes producidos para entregarlos por bloques."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_columnar_export(rows, class_names, fmt='parquet', batch_rows=1000):
+    """Devuelve un generador de bytes con los resultados en Parquet o Arrow IPC (stream).
+
+    Las filas se convierten en RecordBatch de batch_rows filas y cada bloque
+    se entrega en cuanto se escribe, sin construir la tabla completa. Requiere
+    pyarrow, que se comprueba al llamar (antes de empezar la respuesta).
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("La exportación Parquet/Arrow requiere pyarrow (pip install pyarrow)") from e
+    if fmt not in COLUMNAR_FORMATS:
+        raise ValueError(f"Formato de exportación desconocido: {fmt}")
+
+    prob_fields = [f"prob_{c}" for c in class_names]
+    schema = pa.schema(
+        [('timestamp', pa.timestamp('s')), ('session_id', pa.string()), ('source', pa.string()),
+         ('filename', pa.string()), ('predicted_class', pa.string()), ('confidence', pa.float64())]
+        + [(field, pa.float64()) for field in prob_fields]
+    )
+
+    def to_batch(buffer):
+        columns = [
+            [datetime.strptime(r['timestamp'], TIMESTAMP_FORMAT) for r in buffer],
+            [r['session_id'] for r in buffer],
+            [r['source'] for r in buffer],
+            [r['filename'] for r in buffer],
+            [r['predicted_class'] for r in buffer],
+            [r['confidence'] for r in buffer],
+        ] + [[r['probabilities'][c] for r in buffer] for c in class_names]
+        return pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                               schema=schema)
+
+    def generate():
+        sink = _ChunkSink()
+        output = pa.PythonFile(sink, mode='w')
+        writer = pq.ParquetWriter(output, schema) if fmt == 'parquet' else pa.ipc.new_stream(output, schema)
+        try:
+            buffer = []
+            for row in rows:
+                buffer.append(row)
+                if len(buffer) >= batch_rows:
+                    # En Parquet cada bloque es un row group
+                    writer.write_batch(to_batch(buffer))
+                    buffer = []
+                    yield sink.drain()
+            if buffer:
+                writer.write_batch(to_batch(buffer))
+        finally:
+            writer.close()
+        yield sink.drain()
+
+    return generate()
@@ -46,7 +46,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // === VARIABLES DE CÁMARA ===
     let currentStream = null;
-    let detectionInterval = null;
+    let detectionTimer = null;
     let availableCameras = [];
     let currentCameraIndex = 0;
     let isDetecting = false;
@@ -503,23 +503,31 @@ document.addEventListener('DOMContentLoaded', () => {
         gradcamBody.innerHTML = `<p>🔄 ${i18next.t('generating_gradcam')}...</p>`;
         gradcamModal.style.display = 'block';
 
-        fetch('/api/gradcam', {
+        // El servidor encola el trabajo y devuelve su id; se consulta su estado
+        // hasta que los heatmaps están listos.
+        fetch('/api/gradcam/jobs', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ filename: result.filename })
+            // model: versión que clasificó la imagen, para explicar esa misma predicción
+            body: JSON.stringify({ filename: result.stored_name || result.filename, model: result.model })
         })
         .then(response => response.json())
+        .then(job => {
+            if (!job.status_url) {
+                throw new Error(job.error || 'No se pudo encolar el trabajo Grad-CAM');
+            }
+            return pollGradcamJob(job.status_url);
+        })
         .then(data => {
             gradcamBody.innerHTML = ''; // Limpiar loader
 
             if (data.heatmap_urls && data.heatmap_urls.length > 0) {
-                data.heatmap_urls.forEach(url => {
+                data.heatmap_urls.forEach((url, index) => {
                     const wrapper = document.createElement('div');
                     wrapper.style = 'text-align: center; margin-bottom: 15px;';
 
-                    const urlFilename = url.split('/').pop(); // gradcam_120755_basura_general.jpg
-                    const match = urlFilename.match(/gradcam_.+?_([a-z_]+)\.jpg$/);
-                    const className = match ? match[1] : 'desconocido';
+                    // La clase llega en paralelo a las URLs (también sirve para data URLs)
+                    const className = (data.heatmap_classes || [])[index] || 'desconocido';
 
                     const emoji = CLASS_EMOJIS[className] || '📦';
                     //const readableName = classDisplayNames[className] || className;
@@ -549,6 +557,22 @@ document.addEventListener('DOMContentLoaded', () => {
             gradcamBody.innerHTML = `<p>❌ ${i18next.t('error_generating_gradcam')}</p>`;
         });
     }
+    // Consulta periódicamente el estado de un trabajo Grad-CAM hasta que termina
+    async function pollGradcamJob(statusUrl, intervalMs = 500) {
+        while (true) {
+            const response = await fetch(statusUrl);
+            const data = await response.json();
+
+            if (data.status === 'done') {
+                return data;
+            }
+            if (data.status === 'error' || !response.ok) {
+                throw new Error(data.error || 'Error generando Grad-CAM');
+            }
+            await new Promise(resolve => setTimeout(resolve, intervalMs));
+        }
+    }
+
     // Cerrar el modal de Grad-CAM
     closeGradcamModal.onclick = () => {
         gradcamModal.style.display = 'none';
@@ -661,12 +685,16 @@ document.addEventListener('DOMContentLoaded', () => {
             currentStream = null;
         }
         
-        if (detectionInterval) {
-            clearInterval(detectionInterval);
-            detectionInterval = null;
+        if (detectionTimer) {
+            clearTimeout(detectionTimer);
+            detectionTimer = null;
         }
-        
         isDetecting = false;
+        if (cameraSocket) {
+            cameraSocket.onclose = null;
+            cameraSocket.close();
+            cameraSocket = null;
+        }
         
         // Ocultar área de cámara
         cameraArea.style.display = 'none';
@@ -696,63 +724,123 @@ document.addEventListener('DOMContentLoaded', () => {
         await startCamera();
     }
     
-    function startDetection() {
+    // Los frames se reducen en el cliente a 224x224 (el tamaño de entrada del
+    // modelo) y se envían como píxeles RGBA crudos: el servidor no tiene que
+    // decodificar ni redimensionar. Se usa una conexión WebSocket persistente
+    // si el servidor la ofrece y, si no, POST binario a /classify/camera/raw.
+    // Cada frame se envía cuando llega la respuesta del anterior, como mucho
+    // cada CAMERA_FRAME_INTERVAL_MS. Cada detección usa un identificador de
+    // stream propio: el servidor reutiliza el resultado si la escena no cambia
+    // y suaviza la etiqueta en el tiempo.
+    const CAMERA_FRAME_SIZE = 224;
+    const CAMERA_FRAME_INTERVAL_MS = 200;
+    const frameCanvas = document.createElement('canvas');
+    frameCanvas.width = CAMERA_FRAME_SIZE;
+    frameCanvas.height = CAMERA_FRAME_SIZE;
+    const frameCtx = frameCanvas.getContext('2d', { willReadFrequently: true });
+    let cameraSocket = null;
+    let frameSentAt = 0;
+    let cameraStreamId = null;
+
+    function grabDownscaledFrame() {
+        frameCtx.drawImage(cameraVideo, 0, 0, CAMERA_FRAME_SIZE, CAMERA_FRAME_SIZE);
+        return frameCtx.getImageData(0, 0, CAMERA_FRAME_SIZE, CAMERA_FRAME_SIZE).data; // RGBA uint8
+    }
+
+    function showCameraResult(data) {
+        if (data.result) {
+            const result = data.result;
+            const materialTranslated = i18next.t(`materials.${result.predicted_class}`);
+            updateLivePrediction(
+                //`${result.emoji} ${result.display_name}`,
+                `${result.emoji} ${materialTranslated}`,
+                `${result.confidence.toFixed(1)}%`,
+                result.timestamp
+            );
+            
+            // Actualizar estadísticas (sin el updateLocalStats ya que es solo para detección)
+            // updateLocalStats(result);
+        }
+    }
+
+    function scheduleNextFrame() {
+        if (!isDetecting) return;
+        const wait = Math.max(0, CAMERA_FRAME_INTERVAL_MS - (performance.now() - frameSentAt));
+        detectionTimer = setTimeout(detectFromVideo, wait);
+    }
+
+    function openCameraSocket() {
+        return new Promise(resolve => {
+            if (!('WebSocket' in window)) return resolve(null);
+            const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+            const socket = new WebSocket(`${protocol}//${window.location.host}/ws/camera`);
+            socket.binaryType = 'arraybuffer';
+            socket.onopen = () => {
+                socket.send(JSON.stringify({
+                    format: 'raw', width: CAMERA_FRAME_SIZE, height: CAMERA_FRAME_SIZE, stream_id: cameraStreamId
+                }));
+                resolve(socket);
+            };
+            socket.onerror = () => resolve(null);   // sin WebSocket → POST binario
+        });
+    }
+
+    async function startDetection() {
         if (isDetecting) return;
         
         isDetecting = true;
-        detectionInterval = setInterval(async () => {
-            if (!currentStream || !cameraVideo.videoWidth) return;
-            
-            try {
-                await detectFromVideo();
-            } catch (error) {
-                console.error('Error en detección:', error);
-            }
-        }, 1000); // Detectar cada segundo
+        cameraStreamId = 'cam_' + Math.random().toString(36).slice(2, 10);
+        cameraSocket = await openCameraSocket();
+        if (cameraSocket) {
+            cameraSocket.onmessage = (event) => {
+                try {
+                    showCameraResult(JSON.parse(event.data));
+                } catch (error) {
+                    console.error('Error en detección en tiempo real:', error);
+                }
+                scheduleNextFrame();
+            };
+            cameraSocket.onclose = () => {
+                // Si se pierde la conexión (o el servidor no tiene sesiones
+                // WebSocket libres y la cierra), se sigue con POST binario
+                cameraSocket = null;
+                scheduleNextFrame();
+            };
+        }
+        detectFromVideo();
     }
     
     async function detectFromVideo() {
-        if (!cameraVideo.videoWidth || !cameraVideo.videoHeight) return;
+        if (!isDetecting) return;
+        if (!currentStream || !cameraVideo.videoWidth || !cameraVideo.videoHeight) {
+            detectionTimer = setTimeout(detectFromVideo, CAMERA_FRAME_INTERVAL_MS);
+            return;
+        }
         
-        const canvas = cameraCanvas;
-        const ctx = canvas.getContext('2d');
+        const frame = grabDownscaledFrame();
+        frameSentAt = performance.now();
         
-        // Capturar frame del video
-        canvas.width = cameraVideo.videoWidth;
-        canvas.height = cameraVideo.videoHeight;
-        ctx.drawImage(cameraVideo, 0, 0);
+        if (cameraSocket && cameraSocket.readyState === WebSocket.OPEN) {
+            cameraSocket.send(frame);   // la respuesta llega por onmessage
+            return;
+        }
         
-        // Convertir a blob
-        canvas.toBlob(async (blob) => {
-            try {
-                const formData = new FormData();
-                formData.append('files', blob, 'camera_frame.jpg');
-                
-                const response = await fetch('/classify/camera', {
-                    method: 'POST',
-                    body: formData
-                });
-                
-                const data = await response.json();
-                
-                if (data.result) {
-                    const result = data.result;
-                    const materialTranslated = i18next.t(`materials.${result.predicted_class}`);
-                    updateLivePrediction(
-                        //`${result.emoji} ${result.display_name}`,
-                        `${result.emoji} ${materialTranslated}`,
-                        `${result.confidence.toFixed(1)}%`,
-                        result.timestamp
-                    );
-                    
-                    // Actualizar estadísticas (sin el updateLocalStats ya que es solo para detección)
-                    // updateLocalStats(result);
-                }
-                
-            } catch (error) {
-                console.error('Error en detección en tiempo real:', error);
-            }
-        }, 'image/jpeg', 0.7); // Menor calidad para mayor velocidad
+        try {
+            const response = await fetch('/classify/camera/raw', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/octet-stream',
+                    'X-Frame-Width': String(CAMERA_FRAME_SIZE),
+                    'X-Frame-Height': String(CAMERA_FRAME_SIZE),
+                    'X-Stream-Id': cameraStreamId
+                },
+                body: frame
+            });
+            showCameraResult(await response.json());
+        } catch (error) {
+            console.error('Error en detección en tiempo real:', error);
+        }
+        scheduleNextFrame();
     }
     
     function capturePhoto() {
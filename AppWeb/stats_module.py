@@ -0,0 +1,193 @@
+import math
+import threading
+import time
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+# --- Estadísticas en streaming ---
+# Los escritores (peticiones /classify y /classify/camera en hilos distintos)
+# actualizan los agregados bajo un lock, en O(1) por muestra: contadores,
+# ventanas circulares y una cubeta del sketch, y marcan los agregados como
+# modificados. La instantánea inmutable (namedtuple) se construye al leer
+# (/api/stats), solo si hubo escrituras desde la última, y se publica con una
+# sola asignación de atributo: sin escrituras nuevas, los lectores no toman
+# el lock y devuelven la instantánea ya publicada.
+
+
+class RingBuffer:
+    """Ventana circular de tamaño fijo con suma acumulada en O(1)."""
+
+    def __init__(self, capacity=100):
+        self.capacity = max(1, int(capacity))
+        self._data = array('d', [0.0]) * self.capacity
+        self._index = 0
+        self._count = 0
+        self._sum = 0.0
+
+    def append(self, value):
+        value = float(value)
+        if self._count == self.capacity:
+            # La ventana está llena: el valor más antiguo sale de la suma
+            self._sum -= self._data[self._index]
+        else:
+            self._count += 1
+        self._data[self._index] = value
+        self._sum += value
+        self._index = (self._index + 1) % self.capacity
+
+    def __len__(self):
+        return self._count
+
+    def mean(self):
+        return self._sum / self._count if self._count else 0.0
+
+
+class QuantileSketch:
+    """Sketch de cuantiles con cubetas logarítmicas (estilo DDSketch).
+
+    Cada valor positivo x cae en la cubeta ceil(log_gamma(x)), con
+    gamma = (1 + a) / (1 - a). El cuantil estimado tiene un error relativo
+    máximo `a` (relative_accuracy) y la memoria crece con el rango dinámico
+    de los valores, no con su número: con a=1% y latencias entre 1 ms y
+    1000 s bastan ~700 cubetas.
+    """
+
+    def __init__(self, relative_accuracy=0.01, min_value=1e-6):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self._buckets = {}
+        self._zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= self.min_value:
+            self._zero_count += 1
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self._buckets[key] = self._buckets.get(key, 0) + 1
+
+    def snapshot(self):
+        """Copia de las cubetas que se puede consultar sin afectar al sketch."""
+        return _SketchSnapshot(self.gamma, self.count, self._zero_count, dict(self._buckets))
+
+
+class _SketchSnapshot:
+    """Estado congelado de un QuantileSketch para calcular cuantiles."""
+
+    def __init__(self, gamma, count, zero_count, buckets):
+        self.gamma = gamma
+        self.count = count
+        self.zero_count = zero_count
+        self.buckets = buckets
+
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q * (self.count - 1)
+        cumulative = self.zero_count
+        if rank < cumulative:
+            return 0.0
+        # Las cubetas solo se ordenan al consultar, no en cada escritura
+        keys = sorted(self.buckets)
+        for key in keys:
+            cumulative += self.buckets[key]
+            if rank < cumulative:
+                break
+        # Punto medio (en error relativo) de la cubeta (gamma^(k-1), gamma^k]
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+
+StatsSnapshot = namedtuple('StatsSnapshot', [
+    'total', 'class_counts', 'avg_confidence', 'avg_processing_time',
+    'day', 'daily_count', 'latency'
+])
+
+
+class StatsCollector:
+    """Agregados de predicciones seguros entre hilos y con lectura sin bloqueo."""
+
+    def __init__(self, window=100, relative_accuracy=0.01):
+        self.window = window
+        self.relative_accuracy = relative_accuracy
+        self._lock = threading.Lock()
+        self._reset_locked()
+
+    def _reset_locked(self):
+        self._total = 0
+        self._class_counts = {}
+        self._confidences = RingBuffer(self.window)     # últimas confianzas registradas
+        self._processing_times = RingBuffer(self.window)  # últimos tiempos de predicción
+        self._latency_sketch = QuantileSketch(self.relative_accuracy)
+        self._start_day_locked()
+        self._publish_locked()
+
+    def _start_day_locked(self):
+        # El día se formatea solo al cambiar; update() compara un timestamp
+        now = datetime.now()
+        self._day = now.strftime('%Y-%m-%d')
+        self._day_ends = datetime.combine(now.date() + timedelta(days=1), datetime.min.time()).timestamp()
+        self._daily_count = 0
+
+    def _publish_locked(self):
+        self._dirty = False
+        # Una única asignación: los lectores ven la instantánea anterior o la nueva, nunca una mezcla
+        self._snapshot = StatsSnapshot(
+            total=self._total,
+            class_counts=dict(self._class_counts),
+            avg_confidence=self._confidences.mean(),
+            avg_processing_time=self._processing_times.mean(),
+            day=self._day,
+            daily_count=self._daily_count,
+            latency=self._latency_sketch.snapshot()
+        )
+
+    def update(self, predicted_class, confidence, processing_time):
+        """Registra una predicción en O(1); la instantánea se reconstruye al leer."""
+        now = time.time()
+        with self._lock:
+            # Verificar si es un nuevo día → reinicia el contador diario
+            if now >= self._day_ends:
+                self._start_day_locked()
+
+            self._total += 1
+            self._class_counts[predicted_class] = self._class_counts.get(predicted_class, 0) + 1
+            self._confidences.append(confidence)
+            self._processing_times.append(processing_time)
+            self._latency_sketch.add(processing_time)
+            self._daily_count += 1
+            self._dirty = True
+
+    def reset(self):
+        with self._lock:
+            self._reset_locked()
+
+    def snapshot(self):
+        """Instantánea de los agregados; solo toma el lock si hubo escrituras desde la última."""
+        if self._dirty:
+            with self._lock:
+                if self._dirty:
+                    self._publish_locked()
+        return self._snapshot
+
+    def summary(self):
+        """Resumen listo para serializar: totales, medias de la ventana y percentiles."""
+        snap = self.snapshot()
+        today = datetime.now().strftime('%Y-%m-%d')
+        most_common = max(snap.class_counts.items(), key=lambda x: x[1]) if snap.class_counts else ('N/A', 0)
+        return {
+            'total': snap.total,
+            'avg_confidence': snap.avg_confidence,
+            'avg_processing_time': snap.avg_processing_time,
+            'most_common': most_common,
+            'daily_count': snap.daily_count if snap.day == today else 0,
+            'class_distribution': snap.class_counts,
+            'latency_percentiles': {
+                'p50': snap.latency.quantile(0.50),
+                'p95': snap.latency.quantile(0.95),
+                'p99': snap.latency.quantile(0.99)
+            }
+        }
@@ -0,0 +1,370 @@
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+# Bloqueo entre procesos para elegir un único proceso que barre (no existe en Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class BackgroundWriter:
+    """Escribe archivos en disco desde un hilo de fondo."""
+    # Las peticiones entregan los bytes ya recibidos y siguen con la inferencia
+    # sin esperar al disco. Quien necesite leer el archivo después (por ejemplo
+    # /uploads/<filename> o Grad-CAM) debe llamar antes a wait(path).
+    # Con varios workers la escritura puede estar en la cola de otro proceso:
+    # si no está pendiente en este, wait() sondea el disco hasta que aparece el
+    # archivo, como mucho missing_wait segundos.
+
+    def __init__(self, name='background-writer', retries=3, missing_wait=5.0):
+        self.name = name
+        self.retries = retries
+        self.missing_wait = missing_wait
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = {}   # ruta -> threading.Event
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        """Arranca el hilo de fondo (también tras un fork del proceso)."""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+            self._thread.start()
+
+    def submit(self, path, data):
+        """Encola la escritura de `data` (bytes) en `path`."""
+        self._ensure_started()
+        with self._lock:
+            event = self._pending.get(path)
+            if event is None:
+                event = threading.Event()
+                self._pending[path] = event
+        self._queue.put((path, data, event))
+
+    def wait(self, path, timeout=30):
+        """Espera a que `path` esté escrito; devuelve False si no aparece a tiempo."""
+        with self._lock:
+            event = self._pending.get(path)
+        if event is not None:
+            return event.wait(timeout)
+        return self._poll(path, min(timeout, self.missing_wait))
+
+    def _poll(self, path, timeout):
+        """Espera a que exista `path` (escrito por otro proceso) con reintentos crecientes."""
+        deadline = time.monotonic() + timeout
+        delay = 0.01
+        while not os.path.exists(path):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.25)
+        return True
+
+    def pending_count(self):
+        """Número de escrituras aún no completadas."""
+        with self._lock:
+            return len(self._pending)
+
+    def _write(self, path, data):
+        # Se escribe en un temporal y se renombra para que nadie lea un archivo a medias
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _worker(self):
+        while True:
+            path, data, event = self._queue.get()
+            for attempt in range(self.retries):
+                try:
+                    self._write(path, data)
+                    break
+                except Exception as e:
+                    print(f"Error guardando {path} (intento {attempt + 1}/{self.retries}): {e}")
+
+            with self._lock:
+                if self._pending.get(path) is event:
+                    del self._pending[path]
+            event.set()
+
+
+class StorageManager:
+    """Subcarpetas por petición con retención por antigüedad, tamaño total y LRU."""
+    # Cada petición de /classify guarda sus archivos en una subcarpeta propia
+    # (<raíz>/<unidad>/...) en todas las raíces gestionadas (uploads y
+    # gradcam_outputs), de modo que una subida no borra las imágenes de otra.
+    # La unidad de retención es la subcarpeta: el índice en memoria registra
+    # sus bytes y su último acceso, y un hilo de fondo expulsa las unidades que
+    # superan la antigüedad máxima y, después, las menos usadas recientemente
+    # hasta respetar la cuota total. Los archivos ocultos (p. ej. .gitkeep) no
+    # se tocan.
+    #
+    # Con varios procesos (workers de gunicorn o uvicorn) solo expulsa uno: el
+    # que consigue el bloqueo exclusivo del archivo <primera raíz>/.storage.lock
+    # (con preload_app es el proceso maestro). Ese proceso vuelve a recorrer el
+    # disco en cada barrido, así que la cuota se aplica al total real de todos
+    # los workers y cuenta una sola vez lo que quedó de ejecuciones anteriores.
+    # El resto de procesos solo mantienen su índice y, al crear o servir una
+    # unidad, actualizan la fecha de modificación de su carpeta (como mucho una
+    # vez por touch_interval) para que el proceso que barre vea ese acceso. Si
+    # el proceso que barre termina, el sistema libera el bloqueo y lo toma otro.
+    # Sin fcntl (Windows) cada proceso barre por su cuenta.
+
+    def __init__(self, roots, max_age_seconds=24 * 3600, max_total_mb=1024, sweep_interval=60,
+                 name='storage-sweeper', lock_path=None, touch_interval=60):
+        self.roots = list(roots)
+        self.max_age_seconds = max_age_seconds
+        self.max_total_bytes = int(max_total_mb * 1024 * 1024)
+        self.sweep_interval = sweep_interval
+        self.name = name
+        self.lock_path = lock_path or os.path.join(self.roots[0], '.storage.lock')
+        self.touch_interval = touch_interval
+
+        self._lock = threading.Lock()
+        self._units = OrderedDict()   # unidad -> [bytes, último acceso, último touch en disco]; orden LRU
+        self._total_bytes = 0
+        self._thread = None
+        self._pid = None
+        self._lock_file = None
+        self._lock_pid = None
+        self._wake = threading.Event()
+        self.evicted_units = 0
+
+        # Un fork con el hilo de barrido dentro de la sección crítica dejaría
+        # el candado copiado como adquirido en el hijo
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def _ensure_started(self):
+        """Arranca el hilo de barrido (también tras un fork del proceso)."""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+            self._thread.start()
+
+    def start(self):
+        """Arranca el barrido (indexa lo que haya en disco) sin esperar a la primera petición."""
+        self._ensure_started()
+
+    @staticmethod
+    def unit_of(relative_path):
+        """Unidad de retención (primer componente) de una ruta relativa a una raíz."""
+        return relative_path.replace('\\', '/').split('/', 1)[0]
+
+    def new_unit(self):
+        """Crea (solo en el índice) la subcarpeta de una nueva petición y devuelve su nombre."""
+        unit = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.record(unit)
+        return unit
+
+    def record(self, relative_path, added_bytes=0):
+        """Marca la unidad de `relative_path` como usada ahora y suma los bytes escritos.
+
+        Si la unidad no estaba en el índice (por ejemplo, la creó otro worker
+        o una ejecución anterior) se añade con el acceso actual.
+        """
+        unit = self.unit_of(relative_path)
+        if not self._valid_unit(unit):
+            return
+        self._ensure_started()
+        now = time.time()
+        with self._lock:
+            entry = self._units.get(unit)
+            if entry is None:
+                entry = self._units[unit] = [0, now, 0.0]
+            else:
+                self._units.move_to_end(unit)
+                entry[1] = now
+            entry[0] += added_bytes
+            self._total_bytes += added_bytes
+            over_quota = self._total_bytes > self.max_total_bytes
+            touch = now - entry[2] >= self.touch_interval
+            if touch:
+                entry[2] = now
+        if touch:
+            self._touch(unit)
+        if over_quota:
+            self._wake.set()
+
+    def _touch(self, unit):
+        # El acceso queda en el disco para el proceso que barre
+        for root in self.roots:
+            try:
+                os.utime(os.path.join(root, unit))
+            except OSError:
+                pass   # la carpeta aún no existe en esta raíz
+
+    @staticmethod
+    def _valid_unit(unit):
+        # Nunca rutas relativas hacia arriba ni archivos ocultos (.gitkeep)
+        return bool(unit) and not unit.startswith('.')
+
+    def clear(self):
+        """Elimina todas las unidades de todas las raíces (limpieza manual)."""
+        self._ensure_started()
+        with self._lock:
+            units = list(self._units)
+            self._units.clear()
+            self._total_bytes = 0
+        for root in self.roots:
+            try:
+                units += [name for name in os.listdir(root) if not name.startswith('.')]
+            except OSError:
+                pass
+        for unit in set(units):
+            self._remove(unit)
+
+    def is_sweeper(self):
+        """True si este proceso es el que aplica la retención."""
+        return fcntl is None or (self._lock_file is not None and self._lock_pid == os.getpid())
+
+    def get_stats(self):
+        # En los procesos que no barren, el índice solo cubre las unidades que
+        # ese proceso ha creado o servido
+        with self._lock:
+            return {
+                'units': len(self._units),
+                'total_mb': round(self._total_bytes / (1024 * 1024), 2),
+                'max_total_mb': round(self.max_total_bytes / (1024 * 1024), 2),
+                'max_age_hours': round(self.max_age_seconds / 3600, 2),
+                'evicted_units': self.evicted_units,
+                'sweeper': self.is_sweeper()
+            }
+
+    # --- Hilo de barrido ---
+    def _acquire_sweeper_lock(self):
+        """Intenta ser el único proceso que expulsa unidades; True si lo es."""
+        if self.is_sweeper():
+            return True
+        try:
+            os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+            lock_file = open(self.lock_path, 'a')
+        except OSError as e:
+            print(f"Error abriendo {self.lock_path}: {e}")
+            return False
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()   # otro proceso ya barre
+            return False
+        self._lock_file, self._lock_pid = lock_file, os.getpid()
+        print(f"Proceso {os.getpid()} aplica la retención de almacenamiento")
+        return True
+
+    def _remove(self, unit):
+        if not self._valid_unit(unit):
+            return
+        for root in self.roots:
+            path = os.path.join(root, unit)
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.unlink(path)
+            except OSError as e:
+                print(f"Error eliminando {path}: {e}")
+
+    def _scan_disk(self):
+        """Bytes y último acceso de cada unidad en disco, sumando todas las raíces."""
+        found = {}
+        for root in self.roots:
+            try:
+                names = os.listdir(root)
+            except OSError:
+                continue
+            for name in names:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    # La fecha de la carpeta recoge los accesos que marcan los demás procesos
+                    last_access = os.stat(path).st_mtime
+                except OSError:
+                    continue
+                if os.path.isdir(path):
+                    files = [os.path.join(d, f) for d, _, filenames in os.walk(path) for f in filenames]
+                else:
+                    files = [path]
+                size = 0
+                for file_path in files:
+                    try:
+                        stat = os.stat(file_path)
+                    except OSError:
+                        continue
+                    size += stat.st_size
+                    last_access = max(last_access, stat.st_mtime)
+                previous = found.get(name, (0, 0.0))
+                found[name] = (previous[0] + size, max(previous[1], last_access))
+        return found
+
+    def _index_disk(self):
+        """Rehace el índice con lo que hay en disco, conservando los accesos conocidos."""
+        found = self._scan_disk()
+        with self._lock:
+            merged = {}
+            for unit, (size, last_access) in found.items():
+                entry = self._units.get(unit)
+                touched = entry[2] if entry else 0.0
+                merged[unit] = [size, max(last_access, entry[1]) if entry else last_access, touched]
+            # Unidades recién creadas cuyos archivos aún no se han escrito
+            for unit, entry in self._units.items():
+                merged.setdefault(unit, entry)
+            self._units = OrderedDict(sorted(merged.items(), key=lambda item: item[1][1]))
+            self._total_bytes = sum(entry[0] for entry in self._units.values())
+
+    def sweep(self):
+        """Expulsa las unidades caducadas y, si se supera la cuota, las menos usadas recientemente."""
+        cutoff = time.time() - self.max_age_seconds
+        evicted = []
+        with self._lock:
+            for unit, (size, last_access, _) in list(self._units.items()):
+                if last_access < cutoff:
+                    del self._units[unit]
+                    self._total_bytes -= size
+                    evicted.append(unit)
+            while self._total_bytes > self.max_total_bytes and len(self._units) > 1:
+                unit, (size, _, _) = self._units.popitem(last=False)
+                self._total_bytes -= size
+                evicted.append(unit)
+            self.evicted_units += len(evicted)
+
+        for unit in evicted:
+            self._remove(unit)
+        if evicted:
+            print(f"Retención de almacenamiento: {len(evicted)} carpetas eliminadas")
+        return evicted
+
+    def _worker(self):
+        while True:
+            try:
+                if self._acquire_sweeper_lock():
+                    self._index_disk()
+                    self.sweep()
+            except Exception as e:
+                print(f"Error en el barrido de almacenamiento: {e}")
+            self._wake.wait(self.sweep_interval)
+            self._wake.clear()
@@ -0,0 +1,138 @@
+import threading
+import time
+
+import numpy as np
+import torch.nn.functional as F
+
+from ingest_module import FrameDiffFilter
+from preprocessing_module import _MEAN, _STD
+
+# --- Estado temporal por stream de cámara ---
+# En una cinta transportadora los frames consecutivos son casi idénticos.
+# Para cada stream (identificado por el cliente) se guarda:
+#   - la miniatura del último frame inferido: si el frame nuevo apenas
+#     difiere, se reutiliza el resultado anterior sin forward pass;
+#   - una media móvil exponencial (EMA) de las salidas sigmoid, sobre la que
+#     se elige predicted_class, para que la etiqueta mostrada no parpadee.
+#     La EMA avanza en todos los frames, también en los reutilizados (con
+#     las últimas probabilidades inferidas): tras un cambio de escena la
+#     etiqueta cambia en pocos frames aunque solo se infiera el primero.
+# Los streams sin actividad durante ttl_seconds se descartan.
+
+
+class TensorDiffFilter(FrameDiffFilter):
+    """FrameDiffFilter sobre tensores ya normalizados (3 x H x W) en lugar de frames BGR."""
+
+    def thumbnail(self, tensor):
+        # Se deshace la normalización para que el umbral esté en la misma escala 0-255
+        gray = ((tensor * _STD + _MEAN).mean(dim=0, keepdim=True) * 255).unsqueeze(0)
+        return F.adaptive_avg_pool2d(gray, self.size)[0, 0].numpy().astype(np.int16)
+
+
+class StreamState:
+    """Reutilización por cambio de escena y suavizado EMA de un stream de cámara."""
+
+    def __init__(self, diff_threshold=3.0, ema_alpha=0.3, max_reuse_frames=30):
+        self.diff_filter = TensorDiffFilter(diff_threshold)
+        self.ema_alpha = ema_alpha              # peso del frame nuevo (1 = sin suavizado)
+        self.max_reuse_frames = max_reuse_frames  # fuerza una inferencia cada N frames reutilizados
+        self.lock = threading.Lock()            # los frames de un mismo stream se procesan en orden
+        self.smoothed = None
+        self.probs = None                       # últimas probabilidades inferidas (sin suavizar)
+        self.model_name = None                  # versión del modelo que produjo `smoothed`
+        self.reused_in_a_row = 0
+        self.last_seen = time.monotonic()
+        self.frames = 0
+        self.inferred = 0
+
+    def process(self, img_t, infer, model_name=None):
+        """Probabilidades suavizadas del frame y si se reutilizó el resultado anterior.
+
+        infer(img_t) debe devolver las probabilidades sigmoid del frame. Si
+        model_name cambia (nueva versión del modelo), no se reutiliza ni se
+        mezcla nada de la versión anterior.
+        """
+        with self.lock:
+            self.last_seen = time.monotonic()
+            self.frames += 1
+            if model_name != self.model_name:
+                self.smoothed = self.probs = None
+                self.model_name = model_name
+            can_reuse = self.smoothed is not None and self.reused_in_a_row < self.max_reuse_frames
+            if can_reuse and self.diff_filter.is_duplicate(img_t):
+                self.reused_in_a_row += 1
+                self.smoothed = self._ema(self.probs)
+                return self.smoothed, True
+
+            if not can_reuse:
+                # Inferencia forzada: el frame pasa a ser la nueva referencia
+                self.diff_filter.reset()
+                self.diff_filter.is_duplicate(img_t)
+            self.probs = np.asarray(infer(img_t), dtype=np.float32)
+            self.smoothed = self._ema(self.probs)
+            self.reused_in_a_row = 0
+            self.inferred += 1
+            return self.smoothed, False
+
+    def _ema(self, probs):
+        if self.smoothed is None:
+            return probs
+        return self.ema_alpha * probs + (1 - self.ema_alpha) * self.smoothed
+
+
+class TemporalTracker:
+    """Estados por stream_id con expiración por inactividad."""
+
+    def __init__(self, diff_threshold=3.0, ema_alpha=0.3, max_reuse_frames=30, ttl_seconds=300, max_streams=256):
+        self.diff_threshold = diff_threshold
+        self.ema_alpha = ema_alpha
+        self.max_reuse_frames = max_reuse_frames
+        self.ttl_seconds = ttl_seconds
+        self.max_streams = max_streams
+        self._lock = threading.Lock()
+        self._states = {}
+        self._frames = 0      # acumulados de los streams ya descartados
+        self._inferred = 0
+
+    def get(self, stream_id):
+        """Estado del stream, creándolo si no existe."""
+        with self._lock:
+            state = self._states.get(stream_id)
+            if state is None:
+                self._expire_locked()
+                state = self._states[stream_id] = StreamState(
+                    self.diff_threshold, self.ema_alpha, self.max_reuse_frames)
+            return state
+
+    def discard(self, stream_id):
+        with self._lock:
+            state = self._states.pop(stream_id, None)
+            if state is not None:
+                self._frames += state.frames
+                self._inferred += state.inferred
+
+    def _expire_locked(self):
+        now = time.monotonic()
+        expired = [sid for sid, st in self._states.items() if now - st.last_seen > self.ttl_seconds]
+        if len(self._states) - len(expired) >= self.max_streams:
+            # Sin hueco: se descarta también el stream menos reciente
+            oldest = min((sid for sid in self._states if sid not in expired),
+                         key=lambda sid: self._states[sid].last_seen)
+            expired.append(oldest)
+        for sid in expired:
+            state = self._states.pop(sid)
+            self._frames += state.frames
+            self._inferred += state.inferred
+
+    def get_stats(self):
+        with self._lock:
+            states = list(self._states.values())
+            frames = self._frames + sum(st.frames for st in states)
+            inferred = self._inferred + sum(st.inferred for st in states)
+        return {
+            'active_streams': len(states),
+            'frames': frames,
+            'inferred': inferred,
+            'reused': frames - inferred,
+            'reuse_ratio': round((frames - inferred) / frames, 3) if frames else 0.0
+        }
@@ -0,0 +1,143 @@
+import io
+import math
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision.transforms import functional as TF
+
+from preprocessing_module import INPUT_SIZE, NORMALIZE_MEAN, NORMALIZE_STD, decode_image, preprocess
+
+# --- Inferencia por teselas (multi-crop) ---
+# En fotos de obra de alta resolución, Resize((224, 224)) aplasta la imagen
+# entera y se pierde el detalle de las pilas de materiales mezclados. En este
+# modo la imagen se reescala a una resolución de trabajo, se corta en teselas
+# de 224 px que se solapan y se clasifica cada tesela, además de la vista
+# completa habitual (y, opcionalmente, las versiones volteadas de todas).
+# Todas las vistas van en un único forward pass y las salidas sigmoid se
+# agregan por máximo (la clase está en alguna zona) o por media.
+#
+# El presupuesto max_views acota el número total de entradas del lote: la
+# resolución de trabajo se elige como la mayor (sin ampliar la original)
+# cuya rejilla de teselas cabe en el presupuesto, así que la latencia no
+# depende del tamaño de la foto.
+
+AGGREGATIONS = ('max', 'mean')
+
+
+def _tiles_along(length, tile_size, stride):
+    """Número de teselas necesarias para cubrir `length` píxeles con el paso dado."""
+    if length <= tile_size:
+        return 1
+    return math.ceil((length - tile_size) / stride - 1e-6) + 1
+
+
+def _positions(length, tile_size, count):
+    """Origen de cada tesela, repartidas uniformemente de borde a borde."""
+    if count == 1:
+        return [max(0, (length - tile_size) // 2)]
+    return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+
+def min_views_for_tiles(flips=False):
+    """Presupuesto mínimo de vistas con el que plan_tiles puede usar teselas (al menos 2 + la vista completa)."""
+    return 3 * (2 if flips else 1)
+
+
+def plan_tiles(width, height, tile_size=INPUT_SIZE, overlap=0.25, max_views=16, flips=False):
+    """Escala de trabajo y rejilla de teselas de una imagen de width x height.
+
+    Devuelve (escala, columnas, filas). Con 0 teselas (imagen menor que una
+    tesela o presupuesto insuficiente) solo se usa la vista completa.
+    """
+    views_per_crop = 2 if flips else 1
+    max_tiles = max_views // views_per_crop - 1   # una vista es la imagen completa
+    min_scale = tile_size / min(width, height)    # el lado corto ocupa una tesela
+    if max_views < min_views_for_tiles(flips) or min_scale >= 1.0:
+        return 1.0, 0, 0
+
+    stride = tile_size * (1 - min(max(overlap, 0.0), 0.9))
+    # Escalas candidatas: la original y aquellas en las que un lado cubre
+    # exactamente n teselas; se elige la mayor cuya rejilla cabe en el presupuesto
+    candidates = {1.0, min_scale}
+    for n in range(1, max_tiles + 1):
+        covered = tile_size + (n - 1) * stride
+        candidates.update((covered / width, covered / height))
+
+    for scale in sorted((s for s in candidates if min_scale <= s <= 1.0), reverse=True):
+        work_width, work_height = max(tile_size, round(width * scale)), max(tile_size, round(height * scale))
+        cols, rows = _tiles_along(work_width, tile_size, stride), _tiles_along(work_height, tile_size, stride)
+        if cols * rows <= max_tiles:
+            return scale, cols, rows
+    return 1.0, 0, 0
+
+
+def build_views(image, tile_size=INPUT_SIZE, overlap=0.25, max_views=16, flips=False):
+    """Lote de vistas (imagen completa + teselas [+ volteos]) y el plan para agregarlas.
+
+    `image` puede ser una ruta, bytes o una imagen PIL sin decodificar todavía:
+    con JPEG, la decodificación se reduce directamente a la resolución de trabajo.
+    """
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image))
+    elif not isinstance(image, Image.Image):
+        if not os.path.exists(image):
+            raise FileNotFoundError(f"No se encontró la imagen: {image}")
+        image = Image.open(image)   # solo lee la cabecera; se decodifica más abajo
+    width, height = image.size
+    scale, cols, rows = plan_tiles(width, height, tile_size, overlap, max_views, flips)
+    work_size = (max(tile_size, round(width * scale)), max(tile_size, round(height * scale)))
+
+    decoded = decode_image(image, draft_size=work_size if cols else (tile_size, tile_size))
+    views = [preprocess(decoded)]   # vista completa, igual que en el modo normal
+    boxes = []
+    if cols:
+        if decoded.size != work_size:
+            decoded = decoded.resize(work_size, Image.BILINEAR)
+        work = TF.normalize(TF.to_tensor(decoded), NORMALIZE_MEAN, NORMALIZE_STD)
+        # Factores para llevar las cajas a coordenadas de la imagen original
+        fx, fy = width / work_size[0], height / work_size[1]
+        for y in _positions(work_size[1], tile_size, rows):
+            for x in _positions(work_size[0], tile_size, cols):
+                views.append(work[:, y:y + tile_size, x:x + tile_size])
+                boxes.append([round(x * fx), round(y * fy),
+                              min(width, round((x + tile_size) * fx)), min(height, round((y + tile_size) * fy))])
+
+    batch = torch.stack(views)
+    if flips:
+        batch = torch.cat([batch, batch.flip(3)])
+    plan = {'width': width, 'height': height, 'scale': round(scale, 4), 'rows': rows, 'cols': cols,
+            'boxes': boxes, 'flips': bool(flips)}
+    return batch, plan
+
+
+def aggregate(view_probs, plan, class_names, aggregation='max'):
+    """Agrega las salidas de las vistas y construye el mapa de clases por tesela.
+
+    Devuelve (probabilidades agregadas, mapa), con el mapa como
+    {'rows', 'cols', 'grid': [[clase por tesela]], 'tiles': [...]}.
+    """
+    probs = np.asarray(view_probs, dtype=np.float32)
+    views = 1 + len(plan['boxes'])
+    if plan['flips']:
+        # Cada vista se promedia con su versión volteada
+        probs = (probs[:views] + probs[views:2 * views]) / 2
+    combined = probs.max(axis=0) if aggregation == 'max' else probs.mean(axis=0)
+
+    tiles = []
+    for i, box in enumerate(plan['boxes']):
+        tile_probs = probs[1 + i]
+        index = int(tile_probs.argmax())
+        tiles.append({
+            'row': i // plan['cols'],
+            'col': i % plan['cols'],
+            'box': box,
+            'predicted_class': class_names[index],
+            'confidence': round(float(tile_probs[index]) * 100, 1)
+        })
+    grid = [[tile['predicted_class'] for tile in tiles[r * plan['cols']:(r + 1) * plan['cols']]]
+            for r in range(plan['rows'])]
+    tile_map = {'rows': plan['rows'], 'cols': plan['cols'], 'scale': plan['scale'],
+                'views': len(view_probs), 'aggregation': aggregation, 'grid': grid, 'tiles': tiles}
+    return combined, tile_map